@@ -0,0 +1,859 @@
+"""Assignment 2: Benchmarks for Treemap
+
+=== CSC148 Winter 2019 ===
+
+=== Module Description ===
+This module contains benchmarks for the treemap code. Each benchmark function
+returns a dictionary mapping the name of a measured variant to its result
+(a best time in seconds, or a number of bytes), so the variants can be
+compared side by side.
+
+The synthetic trees come in four seeded shapes: balanced, wide (every node
+a child of the root), deep (a long chain with the leaves hung along it) and
+zipf (random parents, with leaf sizes following Zipf's law).
+
+Run this module directly to run the benchmarks and write their results as
+JSON, to compare runs; see --help for the options. For example:
+    python benchmarks.py --groups trees --sizes 1000 1000000 --output a.json
+"""
+import argparse
+import csv
+import heapq
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from array import array
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import pygame
+import papers
+from tm_trees import TMTree, FileSystemTree
+from papers import PaperTree
+from compact_tree import CompactTree
+from snapshots import load_file_system_tree
+from change_tracker import ChangeTracker
+from indexes import TopLeavesIndex, ExtensionIndex
+from treemap_visualiser import MIN_RECT_PIXELS, WIDTH, HEIGHT, \
+    TREEMAP_HEIGHT, TreemapRenderer
+from layouts import SliceAndDiceLayout, SquarifiedLayout, VectorisedLayout, \
+    VisibleLayout, vectorised_layout
+
+# The rectangle used to lay out trees in the benchmarks.
+_RECT = (0, 0, WIDTH, TREEMAP_HEIGHT)
+# The length of the chain of a deep synthetic tree, well over Python's
+# recursion limit, since TMTree walks its trees with explicit stacks.
+_DEEP_TREE_DEPTH = 5000
+# The number of calls timed together by benchmarks of quick operations.
+_BATCH = 100
+
+
+class _SyntheticTree(TMTree):
+    """A tree built in memory for the benchmarks, without reading any data.
+    """
+
+    def get_separator(self) -> str:
+        """Return the string used to separate names in a path string.
+        """
+        return '/'
+
+    def get_suffix(self) -> str:
+        """Return the string used at the end of a path string.
+        """
+        return ''
+
+
+def _balanced_tree(n: int, fanout: int = 8, seed: int = 0) -> TMTree:
+    """Return a tree of <n> nodes in which node i is the parent of nodes
+    <fanout> * i + 1 to <fanout> * i + <fanout>, and each leaf has a random
+    size chosen with <seed>.
+    """
+    rng = random.Random(seed)
+    nodes = [None] * n
+    for i in range(n - 1, -1, -1):
+        first = fanout * i + 1
+        nodes[i] = _SyntheticTree(str(i), nodes[first:first + fanout],
+                                  rng.randint(1, 1000))
+    return nodes[0]
+
+
+def _wide_tree(n: int, seed: int = 0) -> TMTree:
+    """Return a tree of <n> nodes in which every node but the root is a leaf
+    of the root, with a random size chosen with <seed>.
+    """
+    rng = random.Random(seed)
+    return _tree_from_parents([-1] + [0] * (n - 1),
+                              [rng.randint(1, 1000) for _ in range(n)])
+
+
+def _deep_tree(n: int, seed: int = 0) -> TMTree:
+    """Return a tree of <n> nodes made of a chain of _DEEP_TREE_DEPTH nodes,
+    with the other nodes spread as leaves along it, each with a random size
+    chosen with <seed>.
+    """
+    rng = random.Random(seed)
+    depth = min(n, _DEEP_TREE_DEPTH)
+    parents = list(range(-1, depth - 1)) + \
+        [i % depth for i in range(n - depth)]
+    return _tree_from_parents(parents,
+                              [rng.randint(1, 1000) for _ in range(n)])
+
+
+def _zipf_tree(n: int, seed: int = 0) -> TMTree:
+    """Return a tree of <n> nodes in which the parent of each node is chosen
+    at random among the nodes before it, and the sizes of the leaves follow
+    Zipf's law: the k-th largest is about 1/k of the largest. The choices are
+    made with <seed>.
+    """
+    rng = random.Random(seed)
+    ranks = list(range(1, n + 1))
+    rng.shuffle(ranks)
+    return _tree_from_parents([-1] + [rng.randrange(i) for i in range(1, n)],
+                              [max(1, 10 ** 6 // rank) for rank in ranks])
+
+
+def _tree_from_parents(parents: List[int], sizes: List[int]) -> TMTree:
+    """Return a tree in which node i is a child of node <parents>[i] and, if
+    it is a leaf, has size <sizes>[i]. The children of each node are in
+    order.
+
+    Precondition: parents[0] == -1 and 0 <= parents[i] < i for every other i.
+    """
+    children = [[] for _ in parents]
+    for i in range(1, len(parents)):
+        children[parents[i]].append(i)
+    nodes = [None] * len(parents)
+    for i in range(len(parents) - 1, -1, -1):
+        nodes[i] = _SyntheticTree(str(i), [nodes[j] for j in children[i]],
+                                  sizes[i])
+        children[i] = None
+    return nodes[0]
+
+
+# The generators of the synthetic trees, keyed by the name of their shape.
+_TREE_SHAPES = {
+    'balanced': lambda n, seed: _balanced_tree(n, seed=seed),
+    'wide': _wide_tree,
+    'deep': _deep_tree,
+    'zipf': _zipf_tree
+}
+
+
+def _mark_dirty(tree: TMTree) -> None:
+    """Mark every tree in <tree> as changed since it was last laid out, so
+    that the next layout recomputes all of its rectangles.
+    """
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        node._dirty = True
+        stack.extend(node._subtrees)
+
+
+def _best_time(function: Callable[[], object], repeat: int,
+               setup: Optional[Callable[[], object]] = None) -> float:
+    """Return the smallest wall-clock time, in seconds, taken by calling
+    <function> <repeat> times.
+
+    If <setup> is given, call it before each call to <function>, without
+    timing it.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _retained_memory(function: Callable[[], object]) -> int:
+    """Return the number of bytes still allocated by calling <function>
+    while its return value is kept alive.
+    """
+    tracemalloc.start()
+    try:
+        result = function()
+        retained = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return retained
+
+
+def _same_tree(tree1: TMTree, tree2: TMTree) -> bool:
+    """Return True iff <tree1> and <tree2> have the same names, data sizes and
+    shape.
+    """
+    stack = [(tree1, tree2)]
+    while stack:
+        node1, node2 = stack.pop()
+        if node1._name != node2._name or \
+                node1.data_size != node2.data_size or \
+                len(node1._subtrees) != len(node2._subtrees):
+            return False
+        stack.extend(zip(node1._subtrees, node2._subtrees))
+    return True
+
+
+def _same_contents(tree1: TMTree, tree2: TMTree) -> bool:
+    """Return True iff <tree1> and <tree2> have the same names and data
+    sizes, whatever the order of their subtrees.
+    """
+    stack = [(tree1, tree2)]
+    while stack:
+        node1, node2 = stack.pop()
+        if node1._name != node2._name or \
+                node1.data_size != node2.data_size or \
+                len(node1._subtrees) != len(node2._subtrees):
+            return False
+        stack.extend(zip(sorted(node1._subtrees, key=lambda t: t._name),
+                         sorted(node2._subtrees, key=lambda t: t._name)))
+    return True
+
+
+def benchmark_scan(path: str, workers: int = 8,
+                   repeat: int = 3) -> Dict[str, float]:
+    """Return the best times for building a FileSystemTree of the folder at
+    <path> one folder at a time, on a pool of <workers> threads and of
+    <workers> processes, and in lazy mode: until only the top folder is
+    loaded, and until the sizes of all of its subfolders are added up in the
+    background too.
+
+    Raise a ValueError if the pools do not build the same tree as the serial
+    scan.
+    """
+    expected = FileSystemTree(path)
+    for use_processes in (False, True):
+        if not _same_tree(expected,
+                          FileSystemTree(path, workers, use_processes)):
+            raise ValueError('pool built a different tree for ' + path)
+
+    return {
+        'serial': _best_time(lambda: FileSystemTree(path), repeat),
+        'threads': _best_time(lambda: FileSystemTree(path, workers), repeat),
+        'processes': _best_time(lambda: FileSystemTree(path, workers, True),
+                                repeat),
+        'lazy': _best_time(lambda: FileSystemTree(path, lazy=True), repeat),
+        'lazy, sized': _best_time(
+            lambda: FileSystemTree(path, lazy=True).load_folder_sizes(True),
+            repeat)
+    }
+
+
+def benchmark_memory(path: str) -> Dict[str, int]:
+    """Return the number of bytes used to hold the file tree of the folder at
+    <path> as a graph of FileSystemTree objects, and as a CompactTree.
+    """
+    return {
+        'objects': _retained_memory(lambda: FileSystemTree(path)),
+        'compact': _retained_memory(lambda: CompactTree.from_file_system(path))
+    }
+
+
+def benchmark_snapshot(path: str, repeat: int = 3) -> Dict[str, float]:
+    """Return the best times for building a FileSystemTree of the folder at
+    <path> by listing every folder, and from an up-to-date snapshot.
+
+    Raise a ValueError if the snapshot does not give the same tree as the
+    full scan.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        snapshot_path = os.path.join(folder, 'snapshot')
+        load_file_system_tree(path, snapshot_path)
+        if not _same_tree(FileSystemTree(path),
+                          load_file_system_tree(path, snapshot_path)):
+            raise ValueError('snapshot gave a different tree for ' + path)
+        return {
+            'full scan': _best_time(lambda: FileSystemTree(path), repeat),
+            'snapshot': _best_time(
+                lambda: load_file_system_tree(path, snapshot_path), repeat)
+        }
+
+
+def benchmark_layout(sizes: Sequence[int] = (10 ** 5, 10 ** 6),
+                     repeat: int = 3) -> Dict[str, float]:
+    """Return the best times for a full layout of a balanced synthetic tree
+    of each of the given <sizes> with TMTree.update_rectangles and with
+    vectorised_layout.
+
+    Raise a ValueError if the two engines give different rectangles.
+    """
+    results = {}
+    for n in sizes:
+        tree = _balanced_tree(n)
+        vectorised_layout(tree, _RECT)
+        expected = _get_all_rects(tree)
+        _mark_dirty(tree)
+        tree.update_rectangles(_RECT)
+        if _get_all_rects(tree) != expected:
+            raise ValueError('layout engines disagree on {} nodes'.format(n))
+
+        results['recursive {}'.format(n)] = _best_time(
+            lambda: tree.update_rectangles(_RECT), repeat,
+            lambda: _mark_dirty(tree))
+        results['vectorised {}'.format(n)] = _best_time(
+            lambda: vectorised_layout(tree, _RECT), repeat)
+    return results
+
+
+def benchmark_layout_strategies(n: int = 10 ** 5, repeat: int = 3) \
+        -> Dict[str, Tuple[float, float]]:
+    """Return, for each layout strategy, the best time for a full layout of a
+    balanced synthetic tree of <n> nodes and the mean aspect ratio of the
+    rectangles of its leaves.
+    """
+    tree = _balanced_tree(n)
+    strategies = {
+        'slice-and-dice': SliceAndDiceLayout(),
+        'vectorised': VectorisedLayout(),
+        'squarified': SquarifiedLayout()
+    }
+    results = {}
+    for name, strategy in strategies.items():
+        seconds = _best_time(lambda: strategy.layout(tree, _RECT), repeat,
+                             lambda: _mark_dirty(tree))
+        results[name] = (seconds, _mean_aspect_ratio(tree))
+    return results
+
+
+def benchmark_rectangles(n: int = 10 ** 6, repeat: int = 3) \
+        -> Dict[str, float]:
+    """Return the best times for collecting the rectangles of every leaf of a
+    balanced synthetic tree of <n> nodes, as a list with
+    TMTree.get_rectangles and into a reused buffer with
+    TMTree.fill_rectangles.
+    """
+    tree = _balanced_tree(n)
+    tree.expand_all()
+    tree.update_rectangles(_RECT)
+    buffer = array('i')
+    return {
+        'list': _best_time(lambda: tree.get_rectangles(), repeat),
+        'buffer': _best_time(lambda: tree.fill_rectangles(buffer), repeat)
+    }
+
+
+def benchmark_trees(sizes: Sequence[int] = (10 ** 3, 10 ** 4, 10 ** 5),
+                    shapes: Sequence[str] = tuple(_TREE_SHAPES),
+                    repeat: int = 3, seed: int = 0) \
+        -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Return, for each of the synthetic tree <shapes> and each of the given
+    <sizes>, the best times for the operations of the visualiser on a tree of
+    that shape and size, generated with <seed>.
+
+    The operations are building the tree, a full layout with
+    TMTree.update_rectangles, a layout of the displayed-tree alone with a
+    VisibleLayout, collecting its rectangles with
+    TMTree.get_rectangles, a hover hit-test with TMTree.get_tree_at_position,
+    resizing a leaf and laying the tree out again, and rendering a frame
+    with a TreemapRenderer, both in full and with only the hover outline
+    moved. The times of the last four are per call, averaged over a batch of
+    _BATCH calls.
+    """
+    screen = _get_headless_screen()
+    results = {}
+    for shape in shapes:
+        generate = _TREE_SHAPES[shape]
+        results[shape] = {}
+        for n in sizes:
+            tree = generate(n, seed)
+            tree.expand_all()
+            rng = random.Random(seed)
+            positions = [(rng.randrange(_RECT[2]), rng.randrange(_RECT[3]))
+                         for _ in range(_BATCH)]
+            leaves = _get_leaves(tree)
+            leaves = [rng.choice(leaves) for _ in range(_BATCH)]
+            renderer = TreemapRenderer(screen, MIN_RECT_PIXELS)
+            results[shape][str(n)] = {
+                'build': _best_time(lambda: generate(n, seed), repeat),
+                'layout': _best_time(lambda: tree.update_rectangles(_RECT),
+                                     repeat, lambda: _mark_dirty(tree)),
+                'visible layout': _best_time(
+                    lambda: VisibleLayout(MIN_RECT_PIXELS).layout(tree, _RECT),
+                    repeat),
+                'get_rectangles': _best_time(
+                    lambda: tree.get_rectangles(MIN_RECT_PIXELS), repeat),
+                'hit test': _best_time(
+                    lambda: [tree.get_tree_at_position(pos, MIN_RECT_PIXELS)
+                             for pos in positions], repeat) / _BATCH,
+                'mutation': _best_time(
+                    lambda: [_resize(tree, leaf) for leaf in leaves],
+                    repeat) / _BATCH,
+                'frame': _best_time(
+                    lambda: [_render_frame(renderer, tree, None, True)
+                             for _ in range(_BATCH)], repeat) / _BATCH,
+                'hover frame': _best_time(
+                    lambda: [_render_frame(renderer, tree, leaf, False)
+                             for leaf in leaves], repeat) / _BATCH
+            }
+    return results
+
+
+def benchmark_batch(n: int = 10 ** 5, edits: int = 1000, repeat: int = 3,
+                    seed: int = 0) -> Dict[str, float]:
+    """Return the best times for resizing or moving <edits> random leaves of
+    a balanced synthetic tree of <n> nodes, generated with <seed>, laying the
+    tree out after each edit as the visualiser does, and in a single
+    TMTree.batch.
+
+    Raise a ValueError if the two ways give different trees.
+    """
+    trees = [_balanced_tree(n, seed=seed) for _ in range(2)]
+    for tree in trees:
+        tree.update_rectangles(_RECT)
+
+    def edit_one_by_one() -> None:
+        for leaf, destination, factor in _pick_edits(trees[0], edits, seed):
+            _edit(leaf, destination, factor)
+            trees[0].update_rectangles(_RECT)
+
+    def edit_in_batch() -> None:
+        with trees[1].batch(_RECT):
+            for leaf, destination, factor in _pick_edits(trees[1], edits,
+                                                         seed):
+                _edit(leaf, destination, factor)
+
+    results = {'one by one': _best_time(edit_one_by_one, repeat),
+               'batch': _best_time(edit_in_batch, repeat)}
+    if _get_all_rects(trees[0]) != _get_all_rects(trees[1]) or \
+            not _same_tree(trees[0], trees[1]):
+        raise ValueError('batch gave a different tree')
+    return results
+
+
+def _pick_edits(tree: TMTree, edits: int, seed: int) \
+        -> List[Tuple[TMTree, Optional[TMTree], float]]:
+    """Return <edits> random edits of the leaves of <tree> chosen with
+    <seed>: a leaf, and either the tree to move it to or None to resize it
+    by the given factor instead.
+    """
+    rng = random.Random(seed)
+    leaves = _get_leaves(tree)
+    parents = [leaf._parent_tree for leaf in leaves]
+    return [(rng.choice(leaves),
+             rng.choice(parents) if rng.random() < 0.5 else None,
+             rng.choice((-0.5, 0.5))) for _ in range(edits)]
+
+
+def _edit(leaf: TMTree, destination: Optional[TMTree], factor: float) \
+        -> None:
+    """Move <leaf> to <destination>, or resize it by <factor> if
+    <destination> is None.
+    """
+    if destination is None:
+        leaf.change_size(factor)
+    else:
+        leaf.move(destination)
+
+
+def benchmark_indexes(n: int = 10 ** 5, edits: int = 1000, k: int = 10,
+                      repeat: int = 3, seed: int = 0) -> Dict[str, float]:
+    """Return the best times for resizing or moving <edits> random leaves of
+    a balanced synthetic tree of <n> nodes, generated with <seed>, without
+    and with a TopLeavesIndex and an ExtensionIndex listening, and for
+    finding its <k> largest leaves with the index and by walking the tree.
+
+    Raise a ValueError if the index and the walk find different leaves.
+    """
+    tree = _balanced_tree(n, seed=seed)
+    edit_list = _pick_edits(tree, edits, seed)
+
+    def edit() -> None:
+        for leaf, destination, factor in edit_list:
+            _edit(leaf, destination, factor)
+
+    results = {'edits': _best_time(edit, repeat)}
+    results['build indexes'] = _best_time(
+        lambda: [TopLeavesIndex(tree).close(), ExtensionIndex(tree).close()],
+        repeat)
+    with TopLeavesIndex(tree) as top, ExtensionIndex(tree):
+        results['edits with indexes'] = _best_time(edit, repeat)
+        results['largest from index'] = _best_time(
+            lambda: top.get_largest(k), repeat)
+        largest = top.get_largest(k)
+    results['largest by walking'] = _best_time(
+        lambda: heapq.nlargest(k, _get_leaves(tree),
+                               key=lambda leaf: leaf.data_size), repeat)
+    if [size for _, size in largest] != sorted(
+            (leaf.data_size for leaf in _get_leaves(tree)), reverse=True)[:k]:
+        raise ValueError('the index found different leaves')
+    return results
+
+
+def _get_headless_screen() -> pygame.Surface:
+    """Return a visualiser screen on pygame's dummy video driver, so that
+    frames can be rendered without a display.
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.init()
+    return pygame.display.set_mode((WIDTH, HEIGHT))
+
+
+def _get_leaves(tree: TMTree) -> List[TMTree]:
+    """Return the leaves of <tree>, in pre-order.
+    """
+    leaves = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node._subtrees:
+            stack.extend(reversed(node._subtrees))
+        else:
+            leaves.append(node)
+    return leaves
+
+
+def _resize(tree: TMTree, leaf: TMTree) -> None:
+    """Grow <leaf> of <tree> by 1%, and lay <tree> out again, as the
+    visualiser does when the up arrow key is pressed on a selected leaf.
+    """
+    leaf.change_size(0.01)
+    tree.update_rectangles(_RECT)
+
+
+def _render_frame(renderer: TreemapRenderer, tree: TMTree,
+                  hover_node: Optional[TMTree], full: bool) -> None:
+    """Render a frame of <tree> with <renderer>, with <hover_node> outlined,
+    drawing the whole treemap again iff <full>.
+    """
+    if full:
+        renderer.invalidate()
+    renderer.render(tree, None, hover_node)
+
+
+def benchmark_construction(sizes: Sequence[int] = (10 ** 3, 10 ** 4,
+                                                   10 ** 5),
+                           repeat: int = 3, seed: int = 0) \
+        -> Dict[str, Dict[str, float]]:
+    """Return, for each of the given <sizes>, the best times for building
+    the FileSystemTree of a synthetic folder holding that many files, and
+    the PaperTree of a synthetic papers dataset of that many papers, both
+    generated with <seed>.
+
+    The files of the synthetic folders are sparse, so they take up little
+    disk space whatever their size, but every file still needs an inode.
+    """
+    data_file = papers.DATA_FILE
+    results = {}
+    try:
+        for n in sizes:
+            with tempfile.TemporaryDirectory() as folder:
+                root = os.path.join(folder, 'root')
+                _write_folder(root, n, seed)
+                papers.DATA_FILE = os.path.join(folder, 'papers.csv')
+                _write_papers_csv(papers.DATA_FILE, n, seed)
+                results[str(n)] = {
+                    'FileSystemTree': _best_time(lambda: FileSystemTree(root),
+                                                 repeat),
+                    'PaperTree': _best_time(
+                        lambda: PaperTree('CS1', [], all_papers=True), repeat)
+                }
+    finally:
+        papers.DATA_FILE = data_file
+    return results
+
+
+def _write_folder(path: str, files: int, seed: int = 0, fanout: int = 32) \
+        -> None:
+    """Create a folder at <path> holding <files> files of random sizes
+    chosen with <seed>, in nested subfolders of at most <fanout> files and
+    <fanout> subfolders each.
+    """
+    rng = random.Random(seed)
+    for i in range(files):
+        folder = path
+        rest = i // fanout
+        while rest > 0:
+            folder = os.path.join(folder, 'd{}'.format(rest % fanout))
+            rest //= fanout
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, 'f{}'.format(i)), 'wb') as file:
+            file.truncate(rng.randint(1, 10 ** 6))
+
+
+def _mean_aspect_ratio(tree: TMTree) -> float:
+    """Return the mean aspect ratio, longer side over shorter side, of the
+    rectangles of the leaves of <tree> that have an area.
+    """
+    total = 0.0
+    count = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node._subtrees:
+            stack.extend(node._subtrees)
+        else:
+            width, height = node.rect[2], node.rect[3]
+            if width > 0 and height > 0:
+                total += max(width, height) / min(width, height)
+                count += 1
+    return total / count if count else float('inf')
+
+
+def stress_change_tracker(seconds: float = 5.0, use_inotify: bool = True,
+                          seed: int = 0) -> Dict[str, float]:
+    """Create, delete and resize random files and folders in a temporary
+    folder for <seconds> seconds, while a ChangeTracker keeps its tree up to
+    date, and return the number of operations and changes applied, and the
+    mean and worst time taken to apply the pending changes.
+
+    Raise a ValueError if the tree differs from a fresh scan of the folder
+    once the churn has stopped.
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as root:
+        folders = [root]
+        files = []
+        tree = FileSystemTree(root)
+        tracker = ChangeTracker(tree, root, 0.2, use_inotify)
+        tracker.start()
+        operations = 0
+        times = []
+        end = time.perf_counter() + seconds
+        try:
+            while time.perf_counter() < end:
+                for _ in range(20):
+                    _churn(rng, folders, files)
+                    operations += 1
+                time.sleep(0.01)
+                start = time.perf_counter()
+                tracker.apply_pending()
+                times.append(time.perf_counter() - start)
+
+            # Wait for the last changes to be seen
+            time.sleep(1.0)
+            while tracker.apply_pending():
+                time.sleep(1.0)
+        finally:
+            tracker.stop()
+        if not _same_contents(tree, FileSystemTree(root)) or \
+                tree.update_data_sizes() != FileSystemTree(root).data_size:
+            raise ValueError('tracked tree differs from a fresh scan')
+    return {'operations': operations, 'applies': len(times),
+            'mean apply': sum(times) / len(times), 'max apply': max(times)}
+
+
+def _churn(rng: random.Random, folders: List[str], files: List[str]) -> None:
+    """Make one random change under the first of <folders>: create, resize
+    or delete one of <files>, or create or delete one of <folders>, and
+    update both lists to match.
+    """
+    choice = rng.random()
+    if choice < 0.4 or not files:
+        path = os.path.join(rng.choice(folders), 'f{}'.format(rng.random()))
+        with open(path, 'wb') as file:
+            file.write(bytes(rng.randint(1, 4096)))
+        files.append(path)
+    elif choice < 0.7:
+        with open(rng.choice(files), 'ab') as file:
+            file.write(bytes(rng.randint(1, 4096)))
+    elif choice < 0.9:
+        os.remove(files.pop(rng.randrange(len(files))))
+    elif choice < 0.96 or len(folders) == 1:
+        path = os.path.join(rng.choice(folders), 'd{}'.format(rng.random()))
+        os.mkdir(path)
+        folders.append(path)
+    else:
+        path = folders.pop(rng.randrange(1, len(folders)))
+        shutil.rmtree(path)
+        prefix = path + os.sep
+        folders[:] = [folder for folder in folders
+                      if not folder.startswith(prefix)]
+        files[:] = [file for file in files if not file.startswith(prefix)]
+
+
+def benchmark_papers(rows: int = 10 ** 6, workers: Sequence[int] = (2, 4, 8),
+                     repeat: int = 1) -> Dict[str, float]:
+    """Return the best times for building the PaperTree of a synthetic
+    papers dataset file of <rows> papers on a single thread, and on a pool
+    of each number of <workers> processes.
+
+    Also return the best time for merging the trees of the chunks of the
+    largest pool in the main process on its own, as 'merge'. This part does
+    not get faster with more processes.
+
+    A million rows make a file of about 100 MB; use tens of millions to
+    measure multi-GB files.
+
+    Raise a ValueError if a pool builds a different tree than the single
+    thread.
+    """
+    data_file = papers.DATA_FILE
+    with tempfile.TemporaryDirectory() as folder:
+        papers.DATA_FILE = os.path.join(folder, 'papers.csv')
+        try:
+            _write_papers_csv(papers.DATA_FILE, rows)
+            expected = PaperTree('CS1', [], all_papers=True)
+            results = {'serial': _best_time(
+                lambda: PaperTree('CS1', [], all_papers=True), repeat)}
+            for count in workers:
+                if not _same_tree(expected, PaperTree(
+                        'CS1', [], all_papers=True, workers=count)):
+                    raise ValueError('pool of {} built a different '
+                                     'tree'.format(count))
+                results['{} workers'.format(count)] = _best_time(
+                    lambda: PaperTree('CS1', [], all_papers=True,
+                                      workers=count), repeat)
+
+            parts = [papers._load_chunk(papers.DATA_FILE, start, end, True)[0]
+                     for start, end in papers._split_lines(
+                         papers.DATA_FILE, 4 * max(workers))]
+            results['merge'] = _best_time(lambda: _merge_parts(parts),
+                                          repeat)
+        finally:
+            papers.DATA_FILE = data_file
+    return results
+
+
+def _merge_parts(parts: List[papers._Part]) -> PaperTree:
+    """Return a new PaperTree with the encoded trees in <parts> merged into
+    it, in order.
+    """
+    root = PaperTree('CS1', [])
+    index = {}
+    for part in parts:
+        papers._merge_papers(root, part, index)
+    return root
+
+
+def benchmark_papers_cache(rows: int = 10 ** 6,
+                           repeat: int = 3) -> Dict[str, float]:
+    """Return the best times for reading the papers of a synthetic papers
+    dataset file of <rows> papers from the file itself, and from an
+    up-to-date binary cache of it.
+
+    Raise a ValueError if the cache gives different papers than the file.
+    """
+    data_file = papers.DATA_FILE
+    with tempfile.TemporaryDirectory() as folder:
+        papers.DATA_FILE = os.path.join(folder, 'papers.csv')
+        cache_file = os.path.join(folder, 'papers.cache')
+        try:
+            _write_papers_csv(papers.DATA_FILE, rows)
+            if list(papers._read_papers()) != \
+                    list(papers._read_cached_papers(cache_file)):
+                raise ValueError('cache gave different papers')
+            return {
+                'csv': _best_time(
+                    lambda: list(papers._read_papers()), repeat),
+                'cache': _best_time(
+                    lambda: list(papers._read_cached_papers(cache_file)),
+                    repeat)
+            }
+        finally:
+            papers.DATA_FILE = data_file
+
+
+def _write_papers_csv(path: str, rows: int, seed: int = 0) -> None:
+    """Write a papers dataset file of <rows> random papers to <path>, with
+    the same columns as cs1_papers.csv.
+
+    As in cs1_papers.csv, the category paths of the papers are drawn from a
+    limited set.
+    """
+    rng = random.Random(seed)
+    names = ['Category {}'.format(i) for i in range(50)]
+    categories = [':'.join(rng.sample(names, rng.randint(1, 4)))
+                  for _ in range(1000)]
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Author', 'Title', 'Year', 'Category', 'Url',
+                         'Citations'])
+        for i in range(rows):
+            writer.writerow([
+                'Author {}, A.'.format(rng.randrange(rows)),
+                'Title {}'.format(i), rng.randint(1970, 2019),
+                rng.choice(categories),
+                'http://doi.acm.org/10.1145/{}'.format(i),
+                rng.randint(0, 500)
+            ])
+
+
+def _get_all_rects(tree: TMTree) -> Sequence[Tuple[int, int, int, int]]:
+    """Return the rectangle of every tree in <tree>, in pre-order.
+    """
+    rects = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        rects.append(node.rect)
+        stack.extend(reversed(node._subtrees))
+    return rects
+
+
+# The groups of benchmarks that can be run from the command line, keyed by
+# name, each run with the parsed command line arguments.
+_GROUPS = {
+    'trees': lambda args: benchmark_trees(args.sizes, args.shapes,
+                                          args.repeat, args.seed),
+    'construction': lambda args: benchmark_construction(
+        args.sizes, args.repeat, args.seed),
+    'scan': lambda args: benchmark_scan(args.folder, repeat=args.repeat),
+    'snapshot': lambda args: benchmark_snapshot(args.folder, args.repeat),
+    'memory': lambda args: benchmark_memory(args.folder),
+    'layout': lambda args: benchmark_layout(args.sizes, args.repeat),
+    'layout strategies': lambda args: benchmark_layout_strategies(
+        max(args.sizes), args.repeat),
+    'batch': lambda args: benchmark_batch(max(args.sizes),
+                                          repeat=args.repeat, seed=args.seed),
+    'rectangles': lambda args: benchmark_rectangles(max(args.sizes),
+                                                    args.repeat),
+    'indexes': lambda args: benchmark_indexes(max(args.sizes),
+                                              repeat=args.repeat,
+                                              seed=args.seed),
+    'papers': lambda args: benchmark_papers(max(args.sizes)),
+    'papers cache': lambda args: benchmark_papers_cache(max(args.sizes),
+                                                        args.repeat),
+    'change tracker': lambda args: stress_change_tracker(seed=args.seed)
+}
+
+
+def _parse_arguments() -> argparse.Namespace:
+    """Return the command line arguments of the benchmarks.
+    """
+    parser = argparse.ArgumentParser(
+        description='Benchmark the treemap code and write the results as '
+                    'JSON.')
+    parser.add_argument('--groups', nargs='+', choices=list(_GROUPS),
+                        default=[group for group in _GROUPS
+                                 if group != 'change tracker'],
+                        help='the benchmarks to run (default: all but the '
+                             'change tracker stress test)')
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[10 ** 3, 10 ** 4, 10 ** 5],
+                        help='the numbers of nodes of the synthetic trees; '
+                             'the largest is also the number of papers of '
+                             'the synthetic datasets')
+    parser.add_argument('--shapes', nargs='+', choices=list(_TREE_SHAPES),
+                        default=list(_TREE_SHAPES),
+                        help='the shapes of the synthetic trees')
+    parser.add_argument('--folder', default='.',
+                        help='the folder scanned by the scan, snapshot and '
+                             'memory benchmarks')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='the number of runs to take the best time of')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='the seed of the synthetic data')
+    parser.add_argument('--output', default='benchmarks.json',
+                        help='the file to write the JSON results to')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = _parse_arguments()
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'arguments': vars(arguments),
+        'results': {}
+    }
+    for group in arguments.groups:
+        print('running', group)
+        report['results'][group] = _GROUPS[group](arguments)
+    with open(arguments.output, 'w') as output:
+        json.dump(report, output, indent=2)
@@ -0,0 +1,432 @@
+"""Assignment 2: Live change tracking for Treemap
+
+=== CSC148 Winter 2019 ===
+
+=== Module Description ===
+This module keeps a FileSystemTree up to date while the folder it was built
+from changes on disk.
+
+A background thread watches the folder and queues the paths of the folders
+that changed. On Linux it uses inotify, through ctypes; elsewhere, or if
+inotify cannot be set up, it lists every folder again at a fixed interval
+and compares the listings with the previous ones. The tree itself is only
+patched by ChangeTracker.apply_pending, on the thread that owns the tree, so
+the watcher never touches it.
+"""
+import ctypes
+import ctypes.util
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+from typing import Callable, Dict, List, Optional
+from tm_trees import TMTree, FileSystemTree, _list_directory, _scan
+
+# Flags of inotify events, from <sys/inotify.h>.
+_IN_MODIFY = 0x2
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_MOVE_SELF = 0x800
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x1000000
+_IN_ISDIR = 0x40000000
+_IN_CLOEXEC = 0x80000
+# The events watched for in every folder.
+_WATCH_MASK = (_IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+               _IN_CREATE | _IN_DELETE | _IN_MOVE_SELF | _IN_ONLYDIR)
+# The fixed part of an inotify event: wd, mask, cookie and name length.
+_EVENT = struct.Struct('iIII')
+
+
+class ChangeTracker:
+    """Keeps a FileSystemTree up to date with the changes made to the folder
+    it was built from.
+
+    Once started, a background thread watches the folder for files and
+    folders that are created, deleted or resized. apply_pending lists the
+    folders that changed again and patches the tree in place: new entries
+    are added as the last subtrees of their folder, deleted entries are
+    removed, and resized files are given their new size. The data_size of
+    their ancestors is adjusted along the way and they are marked dirty, so
+    the next layout only lays out again the subtrees that changed. Folders of
+    a lazy FileSystemTree that have not been loaded yet are left alone, since
+    they are loaded as they are on disk when they are expanded, and new
+    folders are added to it unloaded, with their size added up in the
+    background.
+
+    === Private Attributes ===
+    _tree:
+        the tree kept up to date.
+    _path:
+        the path of the folder _tree was built from.
+    _folders:
+        the tree of each folder in _tree, keyed by its path. Folders without
+        entries are only added when an event is seen for them, since they
+        cannot be told apart from empty files in the tree.
+    _interval:
+        the number of seconds between two listings of the whole folder, when
+        inotify is not used.
+    _use_inotify:
+        whether to use inotify when it is available.
+    _changed:
+        the paths of the folders that changed since the last call to
+        apply_pending, queued by the watcher thread.
+    _notify:
+        the function called by the watcher thread when a change is queued
+        after the last call to apply_pending, or None.
+    _notified:
+        set once _notify has been called since the last call to
+        apply_pending.
+    _stop:
+        set to ask the watcher thread to stop.
+    _thread:
+        the watcher thread, or None if it is not running.
+    """
+    _tree: FileSystemTree
+    _path: str
+    _folders: Dict[str, FileSystemTree]
+    _interval: float
+    _use_inotify: bool
+    _changed: queue.Queue
+    _notify: Optional[Callable[[], None]]
+    _notified: threading.Event
+    _stop: threading.Event
+    _thread: Optional[threading.Thread]
+
+    def __init__(self, tree: FileSystemTree, path: str,
+                 interval: float = 1.0, use_inotify: bool = True) -> None:
+        """Initialize a tracker of the changes to the folder at <path>, from
+        which <tree> was built.
+
+        Without inotify, the folder is listed again every <interval>
+        seconds.
+
+        Precondition: <path> is a valid path to a folder.
+        """
+        self._tree = tree
+        self._path = path
+        self._folders = {}
+        self._register(tree, path)
+        self._interval = interval
+        self._use_inotify = use_inotify
+        self._changed = queue.Queue()
+        self._notify = None
+        self._notified = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, notify: Optional[Callable[[], None]] = None) -> None:
+        """Start watching the folder in a background thread.
+
+        If <notify> is given, the watcher thread calls it when a change is
+        seen after the last call to apply_pending, so that an event loop
+        can wake up and call apply_pending.
+
+        Changes made to the folder before this call are not seen.
+        """
+        self._notify = notify
+        self._stop.clear()
+        inotify = None
+        if self._use_inotify and sys.platform.startswith('linux'):
+            try:
+                inotify = _Inotify(self._path)
+            except OSError:
+                inotify = None
+        if inotify is None:
+            self._thread = threading.Thread(
+                target=self._poll, args=(_scan(self._path),), daemon=True)
+        else:
+            self._thread = threading.Thread(
+                target=self._read_inotify, args=(inotify,), daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop watching the folder, and wait for the watcher thread to end.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def apply_pending(self) -> bool:
+        """Patch the tree with the changes seen since the last call, and
+        return whether it changed.
+
+        This must be called from the thread that owns the tree.
+        """
+        self._notified.clear()
+        folders = set()
+        while True:
+            try:
+                folders.add(self._changed.get_nowait())
+            except queue.Empty:
+                break
+
+        # Parents go first, so a folder that was replaced is not listed twice
+        changed = False
+        for folder in sorted(folders, key=len):
+            if self._update_folder(folder):
+                changed = True
+        return changed
+
+    def _report(self, folder: str) -> None:
+        """Queue the path of a <folder> that changed, and notify the owner of
+        the tree if it has not been notified since it last applied changes.
+        """
+        self._changed.put(folder)
+        if not self._notified.is_set():
+            self._notified.set()
+            if self._notify is not None:
+                self._notify()
+
+    def _poll(self, listings: Dict[str, list]) -> None:
+        """Report every folder whose listing differs from the one in
+        <listings> the last time the folder was listed, every _interval
+        seconds, until asked to stop.
+        """
+        while not self._stop.wait(self._interval):
+            try:
+                current = _scan(self._path)
+            except OSError:
+                # something was deleted while it was listed; try again later
+                continue
+            for folder, listing in current.items():
+                if listings.get(folder) != listing:
+                    self._report(folder)
+            listings = current
+
+    def _read_inotify(self, inotify: '_Inotify') -> None:
+        """Report every folder that <inotify> sees changing, until asked to
+        stop.
+        """
+        try:
+            while not self._stop.is_set():
+                for folder in inotify.read(self._interval):
+                    self._report(folder)
+        finally:
+            inotify.close()
+
+    def _update_folder(self, folder: str) -> bool:
+        """List the folder at path <folder> again, patch its tree to match,
+        and return whether it changed.
+        """
+        node = self._find_folder(folder)
+        if node is None:
+            return False
+        try:
+            listing = _list_directory(folder)
+        except OSError:
+            # an entry went away while it was listed; the folder itself is
+            # removed when its parent is listed again
+            if os.path.isdir(folder):
+                self._report(folder)
+            return False
+
+        children = {child._name: child for child in node._subtrees}
+        changed = False
+        for name, is_folder, size in listing:
+            path = os.path.join(folder, name)
+            child = children.pop(name, None)
+            if child is not None and is_folder and child._pending is not None:
+                # not loaded yet, so it is loaded as it is now when expanded
+                continue
+            if child is not None and is_folder and path not in self._folders \
+                    and (child._subtrees or child.data_size == 0):
+                # a folder that was empty, or loaded after this tracker was
+                # made, seen as one for the first time
+                self._folders[path] = child
+            if child is not None and (path in self._folders) == is_folder:
+                if not is_folder and child.data_size != size:
+                    child._adjust_data_size(size - child.data_size)
+                    changed = True
+                continue
+            if child is not None:
+                self._remove(node, child, path)
+            if is_folder and node._folder_sizes is not None:
+                # the sizes added up for a folder there before are stale
+                node._folder_sizes.drop_known(path)
+            try:
+                child = node._new_subtree(path, is_folder, size)
+            except OSError:
+                self._report(folder)
+                continue
+            if is_folder and child._pending is None:
+                self._register(child, path)
+            node._add_subtree(child)
+            changed = True
+
+        for name, child in children.items():
+            self._remove(node, child, os.path.join(folder, name))
+            changed = True
+        return changed
+
+    def _find_folder(self, folder: str) -> Optional[FileSystemTree]:
+        """Return the tree of the folder at path <folder>, or None if it is
+        not in the tree, or its subtrees have not been loaded yet.
+
+        Folders that were empty, or were loaded after this tracker was made,
+        are looked up from their closest recorded ancestor, and recorded.
+        """
+        if folder in self._folders:
+            return self._folders[folder]
+        parent_path = os.path.dirname(folder)
+        if parent_path == folder or len(folder) <= len(self._path):
+            return None
+        parent = self._find_folder(parent_path)
+        if parent is None:
+            return None
+        for child in parent._subtrees:
+            if child._name == os.path.basename(folder) and \
+                    child._pending is None and \
+                    (child._subtrees or child.data_size == 0) and \
+                    os.path.isdir(folder):
+                self._folders[folder] = child
+                return child
+        return None
+
+    def _register(self, tree: TMTree, path: str) -> None:
+        """Record <tree>, the tree of the folder at <path>, and every folder
+        with entries in it in _folders.
+        """
+        self._folders[path] = tree
+        stack = [(tree, path)]
+        while stack:
+            node, node_path = stack.pop()
+            for child in node._subtrees:
+                if child._subtrees:
+                    child_path = os.path.join(node_path, child._name)
+                    self._folders[child_path] = child
+                    stack.append((child, child_path))
+
+    def _remove(self, node: TMTree, child: TMTree, path: str) -> None:
+        """Remove <child>, the tree at <path>, from its parent <node>, and
+        forget every folder in it.
+        """
+        node._remove_subtree(child)
+        stack = [(child, path)]
+        while stack:
+            tree, tree_path = stack.pop()
+            self._folders.pop(tree_path, None)
+            for subtree in tree._subtrees:
+                stack.append((subtree, os.path.join(tree_path,
+                                                    subtree._name)))
+
+
+class _Inotify:
+    """An inotify instance watching every folder under a folder.
+
+    === Private Attributes ===
+    _libc:
+        the C library, which provides the inotify system calls.
+    _fd:
+        the file descriptor of the inotify instance.
+    _watches:
+        the path of the folder of each watch, keyed by its watch descriptor.
+    """
+    _libc: ctypes.CDLL
+    _fd: int
+    _watches: Dict[int, str]
+
+    def __init__(self, path: str) -> None:
+        """Watch the folder at <path> and every folder under it.
+
+        Raise an OSError if inotify is not available, or a folder cannot be
+        watched.
+        """
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                     use_errno=True)
+            self._fd = self._libc.inotify_init1(_IN_CLOEXEC)
+        except AttributeError as error:
+            raise OSError('inotify is not available') from error
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._watches = {}
+        try:
+            self._watch_tree(path)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch_tree(self, path: str) -> None:
+        """Watch the folder at <path> and every folder under it.
+
+        Folders that are deleted before they are watched are skipped; raise
+        an OSError if another folder cannot be watched.
+        """
+        stack = [path]
+        while stack:
+            folder = stack.pop()
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder),
+                                              _WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error in (2, 20):  # ENOENT, ENOTDIR
+                    continue
+                raise OSError(error, 'inotify_add_watch failed', folder)
+            self._watches[wd] = folder
+            try:
+                with os.scandir(folder) as it:
+                    stack.extend(entry.path for entry in it if entry.is_dir())
+            except OSError:
+                continue
+
+    def read(self, timeout: float) -> List[str]:
+        """Wait up to <timeout> seconds for events, and return the paths of
+        the folders they happened in.
+
+        New folders are watched as soon as they are seen, before their
+        parent is returned, so no change inside them is missed.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self._fd, 64 * 1024)
+        folders = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                # events were lost, so every folder may have changed
+                folders.extend(self._watches.values())
+            elif wd not in self._watches:
+                continue
+            elif mask & _IN_IGNORED:
+                del self._watches[wd]
+            elif mask & _IN_MOVE_SELF:
+                self._libc.inotify_rm_watch(self._fd, wd)
+            else:
+                folder = self._watches[wd]
+                if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    try:
+                        self._watch_tree(os.path.join(folder, name))
+                    except OSError:
+                        # out of watches; the new folder is still listed
+                        # when its parent is, but not kept up to date
+                        pass
+                folders.append(folder)
+        return folders
+
+    def close(self) -> None:
+        """Stop watching, and release the inotify instance.
+        """
+        os.close(self._fd)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'ctypes', 'ctypes.util', 'os', 'queue',
+            'select', 'struct', 'sys', 'threading', 'tm_trees'
+        ]
+    })
@@ -0,0 +1,172 @@
+"""Assignment 2: Columnar binary files for Treemap
+
+=== CSC148 Winter 2019 ===
+
+=== Module Description ===
+This module writes and reads the binary files used to cache data on disk.
+A column file holds named columns, each of which is either a typed array of
+numbers or a list of strings, together with some JSON meta data.
+
+The file starts with a magic line, the length of its JSON header and the
+header itself, which records where each column is. The columns follow, each
+aligned to 8 bytes, so that a reader can memory-map the file and view a
+numeric column in place, without copying or parsing it.
+
+A string column is stored as the UTF-8 encodings of its strings separated by
+NUL characters, which cannot occur in file names or in the fields of the
+papers dataset.
+"""
+import json
+import mmap
+import os
+import sys
+from array import array
+from typing import Dict, List
+
+# The first line of every column file.
+_MAGIC = b'TMCOLUMNS1\n'
+# The alignment, in bytes, of the columns in a column file.
+_ALIGNMENT = 8
+
+
+def write_columns(path: str, meta: Dict[str, object],
+                  numbers: Dict[str, array],
+                  strings: Dict[str, List[str]]) -> None:
+    """Write a column file to <path> holding the JSON serialisable <meta> data,
+    the numeric columns <numbers> and the string columns <strings>.
+
+    The file is written under a temporary name and then renamed, so a reader
+    never sees a partly written file.
+    """
+    blobs = []
+    columns = {}
+    offset = 0
+    for name, values in numbers.items():
+        blobs.append(values.tobytes())
+        columns[name] = [values.typecode, offset, len(blobs[-1]), len(values)]
+        offset = _align(offset + len(blobs[-1]))
+    for name, values in strings.items():
+        blobs.append('\0'.join(values).encode('utf-8', 'surrogateescape'))
+        columns[name] = ['s', offset, len(blobs[-1]), len(values)]
+        offset = _align(offset + len(blobs[-1]))
+
+    header = json.dumps({'byteorder': sys.byteorder, 'meta': meta,
+                         'columns': columns}).encode('utf-8')
+    start = len(_MAGIC) + 8 + len(header)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(_MAGIC)
+        file.write(len(header).to_bytes(8, 'little'))
+        file.write(header)
+        file.write(bytes(_align(start) - start))
+        for blob in blobs:
+            file.write(blob)
+            file.write(bytes(_align(len(blob)) - len(blob)))
+    os.replace(temporary, path)
+
+
+def _align(offset: int) -> int:
+    """Return the smallest multiple of the column alignment that is at least
+    <offset>.
+    """
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+class ColumnFile:
+    """A column file, memory-mapped for reading.
+
+    Raise a ValueError on opening a file that is not a column file written on
+    a machine with the same byte order as this one.
+
+    === Public Attributes ===
+    meta:
+        the meta data the file was written with.
+
+    === Private Attributes ===
+    _file:
+        the open file.
+    _map:
+        the memory map of the whole file.
+    _start:
+        the offset in the file of the first column.
+    _columns:
+        the kind, offset from _start, length in bytes and number of values of
+        each column, keyed by its name. The kind of a numeric column is its
+        array typecode, and that of a string column is 's'.
+    """
+    meta: Dict[str, object]
+    _file: object
+    _map: mmap.mmap
+    _start: int
+    _columns: Dict[str, List]
+
+    def __init__(self, path: str) -> None:
+        """Open the column file at <path>.
+        """
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise
+        try:
+            self._read_header()
+        except ValueError:
+            self.close()
+            raise
+
+    def _read_header(self) -> None:
+        """Read the meta data and the column positions of this file.
+        """
+        if self._map[:len(_MAGIC)] != _MAGIC:
+            raise ValueError('not a column file')
+        length = int.from_bytes(self._map[len(_MAGIC):len(_MAGIC) + 8],
+                                'little')
+        end = len(_MAGIC) + 8 + length
+        header = json.loads(self._map[len(_MAGIC) + 8:end].decode('utf-8'))
+        try:
+            if header['byteorder'] != sys.byteorder:
+                raise ValueError('column file has a different byte order')
+            self.meta = header['meta']
+            self._start = _align(end)
+            self._columns = header['columns']
+            for _, offset, size, _ in self._columns.values():
+                if self._start + offset + size > len(self._map):
+                    raise ValueError('column file is truncated')
+        except (KeyError, TypeError) as error:
+            raise ValueError('column file has a bad header') from error
+
+    def numbers(self, name: str) -> memoryview:
+        """Return a view of the numeric column <name>, in place in the file.
+
+        The view must be released before the file is closed.
+        """
+        typecode, offset, size, _ = self._columns[name]
+        start = self._start + offset
+        return memoryview(self._map)[start:start + size].cast(typecode)
+
+    def strings(self, name: str) -> List[str]:
+        """Return the strings of the string column <name>.
+        """
+        _, offset, size, count = self._columns[name]
+        if count == 0:
+            return []
+        start = self._start + offset
+        return self._map[start:start + size].decode(
+            'utf-8', 'surrogateescape').split('\0')
+
+    def close(self) -> None:
+        """Close this file.
+        """
+        self._map.close()
+        self._file.close()
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'json', 'mmap', 'os', 'sys', 'array'
+        ]
+    })
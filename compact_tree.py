@@ -0,0 +1,681 @@
+"""Assignment 2: Compact array-backed trees for Treemap
+
+=== CSC148 Winter 2019 ===
+
+=== Module Description ===
+This module contains CompactTree, a store that keeps a whole treemap tree in
+a handful of contiguous typed arrays instead of one TMTree object per node,
+and CompactNode, a light view of a single node of such a store.
+
+A CompactNode has the same public interface as TMTree, so the root view of a
+store can be passed to the treemap visualiser in place of a TMTree. Views are
+only created for the nodes a client asks for (e.g. the selected or hovered
+node), and a store hands out the same view of a node for as long as the
+client holds on to it, so views can be compared with <is>.
+"""
+from __future__ import annotations
+import math
+import os
+import struct
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+from weakref import WeakValueDictionary
+from tm_trees import (RECORD_LENGTH, TMTree, _HitIndex, _contains,
+                      _find_candidates, _get_path_checksum, _get_path_colour,
+                      _grow_buffer, _index_rectangles, _scan, _scan_parallel)
+
+# The index used for a missing parent, child or sibling.
+_NONE = -1
+
+
+class CompactTree:
+    """A whole treemap tree stored in contiguous typed arrays.
+
+    Node i of the tree is described by entry i of each array. Node 0 is the
+    root. The children of a node form a doubly linked list through the sibling
+    arrays, so a leaf can be moved without renumbering any other node.
+
+    === Private Attributes ===
+    _names:
+        The name of each node.
+    _sizes:
+        The data_size of each node.
+    _xs, _ys, _widths, _heights:
+        The pygame rectangle of each node, one coordinate per array.
+    _colours:
+        The RGB colour of each node, as three consecutive entries.
+    _parents:
+        The index of each node's parent, or _NONE for the root.
+    _first_children, _last_children:
+        The index of the first and last child of each node, or _NONE for a
+        leaf.
+    _next_siblings, _prev_siblings:
+        The index of the next and previous child of the same parent, or
+        _NONE at either end of the list.
+    _expanded:
+        1 for each node that is expanded for visualization, 0 otherwise.
+    _separator:
+        The string used to separate names in a path string.
+    _leaf_suffix, _internal_suffix:
+        The suffix added to the path string of a leaf and of an internal node.
+    _views:
+        The views of this store's nodes that are still referenced by a client.
+    _hit_indexes:
+        The children of each node searched by _get_tree_at_position, and an
+        index of their rectangles, in the format of TMTree._hit_index. They
+        are all dropped whenever a rectangle, a size or a list of children
+        changes.
+
+    === Representation Invariants ===
+    - Every array has one entry per node, except _colours, which has three.
+    - If a node has children, its size is the sum of its children's sizes.
+    - The TMTree representation invariants hold for the tree described by
+      the arrays.
+    """
+    _names: List[Optional[str]]
+    _sizes: array
+    _xs: array
+    _ys: array
+    _widths: array
+    _heights: array
+    _colours: array
+    _parents: array
+    _first_children: array
+    _last_children: array
+    _next_siblings: array
+    _prev_siblings: array
+    _expanded: bytearray
+    _separator: str
+    _leaf_suffix: str
+    _internal_suffix: str
+    _views: Dict[int, CompactNode]
+    _hit_indexes: Dict[int, Tuple[List[int], _HitIndex]]
+
+    def __init__(self, names: List[Optional[str]], parents: List[int],
+                 sizes: List[int], separator: str, leaf_suffix: str,
+                 internal_suffix: str) -> None:
+        """Initialize a new store, with the colour that TMTree._get_colour
+        derives from the path of each node.
+
+        Node i has name <names>[i] and parent <parents>[i]. The size of a leaf
+        is taken from <sizes>; the size of an internal node is calculated from
+        its leaves instead. <separator>, <leaf_suffix> and <internal_suffix>
+        are used to build path strings.
+
+        Precondition: <names>, <parents> and <sizes> have the same length,
+        which is at least 1; <parents>[0] is _NONE, and every other node's
+        parent comes before it. Siblings appear in the order they should
+        have in the tree.
+        """
+        n = len(names)
+        # The checksum of each path is continued from its parent's
+        checksums = [0] * n
+        colours = []
+        for i in range(n):
+            name = names[i] or ''
+            if parents[i] == _NONE:
+                checksums[i] = _get_path_checksum(name)
+            else:
+                checksums[i] = _get_path_checksum(separator + name,
+                                                  checksums[parents[i]])
+            colours.extend(_get_path_colour(checksums[i]))
+
+        self._names = names
+        self._sizes = array('q', sizes)
+        self._xs = array('i', bytes(4 * n))
+        self._ys = array('i', bytes(4 * n))
+        self._widths = array('i', bytes(4 * n))
+        self._heights = array('i', bytes(4 * n))
+        self._colours = array('B', colours)
+        self._parents = array('i', parents)
+        self._first_children = array('i', [_NONE]) * n
+        self._last_children = array('i', [_NONE]) * n
+        self._next_siblings = array('i', [_NONE]) * n
+        self._prev_siblings = array('i', [_NONE]) * n
+        self._expanded = bytearray(n)
+        self._separator = separator
+        self._leaf_suffix = leaf_suffix
+        self._internal_suffix = internal_suffix
+        self._views = WeakValueDictionary()
+        self._hit_indexes = {}
+
+        for i in range(1, n):
+            self._append_child(parents[i], i)
+        for i in range(n):
+            if self._first_children[i] != _NONE:
+                self._sizes[i] = 0
+        for i in range(n - 1, 0, -1):
+            self._sizes[parents[i]] += self._sizes[i]
+
+    @classmethod
+    def from_tree(cls, tree: TMTree) -> CompactTree:
+        """Return a new store holding a copy of <tree>, including its
+        rectangles, colours and expansion state.
+        """
+        nodes = [tree]
+        parents = [_NONE]
+        position = {id(tree): 0}
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            for subtree in node._subtrees:
+                position[id(subtree)] = len(nodes)
+                nodes.append(subtree)
+                parents.append(position[id(node)])
+                stack.append(subtree)
+
+        leaf_suffix = internal_suffix = ''
+        for node in nodes:
+            if node._subtrees:
+                internal_suffix = node.get_suffix()
+            else:
+                leaf_suffix = node.get_suffix()
+
+        store = cls([node._name for node in nodes], parents,
+                    [node.data_size for node in nodes],
+                    tree.get_separator(), leaf_suffix, internal_suffix)
+        for i, node in enumerate(nodes):
+            store._set_rect(i, node.rect)
+            store._colours[3 * i:3 * i + 3] = array('B', node._get_colour())
+            store._expanded[i] = node._expanded
+        return store
+
+    @classmethod
+    def from_file_system(cls, path: str, workers: int = 0,
+                         use_processes: bool = False) -> CompactTree:
+        """Return a new store holding the file tree structure contained in the
+        given file or folder, without building a FileSystemTree first.
+
+        <workers> and <use_processes> choose how folders are listed, as for
+        FileSystemTree.
+
+        Precondition: <path> is a valid path for this computer.
+        """
+        names = [os.path.basename(path)]
+        parents = [_NONE]
+        if not os.path.isdir(path):
+            return cls(names, parents, [os.path.getsize(path)], os.sep,
+                       ' (file)', ' (folder)')
+
+        if workers > 0:
+            listings = _scan_parallel(path, workers, use_processes)
+        else:
+            listings = _scan(path)
+
+        sizes = [0]
+        queue = [(path, 0)]
+        for folder, index in queue:
+            for name, is_folder, size in listings.pop(folder):
+                if is_folder:
+                    queue.append((os.path.join(folder, name), len(names)))
+                names.append(name)
+                parents.append(index)
+                sizes.append(size)
+        return cls(names, parents, sizes, os.sep, ' (file)', ' (folder)')
+
+    def __len__(self) -> int:
+        """Return the number of nodes in this store.
+        """
+        return len(self._names)
+
+    def root(self) -> CompactNode:
+        """Return the view of the root of this store.
+        """
+        return self.node(0)
+
+    def node(self, index: int) -> CompactNode:
+        """Return the view of node <index> of this store.
+        """
+        view = self._views.get(index)
+        if view is None:
+            view = CompactNode(self, index)
+            self._views[index] = view
+        return view
+
+    # Helpers for the node views
+    def _children(self, i: int) -> List[int]:
+        """Return the indices of the children of node <i>, in order.
+        """
+        children = []
+        child = self._first_children[i]
+        while child != _NONE:
+            children.append(child)
+            child = self._next_siblings[child]
+        return children
+
+    def _append_child(self, parent: int, child: int) -> None:
+        """Make node <child> the last child of node <parent>.
+        """
+        self._hit_indexes.clear()
+        last = self._last_children[parent]
+        self._parents[child] = parent
+        self._prev_siblings[child] = last
+        self._next_siblings[child] = _NONE
+        if last == _NONE:
+            self._first_children[parent] = child
+        else:
+            self._next_siblings[last] = child
+        self._last_children[parent] = child
+
+    def _unlink_child(self, child: int) -> None:
+        """Remove node <child> from the children of its parent.
+        """
+        self._hit_indexes.clear()
+        parent = self._parents[child]
+        prev, nxt = self._prev_siblings[child], self._next_siblings[child]
+        if prev == _NONE:
+            self._first_children[parent] = nxt
+        else:
+            self._next_siblings[prev] = nxt
+        if nxt == _NONE:
+            self._last_children[parent] = prev
+        else:
+            self._prev_siblings[nxt] = prev
+        self._parents[child] = _NONE
+
+    def _is_leaf(self, i: int) -> bool:
+        """Return True iff node <i> has no children.
+        """
+        return self._first_children[i] == _NONE
+
+    def _is_displayed_leaf(self, i: int, min_pixels: int) -> bool:
+        """Return True iff node <i> is drawn as a single rectangle, as in
+        TMTree._is_displayed_leaf.
+        """
+        return self._first_children[i] == _NONE or not self._expanded[i] or \
+            self._widths[i] < min_pixels or self._heights[i] < min_pixels
+
+    def _rect(self, i: int) -> Tuple[int, int, int, int]:
+        """Return the pygame rectangle of node <i>.
+        """
+        return self._xs[i], self._ys[i], self._widths[i], self._heights[i]
+
+    def _set_rect(self, i: int, rect: Tuple[int, int, int, int]) -> None:
+        """Set the pygame rectangle of node <i> to <rect>.
+        """
+        if self._hit_indexes:
+            self._hit_indexes.clear()
+        self._xs[i], self._ys[i], self._widths[i], self._heights[i] = rect
+
+    def _colour(self, i: int) -> Tuple[int, int, int]:
+        """Return the RGB colour of node <i>.
+        """
+        return tuple(self._colours[3 * i:3 * i + 3])
+
+    def _update_rectangles(self, i: int,
+                           rect: Tuple[int, int, int, int]) -> None:
+        """Lay out the subtree rooted at node <i> in <rect>, as
+        TMTree.update_rectangles does.
+        """
+        stack = [(i, rect)]
+        while stack:
+            node, rect = stack.pop()
+            size = self._sizes[node]
+            if size == 0:
+                continue
+            self._set_rect(node, rect)
+            l, j, width, height = rect
+            child = self._first_children[node]
+            while child != _NONE:
+                if self._next_siblings[child] != _NONE:
+                    ratio = self._sizes[child] / size
+                    if width > height:
+                        child_rect = (l, j, int(width * ratio), height)
+                        l += child_rect[2]
+                    else:
+                        child_rect = (l, j, width, int(height * ratio))
+                        j += child_rect[3]
+                elif width > height:
+                    child_rect = (l, j, width + rect[0] - l, height)
+                else:
+                    child_rect = (l, j, width, height + rect[1] - j)
+                stack.append((child, child_rect))
+                child = self._next_siblings[child]
+
+    def _get_rectangles(self, i: int, min_pixels: int) \
+            -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
+        """Return the rectangles and colours of the displayed leaves under
+        node <i>, as TMTree.get_rectangles does.
+        """
+        return list(self._iter_rectangles(i, min_pixels))
+
+    def _iter_rectangles(self, i: int, min_pixels: int) \
+            -> Iterator[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
+        """Yield the rectangles and colours of the displayed leaves under
+        node <i>, as TMTree.iter_rectangles does.
+        """
+        if self._names[i] is None:
+            return
+        stack = [i]
+        while stack:
+            node = stack.pop()
+            if self._is_displayed_leaf(node, min_pixels):
+                yield self._rect(node), self._colour(node)
+            else:
+                stack.extend(reversed(self._children(node)))
+
+    def _fill_rectangles(self, i: int, buffer: array, min_pixels: int) -> int:
+        """Write the records of the displayed leaves under node <i> into
+        <buffer>, growing it only if it is too short, and return their
+        number, as TMTree.fill_rectangles does.
+        """
+        if self._names[i] is None:
+            return 0
+        record = struct.Struct(str(RECORD_LENGTH) + buffer.typecode)
+        pack_into, record_bytes = record.pack_into, record.size
+        end = len(buffer) * buffer.itemsize
+        colours = self._colours
+        offset = 0
+        stack = [i]
+        while stack:
+            node = stack.pop()
+            if not self._is_displayed_leaf(node, min_pixels):
+                stack.extend(reversed(self._children(node)))
+                continue
+            if offset + record_bytes > end:
+                _grow_buffer(buffer)
+                end = len(buffer) * buffer.itemsize
+            pack_into(buffer, offset, self._xs[node], self._ys[node],
+                      self._widths[node], self._heights[node],
+                      colours[3 * node], colours[3 * node + 1],
+                      colours[3 * node + 2])
+            offset += record_bytes
+        return offset // record_bytes
+
+    def _get_tree_at_position(self, i: int, pos: Tuple[int, int],
+                              min_pixels: int) -> int:
+        """Return the index of the displayed leaf under node <i> whose
+        rectangle contains <pos>, or _NONE, as TMTree.get_tree_at_position
+        does, including its choice between leaves that share an edge.
+
+        Only the children that _get_candidates finds are searched.
+        """
+        if self._is_displayed_leaf(i, min_pixels):
+            return i if _contains(self._rect(i), pos) else _NONE
+
+        # Each frame holds a node, the candidates among its children left to
+        # search, and the best leaf found under it so far.
+        stack = [(i, iter(self._get_candidates(i, pos)), [_NONE])]
+        while True:
+            child = next(stack[-1][1], _NONE)
+            if child == _NONE:
+                found = stack.pop()[2][0]
+                if not stack:
+                    return found
+            elif not self._is_displayed_leaf(child, min_pixels):
+                stack.append((child, iter(self._get_candidates(child, pos)),
+                              [_NONE]))
+                continue
+            else:
+                found = child if _contains(self._rect(child), pos) else _NONE
+            best = stack[-1][2]
+            if found != _NONE and (
+                    best[0] == _NONE or self._ys[found] < self._ys[best[0]] or
+                    self._xs[found] < self._xs[best[0]]):
+                best[0] = found
+
+    def _get_candidates(self, i: int, pos: Tuple[int, int]) -> List[int]:
+        """Return the children of node <i>, in order, that may contain a
+        leaf whose rectangle contains <pos>, as TMTree._get_candidates does.
+
+        Build the entry of node <i> in _hit_indexes first if necessary.
+        """
+        if i not in self._hit_indexes:
+            children = self._children(i)
+            self._hit_indexes[i] = children, _index_rectangles(
+                self._rect(i), [self._rect(child) for child in children],
+                [self._sizes[child] for child in children])
+        children, index = self._hit_indexes[i]
+        return [children[k] for k in _find_candidates(index, pos)]
+
+    def _update_data_sizes(self, i: int) -> int:
+        """Recalculate the size of every internal node under node <i> from
+        its leaves, as TMTree.update_data_sizes does, and return the new size
+        of node <i>.
+        """
+        self._hit_indexes.clear()
+        order = [i]
+        stack = [i]
+        while stack:
+            children = self._children(stack.pop())
+            order.extend(children)
+            stack.extend(children)
+        for node in reversed(order):
+            if self._is_leaf(node):
+                continue
+            size = 0
+            for child in self._children(node):
+                size += self._sizes[child]
+            self._sizes[node] = size
+            if size == 0:
+                self._set_rect(node, (0, 0, 0, 0))
+        return self._sizes[i]
+
+    def _move(self, i: int, destination: int) -> None:
+        """Move node <i> to be the last child of node <destination>, updating
+        the sizes of its old and new ancestors, as TMTree.move does.
+        """
+        if not self._is_leaf(i) or self._is_leaf(destination):
+            return
+        parent = self._parents[i]
+        self._unlink_child(i)
+        self._adjust_size(parent, -self._sizes[i])
+        self._append_child(destination, i)
+        if self._is_leaf(parent):
+            self._sizes[parent] = 0
+            self._set_rect(parent, (0, 0, 0, 0))
+        self._adjust_size(destination, self._sizes[i])
+
+    def _change_size(self, i: int, factor: float) -> None:
+        """Change the size of leaf <i> by <factor>, updating the sizes of its
+        ancestors, as TMTree.change_size does.
+        """
+        if not self._is_leaf(i):
+            return
+        size = math.ceil(abs(self._sizes[i] * factor))
+        if factor >= 0:
+            new_size = self._sizes[i] + size
+        else:
+            new_size = self._sizes[i] - size
+        new_size = 1 if new_size < 1 else new_size
+        self._adjust_size(i, new_size - self._sizes[i])
+
+    def _adjust_size(self, i: int, delta: int) -> None:
+        """Add <delta> to the size of node <i> and of each of its ancestors,
+        as TMTree._adjust_data_size does.
+        """
+        self._hit_indexes.clear()
+        node = i
+        while node != _NONE and delta != 0:
+            self._sizes[node] += delta
+            if self._sizes[node] == 0 and not self._is_leaf(node):
+                self._set_rect(node, (0, 0, 0, 0))
+            node = self._parents[node]
+
+    def _collapse_everything_under(self, i: int) -> None:
+        """Mark node <i> and all of its descendants as not expanded.
+        """
+        stack = [i]
+        while stack:
+            node = stack.pop()
+            self._expanded[node] = 0
+            stack.extend(self._children(node))
+
+    def _get_path_string(self, i: int, final_node: bool) -> str:
+        """Return the path string of node <i>, as TMTree.get_path_string
+        does.
+        """
+        names = []
+        node = i
+        while node != _NONE:
+            names.append(self._names[node])
+            node = self._parents[node]
+        path_str = self._separator.join(reversed(names))
+        if final_node or (self._is_leaf(i) and self._parents[i] != _NONE):
+            path_str += self._suffix(i)
+        return path_str
+
+    def _suffix(self, i: int) -> str:
+        """Return the suffix for the path string of node <i>.
+        """
+        if self._is_leaf(i):
+            return self._leaf_suffix
+        return self._internal_suffix
+
+
+class CompactNode:
+    """A view of one node of a CompactTree, with the public interface of
+    TMTree.
+
+    === Private Attributes ===
+    _store:
+        The store that holds this node.
+    _index:
+        The index of this node in _store.
+    """
+    __slots__ = ('_store', '_index', '__weakref__')
+    _store: CompactTree
+    _index: int
+
+    def __init__(self, store: CompactTree, index: int) -> None:
+        """Initialize a new view of node <index> of <store>.
+
+        Use CompactTree.node instead of calling this directly, so that each
+        node has a single view.
+        """
+        self._store = store
+        self._index = index
+
+    @property
+    def rect(self) -> Tuple[int, int, int, int]:
+        """The pygame rectangle representing this node in the treemap
+        visualization.
+        """
+        return self._store._rect(self._index)
+
+    @property
+    def data_size(self) -> int:
+        """The size of the data represented by this node.
+        """
+        return self._store._sizes[self._index]
+
+    def is_empty(self) -> bool:
+        """Return True iff this tree is empty.
+        """
+        return self._store._names[self._index] is None
+
+    def update_rectangles(self, rect: Tuple[int, int, int, int]) -> None:
+        """Update the rectangles in this tree and its descendents using the
+        treemap algorithm to fill the area defined by pygame rectangle <rect>.
+        """
+        self._store._update_rectangles(self._index, rect)
+
+    def get_rectangles(self, min_pixels: int = 0) \
+            -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
+        """Return a list with tuples for every leaf in the displayed-tree
+        rooted at this tree, as for TMTree.get_rectangles.
+        """
+        return self._store._get_rectangles(self._index, min_pixels)
+
+    def iter_rectangles(self, min_pixels: int = 0) \
+            -> Iterator[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
+        """Yield the tuples of get_rectangles one at a time, as for
+        TMTree.iter_rectangles.
+        """
+        return self._store._iter_rectangles(self._index, min_pixels)
+
+    def fill_rectangles(self, buffer: array, min_pixels: int = 0) -> int:
+        """Write one record per leaf in the displayed-tree rooted at this
+        tree into <buffer>, as for TMTree.fill_rectangles.
+        """
+        return self._store._fill_rectangles(self._index, buffer, min_pixels)
+
+    def get_tree_at_position(self, pos: Tuple[int, int],
+                             min_pixels: int = 0) -> Optional[CompactNode]:
+        """Return the leaf in the displayed-tree rooted at this tree whose
+        rectangle contains position <pos>, or None if there is none, as for
+        TMTree.get_tree_at_position.
+        """
+        found = self._store._get_tree_at_position(self._index, pos,
+                                                  min_pixels)
+        if found == _NONE:
+            return None
+        return self._store.node(found)
+
+    def update_data_sizes(self) -> int:
+        """Update the data_size for this tree and its subtrees, based on the
+        size of their leaves, and return the new size.
+        """
+        return self._store._update_data_sizes(self._index)
+
+    def move(self, destination: CompactNode) -> None:
+        """If this tree is a leaf, and <destination> is not a leaf, move this
+        tree to be the last subtree of <destination>. Otherwise, do nothing.
+
+        Precondition: <destination> is a view of the same store.
+        """
+        self._store._move(self._index, destination._index)
+
+    def change_size(self, factor: float) -> None:
+        """Change the value of this tree's data_size attribute by <factor>,
+        as for TMTree.change_size.
+        """
+        self._store._change_size(self._index, factor)
+
+    def expand(self) -> None:
+        """ Expand selected folder. """
+        if not self._store._is_leaf(self._index):
+            self._store._expanded[self._index] = 1
+
+    def expand_all(self) -> None:
+        """ Expand all files and folder in folder. """
+        store = self._store
+        stack = [self._index]
+        while stack:
+            node = stack.pop()
+            if not store._is_leaf(node):
+                store._expanded[node] = 1
+                stack.extend(store._children(node))
+
+    def collapse(self) -> None:
+        """ Collapse selected file/folder """
+        parent = self._store._parents[self._index]
+        if parent != _NONE and self._store._expanded[parent]:
+            self._store._collapse_everything_under(parent)
+
+    def collapse_all(self) -> None:
+        """Collapse everything """
+        store = self._store
+        now = self._index
+        while store._parents[now] != _NONE and \
+                store._expanded[store._parents[now]]:
+            now = store._parents[now]
+        store._collapse_everything_under(now)
+
+    def get_path_string(self, final_node: bool = True) -> str:
+        """Return a string representing the path containing this tree
+        and its ancestors, as for TMTree.get_path_string.
+        """
+        return self._store._get_path_string(self._index, final_node)
+
+    def get_separator(self) -> str:
+        """Return the string used to separate names in the string
+        representation of a path from the tree root to this tree.
+        """
+        return self._store._separator
+
+    def get_suffix(self) -> str:
+        """Return the string used at the end of the string representation of
+        a path from the tree root to this tree.
+        """
+        return self._store._suffix(self._index)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'math', 'os', 'struct', '__future__',
+            'array', 'weakref', 'tm_trees'
+        ]
+    })
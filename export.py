@@ -0,0 +1,270 @@
+"""Assignment 2: Headless export for Treemap
+
+=== CSC148 Winter 2019 ===
+
+=== Module Description ===
+This module renders the treemap of a tree to a PNG file without opening a
+window, at resolutions far larger than the screen, such as 32768 by 32768.
+
+The image is rendered in square tiles, one band of tiles across the image at
+a time. Each tile only visits the subtrees whose rectangles overlap it, and
+the tiles of a band may be rendered in parallel by a pool of processes. The
+workers are not sent the tree: the rectangles and colours of its displayed
+leaves are flattened once into a column file, indexed by tile, that every
+worker memory-maps, so each tile only reads the leaves that overlap it. The
+rows of each band are compressed into the PNG file as soon as the band is
+done, so the memory used is bounded by the size of one band, not of the
+whole image.
+
+Run this module directly with a folder path and a PNG path to export the
+treemap of that folder, fully expanded:
+    python export.py FOLDER OUTPUT.png [WIDTH HEIGHT]
+"""
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple
+import pygame
+from tm_trees import RECORD_LENGTH, TMTree, FileSystemTree
+from layouts import LayoutStrategy, SliceAndDiceLayout
+from columnar import ColumnFile, write_columns
+
+# Only offscreen surfaces are drawn on, but pygame is told to use its dummy
+# video driver in case anything initializes the display, so that exports run
+# on machines without one.
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+# The default width and height, in pixels, of the tiles.
+TILE_SIZE = 1024
+# The first bytes of every PNG file.
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# The most compressed bytes written to a single PNG data chunk.
+_CHUNK_SIZE = 1 << 20
+
+# The column file of the leaves drawn by the tiles rendered in a worker
+# process, opened once when the process starts; see _write_tile_records.
+_worker_records = None
+
+
+def export_treemap(tree: TMTree, path: str, width: int, height: int,
+                   tile_size: int = TILE_SIZE, workers: int = 0,
+                   min_pixels: int = 0,
+                   layout: Optional[LayoutStrategy] = None) -> None:
+    """Render the treemap of the displayed-tree rooted at <tree>, laid out by
+    <layout> to fill a <width> by <height> image, and save it as a PNG file
+    at <path>.
+
+    The image is rendered in tiles of <tile_size> by <tile_size> pixels, by a
+    pool of <workers> processes, or in this process if <workers> is 0. At most
+    one band of <tile_size> rows of the image is held in memory at once.
+    Trees whose rectangle is less than <min_pixels> wide or high are drawn as
+    a single block, as in TMTree.get_rectangles.
+
+    The rectangles of <tree> are left as laid out for the image. If <layout>
+    is None, the layout of TMTree.update_rectangles is used.
+    """
+    if layout is None:
+        layout = SliceAndDiceLayout()
+    layout.layout(tree, (0, 0, width, height))
+
+    with open(path, 'wb') as file:
+        file.write(_PNG_SIGNATURE)
+        # 8-bit RGB, with the default compression, filtering and interlacing
+        _write_chunk(file, b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                                8, 2, 0, 0, 0))
+        compressor = zlib.compressobj()
+        pending = b''
+        for scanline in _render_scanlines(tree, width, height, tile_size,
+                                          workers, min_pixels):
+            pending += compressor.compress(scanline)
+            if len(pending) >= _CHUNK_SIZE:
+                _write_chunk(file, b'IDAT', pending)
+                pending = b''
+        pending += compressor.flush()
+        _write_chunk(file, b'IDAT', pending)
+        _write_chunk(file, b'IEND', b'')
+
+
+def _render_scanlines(tree: TMTree, width: int, height: int,
+                      tile_size: int, workers: int,
+                      min_pixels: int) -> Iterator[bytes]:
+    """Yield the PNG scanlines of the treemap of <tree>, from the top of the
+    image down, rendering one band of <tile_size> rows at a time.
+
+    Each scanline is a filter type byte of 0 followed by the RGB bytes of its
+    <width> pixels.
+    """
+    bands = [[(x, y, min(tile_size, width - x), min(tile_size, height - y))
+              for x in range(0, width, tile_size)]
+             for y in range(0, height, tile_size)]
+    if workers == 0:
+        for tiles in bands:
+            yield from _join_tiles(tiles, [_render_tile(tree, tile, min_pixels)
+                                           for tile in tiles])
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'tiles.columns')
+        _write_tile_records(path, tree, width, height, tile_size, min_pixels)
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_start_worker,
+                                 initargs=(path,)) as pool:
+            first = 0
+            for tiles in bands:
+                numbers = range(first, first + len(tiles))
+                yield from _join_tiles(tiles, list(pool.map(
+                    _render_worker_tile, numbers, tiles)))
+                first += len(tiles)
+
+
+def _write_tile_records(path: str, tree: TMTree, width: int, height: int,
+                        tile_size: int, min_pixels: int) -> None:
+    """Write the leaves of the displayed-tree rooted at <tree> to a column
+    file at <path>, indexed by the tiles of <tile_size> by <tile_size> pixels
+    of a <width> by <height> image.
+
+    The 'records' column holds the records of TMTree.fill_rectangles. The
+    leaves that overlap tile i, numbered row by row, are the records whose
+    numbers are in 'tile_records', from 'tile_starts'[i] up to
+    'tile_starts'[i + 1], in the order of the records.
+    """
+    records = array('i')
+    count = tree.fill_rectangles(records, min_pixels)
+    del records[count * RECORD_LENGTH:]
+    columns = -(-width // tile_size)
+    tiles = [array('q') for _ in range(columns * -(-height // tile_size))]
+    for number in range(count):
+        x, y, rect_width, rect_height = \
+            records[number * RECORD_LENGTH:number * RECORD_LENGTH + 4]
+        first_column = max(x, 0) // tile_size
+        last_column = (min(x + rect_width, width) - 1) // tile_size
+        for row in range(max(y, 0) // tile_size,
+                         (min(y + rect_height, height) - 1) // tile_size + 1):
+            for column in range(first_column, last_column + 1):
+                tiles[row * columns + column].append(number)
+
+    starts = array('q', [0])
+    tile_records = array('q')
+    for tile_numbers in tiles:
+        tile_records.extend(tile_numbers)
+        starts.append(len(tile_records))
+    write_columns(path, {}, {'records': records, 'tile_starts': starts,
+                             'tile_records': tile_records}, {})
+
+
+def _join_tiles(tiles: List[Tuple[int, int, int, int]],
+                pixels: List[bytes]) -> Iterator[bytes]:
+    """Yield the PNG scanlines of a band made of <tiles>, from left to right,
+    whose RGB bytes are <pixels>.
+    """
+    for row in range(tiles[0][3]):
+        scanline = [b'\0']
+        for tile, tile_pixels in zip(tiles, pixels):
+            stride = 3 * tile[2]
+            scanline.append(tile_pixels[row * stride:(row + 1) * stride])
+        yield b''.join(scanline)
+
+
+def _render_tile(tree: TMTree, tile: Tuple[int, int, int, int],
+                 min_pixels: int) -> bytes:
+    """Return the RGB bytes of the part of the treemap of <tree> inside the
+    pygame rectangle <tile>, row by row.
+    """
+    return _draw_tile(tile, _iter_tile_rectangles(tree, tile, min_pixels))
+
+
+def _draw_tile(tile: Tuple[int, int, int, int],
+               rectangles: Iterable[Tuple[Tuple[int, int, int, int],
+                                          Tuple[int, int, int]]]) -> bytes:
+    """Return the RGB bytes of the part of the treemap inside the pygame
+    rectangle <tile>, row by row, where <rectangles> are the rectangles and
+    colours of the leaves that overlap it, as in TMTree.get_rectangles.
+    """
+    left, top, width, height = tile
+    surface = pygame.Surface((width, height))
+    surface.fill(pygame.color.THECOLORS['black'])
+    for (x, y, rect_width, rect_height), colour in rectangles:
+        # Clip to the tile first: Surface.fill keeps the full width or height
+        # of a rectangle that starts before the edge of the surface
+        x1, y1 = max(x - left, 0), max(y - top, 0)
+        x2 = min(x - left + rect_width, width)
+        y2 = min(y - top + rect_height, height)
+        surface.fill(colour, (x1, y1, x2 - x1, y2 - y1))
+    return pygame.image.tobytes(surface, 'RGB')
+
+
+def _iter_tile_rectangles(tree: TMTree, tile: Tuple[int, int, int, int],
+                          min_pixels: int) \
+        -> Iterator[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
+    """Yield the tuples of TMTree.iter_rectangles for the leaves of the
+    displayed-tree rooted at <tree> whose rectangles overlap <tile>.
+
+    Every rectangle lies inside its parent's, so a subtree whose rectangle
+    misses <tile> is skipped without visiting any of its descendents.
+    """
+    if tree.is_empty():
+        return
+    left, top, width, height = tile
+    right, bottom = left + width, top + height
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        x, y, node_width, node_height = node.rect
+        if x >= right or y >= bottom or x + node_width <= left or \
+                y + node_height <= top:
+            continue
+        if node._is_displayed_leaf(min_pixels):
+            yield node.rect, node._get_colour()
+        else:
+            stack.extend(reversed(node._subtrees))
+
+
+def _start_worker(path: str) -> None:
+    """Open the column file at <path>, written by _write_tile_records for the
+    export, in this worker process.
+    """
+    global _worker_records
+    _worker_records = ColumnFile(path)
+
+
+def _render_worker_tile(number: int,
+                        tile: Tuple[int, int, int, int]) -> bytes:
+    """Return the RGB bytes of <tile>, tile <number> of the treemap being
+    exported by this worker process, as for _render_tile.
+    """
+    return _draw_tile(tile, _iter_worker_rectangles(number))
+
+
+def _iter_worker_rectangles(number: int) \
+        -> Iterator[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
+    """Yield the rectangles and colours of the leaves that overlap tile
+    <number>, read from the column file of this worker process.
+    """
+    records = _worker_records.numbers('records')
+    starts = _worker_records.numbers('tile_starts')
+    for record in _worker_records.numbers('tile_records')[
+            starts[number]:starts[number + 1]]:
+        x, y, width, height, red, green, blue = \
+            records[record * RECORD_LENGTH:(record + 1) * RECORD_LENGTH]
+        yield (x, y, width, height), (red, green, blue)
+
+
+def _write_chunk(file: object, kind: bytes, data: bytes) -> None:
+    """Write a PNG chunk of the given <kind> holding <data> to <file>.
+    """
+    file.write(struct.pack('>I', len(data)))
+    file.write(kind)
+    file.write(data)
+    file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+
+if __name__ == '__main__':
+    folder_tree = FileSystemTree(sys.argv[1])
+    folder_tree.expand_all()
+    size = [int(arg) for arg in sys.argv[3:5]] or [32768, 32768]
+    export_treemap(folder_tree, sys.argv[2], size[0], size[1],
+                   workers=os.cpu_count() or 1)
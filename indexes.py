@@ -0,0 +1,304 @@
+"""Assignment 2: Summary indexes for Treemap
+
+=== CSC148 Winter 2019 ===
+
+=== Module Description ===
+This module keeps summaries of the leaves of a tree up to date as the tree
+changes, so that questions such as "what are the biggest files?" or "how much
+space do the .log files take?" are answered without walking the tree.
+
+Each index is built with one walk of the tree, and then listens to the
+changes made to it by change_size, move and a ChangeTracker, and to the
+folders of a lazy FileSystemTree being loaded. It is updated for each leaf
+that changes, without visiting the rest of the tree; the heap of a
+TopLeavesIndex takes O(log n) time per leaf:
+
+    index = TopLeavesIndex(tree)
+    tree.change_size(0.5)
+    print(index.get_largest(10))
+    index.close()
+
+TopLeavesIndex keeps the largest leaves of any tree in a heap.
+ExtensionIndex adds up the sizes of the files of a FileSystemTree by their
+extension, and AuthorIndex adds up the citations of the papers of a
+PaperTree by author.
+
+An index listens to the changes made to its tree until it is closed, so
+it should be closed once it is no longer needed.
+"""
+import heapq
+import os
+from itertools import count
+from typing import Dict, Iterator, List, Optional, Tuple
+from tm_trees import TMTree, TreeListener
+
+# The number of stale entries the heap of a TopLeavesIndex may hold, on top
+# of one per leaf, before it is rebuilt from the live ones.
+_SLACK = 64
+
+
+class TreeIndex(TreeListener):
+    """A summary of the leaves of a tree, kept up to date as it changes.
+
+    This is an abstract class that should not be instantiated directly.
+    Subclasses record the leaves they are given in _update.
+
+    === Private Attributes ===
+    _root:
+        The root of the tree indexed.
+    _sizes:
+        The data_size last recorded for each leaf indexed.
+    """
+    _root: TMTree
+    _sizes: Dict[TMTree, int]
+
+    def __init__(self, root: TMTree) -> None:
+        """Initialize a new index of the leaves of the tree rooted at <root>,
+        and start listening to its changes.
+
+        Precondition: <root> has no parent.
+        """
+        self._root = root
+        self._sizes = {}
+        self._add_leaves(root)
+        root._add_listener(self)
+
+    def close(self) -> None:
+        """Stop listening to the changes of the tree.
+
+        The index is left as it is, and goes out of date as the tree changes.
+        """
+        self._root._remove_listener(self)
+
+    def __enter__(self) -> 'TreeIndex':
+        """Return this index.
+        """
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        """Close this index.
+        """
+        self.close()
+
+    def leaf_resized(self, leaf: TMTree) -> None:
+        """Record that the data_size of <leaf> changed, if it is indexed.
+        """
+        if leaf in self._sizes:
+            old_size = self._sizes[leaf]
+            self._sizes[leaf] = leaf.data_size
+            self._update(leaf, old_size, leaf.data_size)
+
+    def subtree_added(self, subtree: TMTree) -> None:
+        """Index the leaves of <subtree>.
+        """
+        self._add_leaves(subtree)
+
+    def subtree_removed(self, subtree: TMTree) -> None:
+        """Forget every indexed tree in <subtree>.
+        """
+        stack = [subtree]
+        while stack:
+            node = stack.pop()
+            if node in self._sizes:
+                self._update(node, self._sizes.pop(node), None)
+            stack.extend(node._subtrees)
+
+    def _add_leaves(self, subtree: TMTree) -> None:
+        """Index the leaves of <subtree> that are not indexed yet.
+
+        A folder of a lazy FileSystemTree that has not been loaded yet is
+        left out: its files are indexed when it is loaded.
+        """
+        stack = [subtree]
+        while stack:
+            node = stack.pop()
+            if node._subtrees:
+                stack.extend(node._subtrees)
+            elif node not in self._sizes and \
+                    getattr(node, '_pending', None) is None:
+                self._sizes[node] = node.data_size
+                self._update(node, None, node.data_size)
+
+    def _update(self, leaf: TMTree, old_size: Optional[int],
+                new_size: Optional[int]) -> None:
+        """Record that the data_size of <leaf> changed from <old_size> to
+        <new_size>, where an <old_size> of None means that <leaf> was just
+        added to the index, and a <new_size> of None that it was just removed
+        from it.
+        """
+        raise NotImplementedError
+
+
+class TopLeavesIndex(TreeIndex):
+    """The largest leaves of a tree.
+
+    The leaves are kept in a heap, largest first. An entry is not removed
+    from the heap when its leaf is resized or removed, but replaced by a new
+    one; the stale entries are dropped when they reach the top of the heap,
+    or all at once when there are too many of them.
+
+    In a lazy FileSystemTree, a folder that has not been loaded yet is left
+    out, as it is not a file, and its files are added when it is loaded.
+
+    === Private Attributes ===
+    _heap:
+        The entries of the heap. Each entry is a list of the negated
+        data_size of a leaf, a number that breaks ties in the order the
+        entries were made, and the leaf.
+    _entries:
+        The live entry of each leaf indexed.
+    _counter:
+        The source of the numbers that break ties between entries.
+    """
+    _heap: List[list]
+    _entries: Dict[TMTree, list]
+    _counter: Iterator[int]
+
+    def __init__(self, root: TMTree) -> None:
+        """Initialize a new index of the largest leaves of the tree rooted
+        at <root>, and start listening to its changes.
+
+        Precondition: <root> has no parent.
+        """
+        self._heap = []
+        self._entries = {}
+        self._counter = count()
+        TreeIndex.__init__(self, root)
+
+    def get_largest(self, k: int) -> List[Tuple[TMTree, int]]:
+        """Return the <k> largest leaves of the tree, largest first, with
+        their data_size, or all of them if there are fewer than <k>.
+
+        Leaves of the same size are in the order they were last resized or
+        added in.
+        """
+        found = []
+        while self._heap and len(found) < k:
+            entry = heapq.heappop(self._heap)
+            if self._entries.get(entry[2]) is entry:
+                found.append(entry)
+        for entry in found:
+            heapq.heappush(self._heap, entry)
+        return [(entry[2], -entry[0]) for entry in found]
+
+    def _update(self, leaf: TMTree, old_size: Optional[int],
+                new_size: Optional[int]) -> None:
+        """Replace the entry of <leaf> in the heap by one of <new_size>, or
+        drop it if <new_size> is None.
+        """
+        if new_size is None:
+            del self._entries[leaf]
+        else:
+            entry = [-new_size, next(self._counter), leaf]
+            self._entries[leaf] = entry
+            heapq.heappush(self._heap, entry)
+        if len(self._heap) > 2 * len(self._entries) + _SLACK:
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+
+
+class GroupedIndex(TreeIndex):
+    """The total data_size of the leaves of a tree, grouped by keys taken
+    from each leaf.
+
+    This is an abstract class that should not be instantiated directly.
+    Subclasses give the keys of each leaf in _get_keys.
+
+    === Private Attributes ===
+    _totals:
+        The total data_size of the leaves with each key, for each key of at
+        least one leaf.
+    _counts:
+        The number of leaves with each key in _totals.
+    """
+    _totals: Dict[str, int]
+    _counts: Dict[str, int]
+
+    def __init__(self, root: TMTree) -> None:
+        """Initialize a new index of the leaves of the tree rooted at <root>,
+        and start listening to its changes.
+
+        Precondition: <root> has no parent.
+        """
+        self._totals = {}
+        self._counts = {}
+        TreeIndex.__init__(self, root)
+
+    def get_total(self, key: str) -> int:
+        """Return the total data_size of the leaves with <key>, or 0 if there
+        are none.
+        """
+        return self._totals.get(key, 0)
+
+    def get_totals(self) -> Dict[str, int]:
+        """Return the total data_size of the leaves with each key, for each
+        key of at least one leaf.
+        """
+        return dict(self._totals)
+
+    def get_largest(self, k: int) -> List[Tuple[str, int]]:
+        """Return the <k> keys with the largest totals, largest first, with
+        their totals, or all of them if there are fewer than <k>.
+        """
+        return heapq.nlargest(k, self._totals.items(),
+                              key=lambda item: item[1])
+
+    def _get_keys(self, leaf: TMTree) -> List[str]:
+        """Return the keys of <leaf>, without repeats.
+        """
+        raise NotImplementedError
+
+    def _update(self, leaf: TMTree, old_size: Optional[int],
+                new_size: Optional[int]) -> None:
+        """Move the data_size of <leaf> in the totals of its keys from
+        <old_size> to <new_size>.
+        """
+        for key in self._get_keys(leaf):
+            if old_size is None:
+                self._counts[key] = self._counts.get(key, 0) + 1
+                self._totals[key] = self._totals.get(key, 0) + new_size
+            elif new_size is None:
+                self._counts[key] -= 1
+                if self._counts[key] == 0:
+                    del self._counts[key], self._totals[key]
+                else:
+                    self._totals[key] -= old_size
+            else:
+                self._totals[key] += new_size - old_size
+
+
+class ExtensionIndex(GroupedIndex):
+    """The total size of the files of a FileSystemTree, by extension.
+
+    Extensions are lower-cased and include their dot, as in '.log'; the files
+    without one are grouped under ''. An empty folder counts as a file of
+    size 0, as it does in the treemap, but folders that have not been loaded
+    yet in a lazy FileSystemTree are left out until they are loaded.
+    """
+
+    def _get_keys(self, leaf: TMTree) -> List[str]:
+        """Return the extension of <leaf>.
+        """
+        return [os.path.splitext(leaf._name)[1].lower()]
+
+
+class AuthorIndex(GroupedIndex):
+    """The total citations of the papers of a PaperTree, by author.
+    """
+
+    def _get_keys(self, leaf: TMTree) -> List[str]:
+        """Return the authors of <leaf>, or no key if it is not a paper.
+        """
+        authors = getattr(leaf, '_authors', '')
+        return list(dict.fromkeys(author.strip()
+                                  for author in authors.split(' and ')
+                                  if author.strip()))
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'heapq', 'os', 'itertools', 'tm_trees'
+        ]
+    })
@@ -0,0 +1,370 @@
+"""Assignment 2: Instrumentation for Treemap
+
+=== CSC148 Winter 2019 ===
+
+=== Module Description ===
+This module measures where the visualiser spends its time. An
+Instrumentation wraps the operations of TMTree and its subclasses while it is
+enabled, and records how many times each one is called, how long it takes and
+how many nodes it visits. The event loop of the visualiser records the time
+of each of its phases in it too, when it is given one, and dumps a report
+when the 'i' key is pressed and when the window is closed.
+
+Nothing is measured unless an Instrumentation is enabled, and the methods of
+the trees are restored as they were once it is disabled:
+
+    instrumentation = Instrumentation(trace_memory=True)
+    with instrumentation:
+        tree = FileSystemTree(path)
+        run_visualisation(tree, instrumentation=instrumentation)
+    print(instrumentation.get_stats())
+
+A call made while the same operation is already running on a tree of the
+same class is counted as a node visited by the outer call rather than as a
+call of its own. So are the calls of the methods in VISITS, such as
+TMTree._lay_out, which the operations that walk a tree make once for each
+node they visit.
+"""
+import functools
+import sys
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from tm_trees import TMTree
+
+# The TMTree methods that are measured by default.
+OPERATIONS = ('__init__', 'update_rectangles', 'get_rectangles',
+              'fill_rectangles', 'get_tree_at_position', 'change_size',
+              'move', 'update_data_sizes', 'expand', 'expand_all',
+              'collapse', 'collapse_all', 'get_path_string')
+# The TMTree methods called once for each node visited by an operation.
+VISITS = ('_is_displayed_leaf', '_lay_out', '_add_up_size', '_expand_node')
+# The default number of most recent calls of each operation whose times are
+# kept to compute percentiles.
+_WINDOW = 1000
+# The number of lines of allocation sites in a memory report.
+_MEMORY_LINES = 10
+
+
+class TimingStats:
+    """The timing statistics of the calls of an operation, a phase of the
+    event loop, or of the frames it handles.
+
+    === Public Attributes ===
+    calls:
+        The number of calls recorded.
+    total_time:
+        The total time of the recorded calls, in seconds.
+    max_time:
+        The time of the slowest recorded call, in seconds.
+    visits:
+        The total number of nodes visited by the recorded calls.
+
+    === Private Attributes ===
+    _recent:
+        The times of the most recently recorded calls, oldest first.
+    """
+    calls: int
+    total_time: float
+    max_time: float
+    visits: int
+    _recent: Deque[float]
+
+    def __init__(self, window: int = _WINDOW) -> None:
+        """Initialize new statistics with no calls, which keep the times of
+        the last <window> calls to compute percentiles.
+        """
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.visits = 0
+        self._recent = deque(maxlen=window)
+
+    def record(self, seconds: float, visits: int = 0) -> None:
+        """Record a call that took <seconds> seconds and visited <visits>
+        nodes.
+        """
+        self.calls += 1
+        self.total_time += seconds
+        self.max_time = max(self.max_time, seconds)
+        self.visits += visits
+        self._recent.append(seconds)
+
+    def mean_time(self) -> float:
+        """Return the mean time of the recorded calls, in seconds.
+        """
+        return self.total_time / self.calls if self.calls else 0.0
+
+    def recent_percentile(self, percent: float) -> float:
+        """Return the time, in seconds, that <percent> percent of the most
+        recent calls took at most.
+        """
+        if not self._recent:
+            return 0.0
+        times = sorted(self._recent)
+        return times[min(len(times) - 1, int(len(times) * percent / 100))]
+
+    def to_dict(self) -> Dict[str, float]:
+        """Return these statistics as a dictionary, with times in seconds.
+        """
+        return {
+            'calls': self.calls,
+            'total': self.total_time,
+            'mean': self.mean_time(),
+            'p99': self.recent_percentile(99),
+            'max': self.max_time,
+            'visits per call': self.visits / self.calls if self.calls else 0.0
+        }
+
+
+class Instrumentation:
+    """Call counts, timings and memory use of the operations of TMTrees and
+    of the phases of the event loop, recorded while this is enabled.
+
+    Operations are keyed by the class of the tree they are called on and
+    their name, such as 'FileSystemTree.update_rectangles', and the phases of
+    the event loop by 'event_loop.' and their name.
+
+    Calls are only recorded from one thread at a time.
+
+    === Public Attributes ===
+    operations:
+        The names of the TMTree methods that are measured.
+    trace_memory:
+        Whether memory allocations are traced with tracemalloc.
+    dump_path:
+        The file that reports are appended to, or None to write them to
+        standard error.
+
+    === Private Attributes ===
+    _stats:
+        The statistics of each operation and phase, keyed by its name.
+    _running:
+        The names of the operations that are running, innermost last.
+    _visits:
+        The number of nodes visited so far by each running operation, keyed
+        by its name.
+    _last_visited:
+        The node visited last by each running operation, keyed by its name,
+        so that a method that calls its superclass's version does not count
+        its node twice.
+    _patched:
+        The class, name and original value of every method replaced while
+        this is enabled.
+    _baseline:
+        The memory snapshot taken when this was enabled, or None if memory is
+        not traced.
+    """
+    operations: Tuple[str, ...]
+    trace_memory: bool
+    dump_path: Optional[str]
+    _stats: Dict[str, TimingStats]
+    _running: List[str]
+    _visits: Dict[str, int]
+    _last_visited: Dict[str, TMTree]
+    _patched: List[Tuple[type, str, Callable]]
+    _baseline: Optional[tracemalloc.Snapshot]
+
+    def __init__(self, operations: Tuple[str, ...] = OPERATIONS,
+                 trace_memory: bool = False,
+                 dump_path: Optional[str] = None) -> None:
+        """Initialize a new, disabled instrumentation of the given TMTree
+        <operations>, with nothing recorded.
+
+        If <trace_memory>, memory allocations are traced while this is
+        enabled, which slows every allocation down.
+        """
+        self.operations = operations
+        self.trace_memory = trace_memory
+        self.dump_path = dump_path
+        self._stats = {}
+        self._running = []
+        self._visits = {}
+        self._last_visited = {}
+        self._patched = []
+        self._baseline = None
+
+    def enable(self) -> None:
+        """Start measuring the operations of TMTree and of every subclass of
+        it defined so far.
+
+        Do nothing if this is already enabled.
+        """
+        if self._patched:
+            return
+        classes = [TMTree]
+        for cls in classes:
+            classes.extend(cls.__subclasses__())
+            for name in self.operations:
+                if name in cls.__dict__:
+                    self._patch(cls, name, self._wrap_operation(
+                        name, cls.__dict__[name]))
+            for name in VISITS:
+                if name in cls.__dict__:
+                    self._patch(cls, name,
+                                self._wrap_visit(cls.__dict__[name]))
+        if self.trace_memory:
+            tracemalloc.start()
+            self._baseline = tracemalloc.take_snapshot()
+
+    def disable(self) -> None:
+        """Stop measuring, and restore the methods of the trees.
+
+        What was recorded is kept.
+        """
+        for cls, name, method in reversed(self._patched):
+            setattr(cls, name, method)
+        self._patched = []
+        if self._baseline is not None:
+            tracemalloc.stop()
+            self._baseline = None
+
+    def __enter__(self) -> 'Instrumentation':
+        """Enable this instrumentation, and return it.
+        """
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        """Disable this instrumentation.
+        """
+        self.disable()
+
+    def _patch(self, cls: type, name: str, method: Callable) -> None:
+        """Replace the method <name> of <cls> with <method> until this is
+        disabled.
+        """
+        self._patched.append((cls, name, cls.__dict__[name]))
+        setattr(cls, name, method)
+
+    def _wrap_operation(self, name: str, method: Callable) -> Callable:
+        """Return a version of the TMTree <method> called <name> that records
+        its calls.
+        """
+        @functools.wraps(method)
+        def wrapper(tree: TMTree, *args: object, **kwargs: object) -> object:
+            key = type(tree).__name__ + '.' + name
+            if key in self._visits:
+                if self._last_visited[key] is not tree:
+                    self._visits[key] += 1
+                    self._last_visited[key] = tree
+                return method(tree, *args, **kwargs)
+            self._running.append(key)
+            self._visits[key] = 1
+            self._last_visited[key] = tree
+            start = time.perf_counter()
+            try:
+                return method(tree, *args, **kwargs)
+            finally:
+                self.record(key, time.perf_counter() - start,
+                            self._visits.pop(key))
+                del self._last_visited[key]
+                self._running.pop()
+        return wrapper
+
+    def _wrap_visit(self, method: Callable) -> Callable:
+        """Return a version of the TMTree <method> whose calls count as node
+        visits of the innermost running operation.
+        """
+        @functools.wraps(method)
+        def wrapper(tree: TMTree, *args: object, **kwargs: object) -> object:
+            if self._running:
+                key = self._running[-1]
+                if self._last_visited[key] is not tree:
+                    self._visits[key] += 1
+                    self._last_visited[key] = tree
+            return method(tree, *args, **kwargs)
+        return wrapper
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Record the time taken by the body of a with statement as a call of
+        the event loop phase <name>.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record('event_loop.' + name, time.perf_counter() - start, 0)
+
+    def record(self, name: str, seconds: float, visits: int = 0) -> None:
+        """Record a call of the operation or phase <name> that took <seconds>
+        seconds and visited <visits> nodes.
+        """
+        if name not in self._stats:
+            self._stats[name] = TimingStats()
+        self._stats[name].record(seconds, visits)
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Return the call count, total, mean, p99 and maximum times, in
+        seconds, and mean number of nodes visited per call, of every
+        operation and phase recorded so far, keyed by its name.
+
+        The p99 time is that of the most recent calls only.
+        """
+        return {name: stats.to_dict() for name, stats in self._stats.items()}
+
+    def get_memory_stats(self, limit: int = _MEMORY_LINES) \
+            -> List[Tuple[str, int, int]]:
+        """Return the <limit> source lines whose allocations grew the most
+        since this was enabled, with the growth in bytes and in number of
+        blocks of each, largest first.
+
+        Return an empty list if memory is not being traced.
+        """
+        if self._baseline is None:
+            return []
+        differences = tracemalloc.take_snapshot().compare_to(self._baseline,
+                                                             'lineno')
+        return [(str(difference.traceback), difference.size_diff,
+                 difference.count_diff)
+                for difference in differences[:limit]]
+
+    def reset(self) -> None:
+        """Forget everything recorded so far.
+        """
+        self._stats = {}
+        if self._baseline is not None:
+            self._baseline = tracemalloc.take_snapshot()
+
+    def dump(self) -> None:
+        """Write a report of everything recorded so far to dump_path, or to
+        standard error if it is None.
+        """
+        lines = ['{:<40}{:>8}{:>11}{:>10}{:>10}{:>10}{:>10}'.format(
+            'operation', 'calls', 'total ms', 'mean ms', 'p99 ms', 'max ms',
+            'visits')]
+        stats = self.get_stats()
+        for name in sorted(stats, key=lambda key: -stats[key]['total']):
+            row = stats[name]
+            lines.append(
+                '{:<40}{:>8}{:>11.2f}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.1f}'
+                .format(name, row['calls'], 1000 * row['total'],
+                        1000 * row['mean'], 1000 * row['p99'],
+                        1000 * row['max'], row['visits per call']))
+        if self._baseline is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            lines.append('memory: {:,} bytes traced, {:,} bytes at peak'
+                         .format(current, peak))
+            for site, size, count in self.get_memory_stats():
+                lines.append('{:>+14,} bytes {:>+9,} blocks  {}'.format(
+                    size, count, site))
+
+        report = '\n'.join(lines) + '\n\n'
+        if self.dump_path is None:
+            sys.stderr.write(report)
+        else:
+            with open(self.dump_path, 'a') as file:
+                file.write(report)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'functools', 'sys', 'time', 'tracemalloc',
+            'collections', 'contextlib', 'tm_trees'
+        ]
+    })
@@ -0,0 +1,466 @@
+"""Assignment 2: Layout engines for Treemap
+
+=== CSC148 Winter 2019 ===
+
+=== Module Description ===
+This module contains the layout strategies that the treemap visualiser can
+use to compute the rectangles of a TMTree. Any strategy works with any TMTree
+subclass, since they only use the attributes defined by TMTree, and with the
+views of a CompactTree store, whose nodes they reach through the store.
+
+SliceAndDiceLayout is the layout of TMTree.update_rectangles, which splits
+each rectangle into strips along its longer side. VectorisedLayout computes
+exactly the same rectangles with vectorised_layout, one level of the tree at
+a time, with NumPy array arithmetic over all of the nodes of the level
+instead of a Python function call per node; NumPy is only needed to use it.
+SquarifiedLayout computes a squarified treemap, whose rectangles are as
+close to squares as the algorithm can make them. VisibleLayout computes the
+rectangles of update_rectangles too, but only for the trees that are
+displayed, so the many collapsed trees of a large tree are never given one.
+"""
+from typing import Iterable, List, Optional, Tuple, Union
+from tm_trees import TMTree
+from compact_tree import CompactNode, CompactTree
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class LayoutStrategy:
+    """A way of computing the rectangles of a TMTree.
+
+    This is an abstract class that should not be instantiated directly.
+    """
+
+    def layout(self, tree: TMTree, rect: Tuple[int, int, int, int]) -> None:
+        """Update the rectangles in <tree> and its descendents to fill the
+        area defined by pygame rectangle <rect>.
+        """
+        raise NotImplementedError
+
+
+class SliceAndDiceLayout(LayoutStrategy):
+    """The layout of TMTree.update_rectangles, which only lays out again the
+    subtrees that changed.
+    """
+
+    def layout(self, tree: TMTree, rect: Tuple[int, int, int, int]) -> None:
+        """Update the rectangles in <tree> and its descendents to fill the
+        area defined by pygame rectangle <rect>.
+        """
+        tree.update_rectangles(rect)
+
+
+class VectorisedLayout(LayoutStrategy):
+    """The layout of TMTree.update_rectangles, computed by
+    vectorised_layout.
+    """
+
+    def layout(self, tree: TMTree, rect: Tuple[int, int, int, int]) -> None:
+        """Update the rectangles in <tree> and its descendents to fill the
+        area defined by pygame rectangle <rect>.
+        """
+        vectorised_layout(tree, rect)
+
+
+class SquarifiedLayout(LayoutStrategy):
+    """The squarified treemap layout of Bruls, Huizing and van Wijk.
+
+    The subtrees of each tree are placed in decreasing order of size, in rows
+    along the shorter side of the space that is left, and a row is closed as
+    soon as adding the next subtree would make its worst aspect ratio worse.
+    Laying out a tree of n nodes takes O(n log n) time, for the sorting.
+
+    Rectangle corners are rounded to whole pixels, so neighbouring
+    rectangles share their edges exactly.
+    """
+
+    def layout(self, tree: TMTree, rect: Tuple[int, int, int, int]) -> None:
+        """Update the rectangles in <tree> and its descendents to fill the
+        area defined by pygame rectangle <rect>.
+
+        As in TMTree.update_rectangles, trees with a data_size of 0 are not
+        laid out. Every tree that is laid out is left marked as dirty, so that
+        TMTree.update_rectangles does not mistake its squarified rectangles for
+        its own.
+
+        >>> sizes = [6, 6, 4, 3, 2, 2, 1]
+        >>> leaves = [TMTree(str(i), [], size) for i, size in enumerate(sizes)]
+        >>> tree = TMTree('root', leaves)
+        >>> tree.expand_all()
+        >>> SquarifiedLayout().layout(tree, (0, 0, 600, 400))
+        >>> [leaf.rect for leaf in leaves[:3]]
+        [(0, 0, 300, 200), (0, 200, 300, 200), (300, 0, 171, 233)]
+        >>> tree.get_tree_at_position((500, 300))._name
+        '5'
+        >>> tree.get_tree_at_position((300, 200))._name
+        '0'
+        """
+        nodes, root = _get_nodes(tree)
+        if nodes.size(root) == 0:
+            return
+        stack = [([root], [rect])]
+        while stack:
+            group, rects = stack.pop()
+            parents, counts, children, sizes = nodes.place_all(group, rects,
+                                                               True, None)
+            start = 0
+            for i, count in zip(parents, counts):
+                subtrees = []
+                subtree_sizes = []
+                for j in range(start, start + count):
+                    if sizes[j] > 0:
+                        subtrees.append(children[j])
+                        subtree_sizes.append(sizes[j])
+                start += count
+                if subtrees:
+                    stack.append((subtrees,
+                                  _squarify(subtree_sizes, rects[i])))
+
+
+class VisibleLayout(LayoutStrategy):
+    """The layout of TMTree.update_rectangles, computed only for the trees in
+    the displayed-tree.
+
+    The subtrees of a collapsed tree, and of a tree whose rectangle is less
+    than min_pixels wide or high, are not drawn, so they are not laid out
+    either and keep whatever rectangles they had. Laying out a tree takes
+    time in the number of trees displayed, not in the size of the tree.
+
+    === Public Attributes ===
+    min_pixels:
+        The width or height, in pixels, below which a tree is drawn as a
+        single block, as in TMTree.get_rectangles.
+    """
+    min_pixels: int
+
+    def __init__(self, min_pixels: int = 0) -> None:
+        """Initialize a new layout of the displayed-trees of <min_pixels>.
+        """
+        self.min_pixels = min_pixels
+
+    def layout(self, tree: TMTree, rect: Tuple[int, int, int, int]) -> None:
+        """Update the rectangles in <tree> and its displayed descendents to
+        fill the area defined by pygame rectangle <rect>.
+
+        As in TMTree.update_rectangles, trees with a data_size of 0 are not
+        laid out. Every tree that is laid out is left marked as dirty, since
+        its subtrees may not have been, so that TMTree.update_rectangles lays
+        it out in full if it is used later.
+        """
+        nodes, root = _get_nodes(tree)
+        size = nodes.size(root)
+        if size == 0:
+            return
+        stack = [([root], [rect], [size])]
+        while stack:
+            group, rects, sizes = stack.pop()
+            parents, counts, children, child_sizes = nodes.place_all(
+                group, rects, True, self.min_pixels)
+            start = 0
+            for i, count in zip(parents, counts):
+                end = start + count
+                stack.append(_slice(sizes[i], children[start:end],
+                                    child_sizes[start:end], rects[i]))
+                start = end
+
+
+class _TreeNodes:
+    """The nodes of a tree of TMTrees, as the layout strategies reach them:
+    each node is a TMTree.
+    """
+
+    def size(self, node: TMTree) -> int:
+        """Return the data_size of <node>.
+        """
+        return node.data_size
+
+    def place_all(self, nodes: List[TMTree],
+                  rects: Iterable[Tuple[int, int, int, int]], dirty: bool,
+                  min_pixels: Optional[int]) \
+            -> Tuple[List[int], List[int], List[TMTree], List[int]]:
+        """Give each of <nodes> the rectangle at the same position in <rects>,
+        and mark it as <dirty>, or as laid out by TMTree.update_rectangles if
+        not.
+
+        Return the positions in <nodes> of those that have subtrees, in
+        increasing order, the number of subtrees of each of them, and all of
+        their subtrees, in order, with the data_size of each. If <min_pixels>
+        is not None, the nodes that are drawn as a single rectangle, as in
+        TMTree._is_displayed_leaf, are left out.
+        """
+        parents = []
+        counts = []
+        children = []
+        for i, (node, rect) in enumerate(zip(nodes, rects)):
+            node.rect = rect
+            node._dirty = dirty
+            node._hit_index = None
+            subtrees = node._subtrees
+            if subtrees and (min_pixels is None or
+                             not node._is_displayed_leaf(min_pixels)):
+                parents.append(i)
+                counts.append(len(subtrees))
+                children.extend(subtrees)
+        return parents, counts, children, [child.data_size
+                                           for child in children]
+
+
+class _StoreNodes:
+    """The nodes of a CompactTree store, as the layout strategies reach them:
+    each node is its index in the store. A store keeps no record of which of
+    its nodes are laid out, so they are never marked as dirty.
+
+    === Private Attributes ===
+    _store:
+        The store that holds the nodes.
+    """
+    _store: CompactTree
+
+    def __init__(self, store: CompactTree) -> None:
+        """Initialize the nodes of <store>.
+        """
+        self._store = store
+
+    def size(self, node: int) -> int:
+        """Return the data_size of node <node>.
+        """
+        return self._store._sizes[node]
+
+    def place_all(self, nodes: List[int],
+                  rects: Iterable[Tuple[int, int, int, int]], dirty: bool,
+                  min_pixels: Optional[int]) \
+            -> Tuple[List[int], List[int], List[int], List[int]]:
+        """Give each of <nodes> the rectangle at the same position in <rects>,
+        and return the positions of those that have children, their number
+        of children, and their children with the data_size of each, as
+        _TreeNodes.place_all does.
+        """
+        store = self._store
+        parents = []
+        counts = []
+        children = []
+        for i, (node, rect) in enumerate(zip(nodes, rects)):
+            store._set_rect(node, rect)
+            if not store._is_leaf(node) and (
+                    min_pixels is None or
+                    not store._is_displayed_leaf(node, min_pixels)):
+                node_children = store._children(node)
+                parents.append(i)
+                counts.append(len(node_children))
+                children.extend(node_children)
+        return parents, counts, children, [store._sizes[child]
+                                           for child in children]
+
+
+def _get_nodes(tree: Union[TMTree, CompactNode]) \
+        -> Tuple[Union[_TreeNodes, _StoreNodes], Union[TMTree, int]]:
+    """Return the nodes of the tree that <tree> is part of, and <tree> as one
+    of those nodes.
+    """
+    if isinstance(tree, CompactNode):
+        return _StoreNodes(tree._store), tree._index
+    return _TreeNodes(), tree
+
+
+def _slice(size: int, subtrees: list, sizes: List[int],
+           rect: Tuple[int, int, int, int]) \
+        -> Tuple[list, List[Tuple[int, int, int, int]], List[int]]:
+    """Return the <subtrees> of a tree of data_size <size> whose data_size,
+    given in <sizes>, is greater than 0, the rectangle that
+    TMTree.update_rectangles gives each of them when the tree is given
+    <rect>, and their data_size.
+    """
+    x, y, width, height = rect
+    last = len(subtrees) - 1
+    placed = []
+    rects = []
+    placed_sizes = []
+    for i, (subtree, subtree_size) in enumerate(zip(subtrees, sizes)):
+        if i < last:
+            ratio = subtree_size / size
+            if width > height:
+                subtree_rect = (x, y, int(width * ratio), height)
+                x += subtree_rect[2]
+            else:
+                subtree_rect = (x, y, width, int(height * ratio))
+                y += subtree_rect[3]
+        elif width > height:
+            subtree_rect = (x, y, width + rect[0] - x, height)
+        else:
+            subtree_rect = (x, y, width, height + rect[1] - y)
+        if subtree_size > 0:
+            placed.append(subtree)
+            rects.append(subtree_rect)
+            placed_sizes.append(subtree_size)
+    return placed, rects, placed_sizes
+
+
+def _squarify(sizes: List[int], rect: Tuple[int, int, int, int]) \
+        -> List[Tuple[int, int, int, int]]:
+    """Return the rectangles, in the same order as <sizes>, that a
+    squarified treemap gives to items of the given <sizes> inside <rect>.
+
+    If <rect> has no area, every item gets an empty rectangle at its corner.
+
+    Precondition: every element of <sizes> is positive.
+    """
+    x, y, width, height = rect
+    if width == 0 or height == 0:
+        return [(x, y, 0, 0)] * len(sizes)
+    order = sorted(range(len(sizes)), key=lambda i: -sizes[i])
+    scale = width * height / sum(sizes)
+    areas = [sizes[i] * scale for i in order]
+    left, top, right, bottom = float(x), float(y), float(x + width), \
+        float(y + height)
+
+    rects = [None] * len(sizes)
+    start = 0
+    while start < len(areas):
+        # Grow the row while that improves its worst aspect ratio
+        short_side = min(right - left, bottom - top)
+        end = start + 1
+        total = areas[start]
+        worst = _get_worst_ratio(total, areas[start], areas[start], short_side)
+        while end < len(areas):
+            ratio = _get_worst_ratio(total + areas[end], areas[start],
+                                     areas[end], short_side)
+            if ratio > worst:
+                break
+            total += areas[end]
+            worst = ratio
+            end += 1
+
+        # Place the row along the shorter side of the space that is left
+        if right - left >= bottom - top:
+            row_end = right
+            if end < len(areas) and bottom > top:
+                row_end = left + total / (bottom - top)
+            edge = top
+            for k in range(start, end):
+                next_edge = bottom
+                if k < end - 1:
+                    next_edge = edge + (bottom - top) * areas[k] / total
+                rects[order[k]] = _round_rect(left, edge, row_end, next_edge)
+                edge = next_edge
+            left = row_end
+        else:
+            row_end = bottom
+            if end < len(areas):
+                row_end = top + total / (right - left)
+            edge = left
+            for k in range(start, end):
+                next_edge = right
+                if k < end - 1:
+                    next_edge = edge + (right - left) * areas[k] / total
+                rects[order[k]] = _round_rect(edge, top, next_edge, row_end)
+                edge = next_edge
+            top = row_end
+        start = end
+    return rects
+
+
+def _get_worst_ratio(total: float, largest: float, smallest: float,
+                     side: float) -> float:
+    """Return the worst aspect ratio in a row of rectangles laid along a side
+    of length <side>, whose areas add up to <total> and range from <smallest>
+    to <largest>.
+    """
+    if smallest == 0 or side == 0:
+        return float('inf')
+    return max(side * side * largest / (total * total),
+               total * total / (side * side * smallest))
+
+
+def _round_rect(left: float, top: float, right: float,
+                bottom: float) -> Tuple[int, int, int, int]:
+    """Return the pygame rectangle with the given edges, rounded to whole
+    pixels.
+    """
+    x, y = round(left), round(top)
+    return x, y, round(right) - x, round(bottom) - y
+
+
+def vectorised_layout(tree: TMTree, rect: Tuple[int, int, int, int]) -> None:
+    """Update the rectangles in <tree> and its descendents to fill the area
+    defined by pygame rectangle <rect>, exactly as
+    tree.update_rectangles(rect) would, processing one level of the tree at
+    a time.
+
+    Every tree that is laid out is left marked as clean, as
+    TMTree.update_rectangles leaves it.
+
+    Raise an ImportError if NumPy is not installed.
+    """
+    if np is None:
+        raise ImportError('vectorised_layout requires NumPy')
+    nodes, root = _get_nodes(tree)
+    size = nodes.size(root)
+    if size == 0:
+        return
+    parents, counts, children, child_sizes = nodes.place_all([root], [rect],
+                                                             False, None)
+    rects = np.array([rect], dtype=np.int64)
+    sizes = np.array([size], dtype=np.int64)
+    while parents:
+        counts = np.array(counts, dtype=np.int64)
+        child_sizes = np.array(child_sizes, dtype=np.int64)
+        child_rects = _split(rects, sizes, counts, child_sizes)
+
+        # Only the children with a size are laid out, as in update_rectangles
+        laid_out = np.flatnonzero(child_sizes)
+        if len(laid_out) < len(children):
+            children = [children[i] for i in laid_out.tolist()]
+        parents, counts, next_children, next_sizes = nodes.place_all(
+            children, zip(*child_rects[laid_out].T.tolist()), False, None)
+        next_parents = laid_out[parents]
+        rects = child_rects[next_parents]
+        sizes = child_sizes[next_parents]
+        children, child_sizes = next_children, next_sizes
+
+
+def _split(rects: 'np.ndarray', sizes: 'np.ndarray', counts: 'np.ndarray',
+           child_sizes: 'np.ndarray') -> 'np.ndarray':
+    """Return the rectangles of all of the children of a level of the tree,
+    as an array with one (x, y, width, height) row per child.
+
+    Row i of <rects> is the rectangle of the i-th parent of the level, whose
+    size is <sizes>[i] and which has <counts>[i] children. <child_sizes>
+    holds the sizes of the children of every parent, in order.
+
+    Each parent is split along its longer side, the way
+    TMTree.update_rectangles does: every child but the last gets the
+    truncated share of the side given by its size, and the last child gets
+    whatever is left.
+    """
+    parent_of = np.repeat(np.arange(len(counts)), counts)
+    along_x = rects[:, 2] > rects[:, 3]
+    side = np.where(along_x, rects[:, 2], rects[:, 3])[parent_of]
+
+    shares = (side * (child_sizes / sizes[parent_of])).astype(np.int64)
+    ends = np.cumsum(counts)
+    lasts = ends[counts > 0] - 1
+    totals = np.cumsum(shares)
+    offsets = totals - shares
+    firsts = ends - counts
+    offsets -= np.where(firsts > 0, totals[firsts - 1], 0)[parent_of]
+    shares[lasts] = side[lasts] - offsets[lasts]
+
+    child_rects = rects[parent_of].copy()
+    child_along_x = along_x[parent_of]
+    child_rects[child_along_x, 0] += offsets[child_along_x]
+    child_rects[child_along_x, 2] = shares[child_along_x]
+    child_rects[~child_along_x, 1] += offsets[~child_along_x]
+    child_rects[~child_along_x, 3] = shares[~child_along_x]
+    return child_rects
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'numpy', 'tm_trees', 'compact_tree'
+        ]
+    })
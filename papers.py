@@ -59,12 +59,25 @@ Recommended steps:
    on your code.
 """
 import csv
-from typing import List, Dict, Union
+import io
+import locale
+import os
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple, Union
+from columnar import ColumnFile, write_columns
 from tm_trees import TMTree
 
 # Filename for the dataset
 DATA_FILE = '/app/data11/cs1_papers.csv'
 
+# The version of the format of the binary caches of the dataset.
+_CACHE_VERSION = 1
+
+# A tree of papers encoded by _encode_tree
+_Part = Tuple[List[str], List[int], List[int], List[str], List[str]]
+
 
 class PaperTree(TMTree):
     """A tree representation of Computer Science Education research paper data.
@@ -83,7 +96,8 @@ class PaperTree(TMTree):
     data_size:
         The size of the data represented by this tree.
     _colour:
-        The RGB colour value of the root of this tree.
+        The RGB colour value of the root of this tree, or None if it has not
+        been derived from the tree's path yet.
     _name:
         The root value of this tree, or None if this tree is empty.
     _subtrees:
@@ -102,7 +116,8 @@ class PaperTree(TMTree):
 
     def __init__(self, name: str, subtrees: List[TMTree], authors: str = '',
                  doi: str = '', citations: int = 0, by_year: bool = True,
-                 all_papers: bool = False) -> None:
+                 all_papers: bool = False, workers: int = 0,
+                 cache_file: Optional[str] = None) -> None:
         """Initialize a new PaperTree with the given <name> and <subtrees>,
         <authors> and <doi>, and with <citations> as the size of the data.
 
@@ -115,21 +130,30 @@ class PaperTree(TMTree):
         <by_year> indicates whether or not the first level of subtrees should be
         the years, followed by each category, subcategory, and so on. If
         <by_year> is False, then the year in the dataset is simply ignored.
+
+        If <workers> is positive, DATA_FILE is split into chunks of whole lines,
+        a pool of that many processes builds the tree of the papers in each
+        chunk, and these trees are merged one category at a time. This builds
+        the same tree, provided that no field in DATA_FILE contains a line
+        break.
+
+        If <cache_file> is given, the papers are read from the binary cache
+        of DATA_FILE at that path instead, without parsing any text. The
+        cache is made from DATA_FILE first if it is missing, or if DATA_FILE
+        changed since it was made.
         """
 
         self._authors = authors
         self._url = doi
 
         if all_papers:
-            if by_year:
-                dictionary_1 = _load_papers_to_dict(by_year)
-                sub_ro = _build_tree_from_dict(dictionary_1)
-                TMTree.__init__(self, name, sub_ro)
-
+            TMTree.__init__(self, name, [])
+            if cache_file is not None:
+                _insert_papers(self, _read_cached_papers(cache_file, by_year))
+            elif workers > 0:
+                _build_parallel(self, by_year, workers)
             else:
-                dictionary_1 = _load_papers_to_dict(False)
-                sub_ro = _build_tree_from_dict(dictionary_1)
-                TMTree.__init__(self, name, sub_ro)
+                _insert_papers(self, _read_papers(by_year))
         else:
             TMTree.__init__(self, name, subtrees, citations)
 
@@ -147,66 +171,388 @@ class PaperTree(TMTree):
             return ' (Category)'
 
 
-def _load_papers_to_dict(by_year: bool = True) -> Dict:
-    """Return a nested dictionary of the data read from the papers dataset file.
+def _read_papers(by_year: bool = True) \
+        -> Iterator[Tuple[List[str], str, int, str, str]]:
+    """Yield the category path, title, citations, doi and authors of each
+    paper in the papers dataset file, one row at a time.
 
-    If <by_year>, then use years as the roots of the subtrees of the root of
-    the whole tree. Otherwise, ignore years and use categories only.
+    If <by_year>, then the year of the paper comes first in its category
+    path. Category names are interned, so that each name is only stored once
+    however many papers are in its category.
     """
-
-    to_return = {}
     with open(DATA_FILE) as csvfile:
         to_read = csv.reader(csvfile)
         next(to_read)
         for line in to_read:
-            category = line[3].split(':')
-            leaf = [line[1], int(line[5]), line[4], line[0]]
-            if by_year:
-                category = [line[2]] + category
-            _add_to_dict(to_return, category, leaf)
-    return to_return
+            yield _parse_row(line, by_year)
+
 
+def _parse_row(line: List[str], by_year: bool) \
+        -> Tuple[List[str], str, int, str, str]:
+    """Return the category path, title, citations, doi and authors of the
+    paper in the row <line> of the papers dataset file, as _read_papers
+    does.
+    """
+    year = line[2] if by_year else None
+    return (_parse_category(line[3], year), line[1], int(line[5]), line[4],
+            line[0])
 
-def _add_to_dict(tree: Dict, category: List, leaf: List) -> None:
-    """"""
 
-    if len(category) == 0:
-        tree[leaf[0]] = leaf[1:]
-    elif len(category) == 1:
-        if category[0] not in tree:
-            tree[category[0]] = {}
-        tree[category[0]][leaf[0]] = leaf[1:]
-    else:
-        if category[0] not in tree:
-            tree[category[0]] = {}
-        _add_to_dict(tree[category[0]], category[1:], leaf)
+def _parse_category(category: str, year: Optional[str]) -> List[str]:
+    """Return the category path given by the colon-separated <category>
+    of a paper, preceded by its <year> unless <year> is None.
 
+    The names in the path are interned, so that each name is only stored
+    once however many papers are in its category.
+    """
+    path = [sys.intern(name) for name in category.split(':')]
+    if year is not None:
+        path.insert(0, sys.intern(year))
+    return path
+
+
+def _build_parallel(root: PaperTree, by_year: bool, workers: int) -> None:
+    """Add the papers of the papers dataset file to <root>, as _insert_papers
+    does with the papers read by _read_papers, on a pool of <workers>
+    processes.
+
+    Each process builds the tree of the papers in a chunk of the file, with
+    the data_size of its categories already added up, as in _load_chunk.
+    The trees are merged into <root> in the order of their chunks, so that
+    the parent process only visits the categories that more than one chunk
+    has, and their subtrees, instead of inserting every paper again.
+    """
+    chunks = _split_lines(DATA_FILE, 4 * workers)
+    # The subtrees of each category of <root>, by name, while it is built
+    index = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for part, papers in pool.map(_load_chunk, [DATA_FILE] * len(chunks),
+                                     [start for start, _ in chunks],
+                                     [end for _, end in chunks],
+                                     [by_year] * len(chunks)):
+            if part is None:
+                _insert_papers(root, papers, index)
+            else:
+                _merge_papers(root, part, index)
 
-        #
-        # for line in
+
+def _split_lines(path: str, count: int) -> List[Tuple[int, int]]:
+    """Return the start and end offsets of up to <count> chunks of about
+    the same size that cover the lines of the file at <path> after its
+    first line, and each start at the beginning of a line.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as file:
+        bounds = [_next_line(file, 0)]
+        for i in range(1, count):
+            bounds.append(_next_line(file, max(size * i // count,
+                                               bounds[-1])))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:])
+            if start < end]
+
+
+def _next_line(file: io.BufferedReader, offset: int) -> int:
+    """Return the offset of the first line of the binary <file> that starts
+    after <offset>, or the size of the file if there is none.
+    """
+    file.seek(offset)
+    while True:
+        block = file.read(64 * 1024)
+        if not block:
+            return file.tell()
+        ends = [i for i in (block.find(b'\n'), block.find(b'\r')) if i >= 0]
+        if ends:
+            # a '\r\n' split here leaves an empty line, which is skipped
+            return offset + min(ends) + 1
+        offset += len(block)
+
+
+def _load_chunk(path: str, start: int, end: int, by_year: bool) \
+        -> Tuple[Optional[_Part], List[Tuple[List[str], str, int, str, str]]]:
+    """Return the tree of the papers in the bytes from <start> to <end> of
+    the papers dataset file at <path>, as _insert_papers builds it, encoded
+    as by _encode_tree, and no papers.
+
+    If a paper in the chunk has the same path as a category, the tree does
+    not say which of its data came from the paper. In that case, return
+    None and the papers themselves instead, to be inserted one by one.
+    """
+    with open(path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    text = data.decode(locale.getpreferredencoding(False))
+
+    papers = [_parse_row(line, by_year)
+              for line in csv.reader(io.StringIO(text, newline='')) if line]
+    tree = PaperTree('', [])
+    if _insert_papers(tree, papers):
+        return _encode_tree(tree), []
+    return None, papers
+
+
+def _encode_tree(tree: PaperTree) -> _Part:
+    """Return the name, data_size, authors and doi of each tree in <tree>,
+    in pre-order, and the position in that order of its parent, or -1 for
+    <tree> itself, as five lists.
+
+    These lists are sent between processes far faster than the trees
+    themselves.
+    """
+    names, sizes, parents, authors, dois = [], [], [], [], []
+    stack = [(tree, -1)]
+    while stack:
+        node, parent = stack.pop()
+        parents.append(parent)
+        names.append(node._name)
+        sizes.append(node.data_size)
+        authors.append(node._authors)
+        dois.append(node._url)
+        stack.extend((subtree, len(names) - 1)
+                     for subtree in reversed(node._subtrees))
+    return names, sizes, parents, authors, dois
+
+
+def _merge_papers(root: PaperTree, part: _Part,
+                  index: Dict[PaperTree, Dict[str, PaperTree]]) -> None:
+    """Add the papers of <part>, a tree encoded by _encode_tree in which no
+    paper has the same path as a category, to <root>, as if they were
+    inserted by _insert_papers after those already in it.
+
+    A subtree of <part> whose name is not in its category of <root> is added
+    as it is. A category that is in both is merged into the one of <root>,
+    and a paper replaces the tree of <root> with its name in place, as
+    _insert_papers does. The data_size of each category of <root> is then
+    updated once, by what was merged into it. <index> maps trees of <root>
+    to their subtrees by name, as in _insert_papers, and is updated.
+    """
+    names, sizes, parents, authors, dois = part
+    # The tree of <root> that each tree of <part> was merged into or added
+    # as, and whether it was added
+    trees = [root]
+    added = [False]
+    # The trees of <root> merged into, each before its subtrees, and the
+    # change to the data_size of each of them
+    merged = [root]
+    changes = {root: 0}
+    last = len(names) - 1
+    for i in range(1, len(names)):
+        parent = parents[i]
+        tree = trees[parent]
+        if not added[parent]:
+            subtrees = index.get(tree)
+            if subtrees is None:
+                subtrees = _get_index(tree, index)
+            old = subtrees.get(names[i])
+            if old is not None:
+                trees.append(old)
+                added.append(False)
+                if i < last and parents[i + 1] == i:
+                    merged.append(old)
+                    changes[old] = 0
+                else:
+                    old._authors = authors[i]
+                    old._url = dois[i]
+                    changes[tree] += sizes[i] - old.data_size
+                    old.data_size = sizes[i]
+                continue
+            changes[tree] += sizes[i]
+
+        subtree = PaperTree(names[i], [], authors[i], dois[i], sizes[i])
+        subtree._parent_tree = tree
+        tree._subtrees.append(subtree)
+        if not added[parent]:
+            subtrees[names[i]] = subtree
+        trees.append(subtree)
+        added.append(True)
+
+    for tree in reversed(merged):
+        tree.data_size += changes[tree]
+        if tree is not root:
+            changes[tree._parent_tree] += changes[tree]
+
+
+def _read_cached_papers(cache_file: str, by_year: bool = True) \
+        -> Iterator[Tuple[List[str], str, int, str, str]]:
+    """Yield the papers of the papers dataset file as _read_papers does,
+    from its binary cache at <cache_file>, which is made first if it is
+    missing or out of date.
+
+    The cache is a column file (see columnar.py) holding the titles, dois
+    and citations of the papers in order, and their years, authors and
+    category paths encoded as indexes into tables of distinct values. Papers
+    with the same category path, and year if <by_year>, are yielded the same
+    category list.
+    """
+    columns = _open_cache(cache_file)
+    if columns is None:
+        _write_cache(cache_file)
+        columns = _open_cache(cache_file)
+        if columns is None:
+            # DATA_FILE changed while the cache was made
+            yield from _read_papers(by_year)
+            return
+    try:
+        titles = columns.strings('titles')
+        dois = columns.strings('dois')
+        citations = columns.numbers('citations').tolist()
+        years = columns.numbers('years').tolist()
+        authors = columns.numbers('authors').tolist()
+        categories = columns.numbers('categories').tolist()
+        year_names = columns.strings('year_names')
+        author_names = columns.strings('author_names')
+        category_names = columns.strings('category_names')
+    finally:
+        columns.close()
+
+    paths = {}
+    for title, doi, paper_citations, year, paper_authors, category in zip(
+            titles, dois, citations, years, authors, categories):
+        key = year * len(category_names) + category if by_year else category
+        if key not in paths:
+            paths[key] = _parse_category(
+                category_names[category], year_names[year] if by_year else None)
+        yield paths[key], title, paper_citations, doi, \
+            author_names[paper_authors]
+
+
+def _open_cache(cache_file: str) -> Optional[ColumnFile]:
+    """Return the binary cache of the papers dataset file at <cache_file>,
+    or None if it is missing, unreadable, or out of date.
+    """
+    try:
+        columns = ColumnFile(cache_file)
+    except (OSError, ValueError):
+        return None
+    if columns.meta != _get_cache_meta():
+        columns.close()
+        return None
+    return columns
+
+
+def _get_cache_meta() -> Dict[str, object]:
+    """Return the meta data recorded in a binary cache of the papers dataset
+    file as it is now, which changes whenever the file does.
+    """
+    stat = os.stat(DATA_FILE)
+    return {'version': _CACHE_VERSION, 'source': os.path.abspath(DATA_FILE),
+            'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
 
 
-def _build_tree_from_dict(nested_dict: Dict) -> List[PaperTree]:
-    """Return a list of trees from the nested dictionary <nested_dict>.
+def _write_cache(cache_file: str) -> None:
+    """Make the binary cache of the papers dataset file at <cache_file>,
+    as described in _read_cached_papers.
+    """
+    meta = _get_cache_meta()
+    titles = []
+    dois = []
+    citations = array('q')
+    years = array('i')
+    authors = array('i')
+    categories = array('i')
+    year_codes = {}
+    author_codes = {}
+    category_codes = {}
+    with open(DATA_FILE) as csvfile:
+        to_read = csv.reader(csvfile)
+        next(to_read)
+        for line in to_read:
+            titles.append(line[1])
+            dois.append(line[4])
+            citations.append(int(line[5]))
+            years.append(year_codes.setdefault(line[2], len(year_codes)))
+            authors.append(author_codes.setdefault(line[0],
+                                                   len(author_codes)))
+            categories.append(category_codes.setdefault(
+                line[3], len(category_codes)))
+
+    write_columns(cache_file, meta,
+                  {'citations': citations, 'years': years, 'authors': authors,
+                   'categories': categories},
+                  {'titles': titles, 'dois': dois,
+                   'year_names': list(year_codes),
+                   'author_names': list(author_codes),
+                   'category_names': list(category_codes)})
+
+
+def _insert_papers(root: PaperTree,
+                   papers: Iterable[Tuple[List[str], str, int, str, str]],
+                   index: Optional[Dict[PaperTree, Dict[str, PaperTree]]]
+                   = None) -> bool:
+    """Insert each of <papers>, given as its category path, title,
+    citations, doi and authors, as a leaf of <root>, creating any category
+    that is not yet in the tree.
+
+    Subtrees are kept in the order they were first inserted, and a paper with
+    the same title as an earlier one in the same category replaces it in
+    place. The data_size of the ancestors of each paper is updated as it is
+    inserted, so the tree is built in a single pass over <papers>.
+
+    <index> maps trees to their subtrees by name, and is updated; it may
+    leave out trees, which are then added to it as they are needed.
+
+    Return whether no paper had the same path as a category, so that each
+    tree inserted into is either a paper or a category.
     """
+    if index is None:
+        index = {root: {}}
+    separate = True
+    for category, title, citations, doi, authors in papers:
+        tree = root
+        for name in category:
+            subtrees = index.get(tree)
+            if subtrees is None:
+                separate = separate and (tree is root or
+                                         len(tree._subtrees) > 0)
+                subtrees = _get_index(tree, index)
+            if name not in subtrees:
+                subtrees[name] = _new_subtree(tree, name)
+                index[subtrees[name]] = {}
+            tree = subtrees[name]
+
+        subtrees = index.get(tree)
+        if subtrees is None:
+            separate = separate and (tree is root or len(tree._subtrees) > 0)
+            subtrees = _get_index(tree, index)
+        if title not in subtrees:
+            subtrees[title] = _new_subtree(tree, title)
+        paper = subtrees[title]
+        separate = separate and not paper._subtrees
+        paper._authors = authors
+        paper._url = doi
+        paper._adjust_data_size(citations - paper.data_size)
+    return separate
+
+
+def _get_index(tree: PaperTree,
+               index: Dict[PaperTree, Dict[str, PaperTree]]) \
+        -> Dict[str, PaperTree]:
+    """Return the subtrees of <tree> by name from <index>, adding them to
+    <index> first if they are not in it yet.
+    """
+    if tree not in index:
+        index[tree] = {subtree._name: subtree for subtree in tree._subtrees}
+    return index[tree]
 
-    to_return = []
-    for key in nested_dict:
-        value = nested_dict[key]
-        if isinstance(value, list):
-            to_return.append(
-                PaperTree(key, [], value[2], value[1], value[0]))
-        else:
-            tmt = _build_tree_from_dict(value)
-            to_return.append(PaperTree(key, tmt))
 
-    return to_return
+def _new_subtree(parent: PaperTree, name: str) -> PaperTree:
+    """Return a new PaperTree with the given <name> and a data_size of 0,
+    added as the last subtree of <parent>.
+    """
+    subtree = PaperTree(name, [])
+    subtree._parent_tree = parent
+    parent._subtrees.append(subtree)
+    return subtree
 
 
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
-        'allowed-import-modules': ['python_ta', 'typing', 'csv', 'tm_trees'],
-        'allowed-io': ['_load_papers_to_dict'],
-        'max-args': 8
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'csv', 'io', 'locale', 'os', 'sys',
+            'array', 'concurrent.futures', 'columnar', 'tm_trees'
+        ],
+        'allowed-io': ['_read_papers', '_split_lines', '_load_chunk',
+                       '_write_cache'],
+        'max-args': 10
     })
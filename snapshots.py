@@ -0,0 +1,164 @@
+"""Assignment 2: Scan snapshots for Treemap
+
+=== CSC148 Winter 2019 ===
+
+=== Module Description ===
+This module saves the folder listings of a FileSystemTree scan to a snapshot
+file, and uses the snapshot to build the tree of the same folder again
+without listing the folders that did not change since.
+
+A snapshot is a column file (see columnar.py) holding, for every folder in
+breadth-first order, its modification time and number of entries, and for
+every entry of those folders, in order, its name, size and whether it is a
+folder.
+
+A folder's modification time changes when entries are added to, removed from
+or renamed in it, but not when a file in it is rewritten, nor when anything
+changes inside its subfolders. So every folder is still stat-ed on a rescan,
+but only the folders whose modification time changed are listed again; the
+size of a file that was rewritten in place is taken from the snapshot, and
+may be out of date.
+"""
+import os
+import time
+from array import array
+from typing import Dict, List, Tuple
+from columnar import ColumnFile, write_columns
+from tm_trees import FileSystemTree, _build_from_listings, _list_directory
+
+# The version of the snapshot format, stored in every snapshot.
+_VERSION = 1
+# Folders modified less than this many nanoseconds before a scan started may
+# be modified again without their modification time changing, so their
+# listings are not trusted by the next scan.
+_RACY_WINDOW = 2 * 10 ** 9
+# The modification time recorded for a folder whose listing is not trusted.
+_UNKNOWN = -1
+
+
+def load_file_system_tree(path: str, snapshot_path: str) -> FileSystemTree:
+    """Return the FileSystemTree of the file or folder at <path>, reusing the
+    listings in the snapshot at <snapshot_path> for the folders whose
+    modification time did not change, and save a new snapshot there.
+
+    If the snapshot is missing, unreadable or of another folder, every folder
+    is listed.
+
+    Precondition: <path> is a valid path for this computer.
+    """
+    if not os.path.isdir(path):
+        return FileSystemTree(path)
+    listings, mtimes = _rescan(path, _read_snapshot(path, snapshot_path))
+    tree = FileSystemTree.__new__(FileSystemTree)
+    _build_from_listings(tree, path, listings)
+    _write_snapshot(path, snapshot_path, listings, mtimes)
+    return tree
+
+
+def _rescan(path: str,
+            snapshot: Dict[str, Tuple[int, List[Tuple[str, bool, int]]]]) \
+        -> Tuple[Dict[str, List[Tuple[str, bool, int]]], Dict[str, int]]:
+    """Return the listing and modification time of every folder under the
+    folder at <path> (including <path> itself), keyed by the folder's path, in
+    breadth-first order.
+
+    A folder is only listed if its modification time differs from the one
+    recorded for it in <snapshot>; otherwise its listing is taken from there.
+    """
+    start = time.time_ns()
+    listings = {}
+    mtimes = {}
+    queue = [path]
+    i = 0
+    while i < len(queue):
+        folder = queue[i]
+        i += 1
+        mtime = os.stat(folder).st_mtime_ns
+        if folder in snapshot and snapshot[folder][0] == mtime:
+            listings[folder] = snapshot[folder][1]
+        else:
+            listings[folder] = _list_directory(folder)
+        if mtime > start - _RACY_WINDOW:
+            mtime = _UNKNOWN
+        mtimes[folder] = mtime
+        for name, is_folder, _ in listings[folder]:
+            if is_folder:
+                queue.append(os.path.join(folder, name))
+    return listings, mtimes
+
+
+def _write_snapshot(path: str, snapshot_path: str,
+                    listings: Dict[str, List[Tuple[str, bool, int]]],
+                    mtimes: Dict[str, int]) -> None:
+    """Save the folder <listings> and modification times <mtimes> of the
+    folder at <path>, both in breadth-first order, to a snapshot at
+    <snapshot_path>.
+    """
+    names = []
+    folders = array('B')
+    sizes = array('q')
+    counts = array('q')
+    for listing in listings.values():
+        counts.append(len(listing))
+        for name, is_folder, size in listing:
+            names.append(name)
+            folders.append(is_folder)
+            sizes.append(size)
+    write_columns(snapshot_path,
+                  {'version': _VERSION, 'root': os.path.abspath(path)},
+                  {'mtimes': array('q', mtimes.values()), 'counts': counts,
+                   'sizes': sizes, 'folders': folders},
+                  {'names': names})
+
+
+def _read_snapshot(path: str, snapshot_path: str) \
+        -> Dict[str, Tuple[int, List[Tuple[str, bool, int]]]]:
+    """Return the modification time and listing of every folder recorded in
+    the snapshot at <snapshot_path>, keyed by the folder's path, or an empty
+    dictionary if there is no usable snapshot of the folder at <path> there.
+    """
+    try:
+        snapshot = ColumnFile(snapshot_path)
+    except (OSError, ValueError):
+        return {}
+    try:
+        if snapshot.meta != {'version': _VERSION,
+                             'root': os.path.abspath(path)}:
+            return {}
+        mtimes = snapshot.numbers('mtimes').tolist()
+        counts = snapshot.numbers('counts').tolist()
+        entries = list(zip(snapshot.strings('names'),
+                           map(bool, snapshot.numbers('folders').tolist()),
+                           snapshot.numbers('sizes').tolist()))
+    except KeyError:
+        return {}
+    finally:
+        snapshot.close()
+    if len(mtimes) != len(counts) or sum(counts) != len(entries):
+        return {}
+
+    # The folders are in breadth-first order, so the path of each one is
+    # known by the time its entries are read
+    folders = {}
+    queue = [path]
+    start = 0
+    for i, count in enumerate(counts):
+        if i == len(queue):
+            return {}
+        listing = entries[start:start + count]
+        start += count
+        folders[queue[i]] = (mtimes[i], listing)
+        for name, is_folder, _ in listing:
+            if is_folder:
+                queue.append(os.path.join(queue[i], name))
+    return folders
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'os', 'time', 'array', 'columnar',
+            'tm_trees'
+        ]
+    })
@@ -19,8 +19,26 @@ computer's file system.
 from __future__ import annotations
 import os
 import math
-from random import randint
-from typing import List, Tuple, Optional
+import queue
+import struct
+import threading
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                FIRST_COMPLETED, wait)
+from array import array
+from typing import (Callable, Deque, Dict, Iterator, List, Set, Tuple,
+                    Optional)
+
+# The number of integers in each record written by TMTree.fill_rectangles.
+RECORD_LENGTH = 7
+
+# An index of the rectangles of the children of a tree, in the format of
+# TMTree._hit_index, built by _index_rectangles.
+_HitIndex = Tuple[bool, List[int], List[int], List[int], List[int],
+                  Optional[Tuple[int, int, int, int, int, List[List[int]]]]]
 
 
 class TMTree:
@@ -45,7 +63,8 @@ class TMTree:
 
     === Private Attributes ===
     _colour:
-        The RGB colour value of the root of this tree.
+        The RGB colour value of the root of this tree, or None if it has not
+        been derived from the tree's path yet; see _get_colour.
     _name:
         The root value of this tree, or None if this tree is empty.
     _subtrees:
@@ -55,13 +74,49 @@ class TMTree:
         as a subtree, or None if this tree is not part of a larger tree.
     _expanded:
         Whether or not this tree is considered expanded for visualization.
+    _dirty:
+        Whether the rectangles in this tree may be out of date, because the
+        tree or one of its descendents was changed since it was last laid out.
+    _hit_index:
+        An index of the rectangles of _subtrees used by get_tree_at_position,
+        or None if it has not been built since they last changed. It is a
+        tuple of: whether _subtrees are laid out left to right (rather than
+        top to bottom), the start and end coordinate of each laid out
+        subtree along that direction, the positions in _subtrees of those
+        subtrees, the positions of the other subtrees, which must be checked
+        one by one, and a grid of the laid out subtrees, or None. The grid
+        is used instead of the coordinates when the laid out subtrees are
+        not in order along that direction, as in a squarified layout; it is
+        a tuple of the left, top, width and height of the area they cover,
+        the number of rows and columns it is divided in, and the positions
+        of the subtrees whose rectangles touch each cell, row by row.
+    _path_prefix:
+        The names of the trees from the root down to this tree, separated as
+        in get_path_string, or None if it has not been computed since this
+        tree was last given a new parent. It is only computed for the trees
+        whose path string is asked for, and their ancestors.
+    _path_checksum:
+        The CRC-32 checksum of _path_prefix, or None if it has not been
+        computed since this tree was last given a new parent. It is only
+        kept by the ancestors of the trees whose colour was derived, so that
+        the colours of their other descendants can be derived from it.
+    _stale_sizes:
+        While a batch is running, the trees whose data_size may no longer be
+        the sum of their subtrees', because one of those subtrees was resized,
+        moved, added or removed in the batch; None otherwise. This is a class
+        attribute, shared by all trees.
+    _listeners:
+        The listeners told about every change to the leaves of the tree
+        rooted at this tree, such as the indexes of indexes.py. Only the
+        trees that have listeners hold a tuple of their own; the others share
+        the empty one of the class.
 
     === Representation Invariants ===
     - data_size >= 0
-    - If _subtrees is not empty, then data_size is equal to the sum of the
-      data_size of each subtree.
+    - If _subtrees is not empty and no batch is running, then data_size is
+      equal to the sum of the data_size of each subtree.
 
-    - _colour's elements are each in the range 0-255.
+    - _colour is None, or its elements are each in the range 0-255.
 
     - If _name is None, then _subtrees is empty, _parent_tree is None, and
       data_size is 0.
@@ -73,51 +128,62 @@ class TMTree:
     - if _expanded is False, then _expanded is False for every tree
       in _subtrees
     - if _subtrees is empty, then _expanded is False
+
+    - if _dirty is False, then the rectangles of the descendents of this tree
+      are the ones update_rectangles would give them from rect
+    - if _path_prefix is not None, then _parent_tree is None or
+      _parent_tree._path_prefix is not None
+    - if _path_checksum is not None, then _parent_tree is None or
+      _parent_tree._path_checksum is not None
     """
-    rect: Tuple[int, int, int, int]
+    rect: Tuple[int, int, int, int] = (0, 0, 0, 0)
     data_size: int
-    _colour: Tuple[int, int, int]
+    _colour: Optional[Tuple[int, int, int]] = None
     _name: str
     _subtrees: List[TMTree]
     _parent_tree: Optional[TMTree]
     _expanded: bool
+    _dirty: bool
+    _hit_index: Optional[_HitIndex] = None
+    _path_prefix: Optional[str] = None
+    _path_checksum: Optional[int] = None
+    _stale_sizes: Optional[Set[TMTree]] = None
+    _listeners: Tuple[TreeListener, ...] = ()
 
     def __init__(self, name: str, subtrees: List[TMTree],
                  data_size: int = 0) -> None:
-        """Initialize a new TMTree with a random colour and the provided <name>.
+        """Initialize a new TMTree with the provided <name>.
 
         If <subtrees> is empty, use <data_size> to initialize this tree's
         data_size.
 
         If <subtrees> is not empty, ignore the parameter <data_size>,
-        and calculate this tree's data_size instead.
+        and calculate this tree's data_size instead, as the sum of the
+        data_size of each subtree.
 
         Set this tree as the parent for each of its subtrees.
 
+        The rectangle, colour, hit-test index and path prefix of the new tree
+        are left to their class defaults until they are needed, so that trees
+        that are never displayed cost neither the time nor the memory to set
+        them.
+
         Precondition: if <name> is None, then <subtrees> is empty.
         """
-        self.rect = (0, 0, 0, 0)
         self._name = name
         self._subtrees = subtrees[:]
         self._parent_tree = None
-        self._colour = (randint(0, 255), randint(0, 255), randint(0, 255))
         self._expanded = False
+        self._dirty = True
 
         if len(self._subtrees) == 0:
             self.data_size = data_size
         else:
-            self.data_size = self._get_data_size()
+            self.data_size = 0
             for subtree in self._subtrees:
+                self.data_size += subtree.data_size
                 subtree._parent_tree = self
-
-    def _get_data_size(self) -> int:
-        if len(self._subtrees) == 0:
-            return self.data_size
-        else:
-            data_size = 0
-            for subtree in self._subtrees:
-                data_size += subtree._get_data_size()
-            return data_size
+                subtree._forget_path_prefixes()
 
     def is_empty(self) -> bool:
         """Return True iff this tree is empty.
@@ -127,13 +193,40 @@ class TMTree:
     def update_rectangles(self, rect: Tuple[int, int, int, int]) -> None:
         """Update the rectangles in this tree and its descendents using the
         treemap algorithm to fill the area defined by pygame rectangle <rect>.
+
+        A subtree that is given the rectangle it already has, and that has not
+        changed since it was last laid out, keeps the rectangles it has
+        instead of being laid out again; the result is the same.
+
+        The tree is walked with an explicit stack, as in iter_rectangles, so
+        this also works on trees too deep to recurse through.
+        """
+        stack = [(self, rect)]
+        while stack:
+            tree, tree_rect = stack.pop()
+            stack.extend(tree._lay_out(tree_rect))
+
+    def _lay_out(self, rect: Tuple[int, int, int, int]) \
+            -> List[Tuple[TMTree, Tuple[int, int, int, int]]]:
+        """Give this tree the rectangle <rect>, and return each of its
+        subtrees with the rectangle that the treemap algorithm gives it
+        inside <rect>, as update_rectangles does for each tree.
+
+        Return no subtrees if this tree has no data, or if it already has
+        <rect> and has not changed since it was last laid out, as its
+        subtrees then keep the rectangles they have.
         """
         if self.data_size == 0:
-            return
+            return []
+        if rect == self.rect and not self._dirty:
+            return []
         self.rect = rect
+        self._dirty = False
+        self._hit_index = None
         l, j, width, height = rect
         size = self.data_size
 
+        laid_out = []
         for i in range(len(self._subtrees)):
             subtree = self._subtrees[i]
             if i < len(self._subtrees) - 1:
@@ -146,107 +239,253 @@ class TMTree:
                     new_height = int(height * ratio)
                     rect1 = (l, j, width, new_height)
                     j += rect1[3]
-                subtree.update_rectangles(rect1)
+            elif width > height:
+                rect1 = (l, j, width + rect[0] - l, height)
             else:
-                if width > height:
-                    rect1 = (l, j, width + rect[0] - l, height)
-                    subtree.update_rectangles(rect1)
-                else:
-                    rect1 = (l, j, width, height + rect[1] - j)
-                    subtree.update_rectangles(rect1)
+                rect1 = (l, j, width, height + rect[1] - j)
+            laid_out.append((subtree, rect1))
+        return laid_out
 
-    def get_rectangles(self) -> List[Tuple[Tuple[int, int, int, int], \
-                                           Tuple[int, int, int]]]:
+    def get_rectangles(self, min_pixels: int = 0) \
+            -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
         """Return a list with tuples for every leaf in the displayed-tree
         rooted at this tree. Each tuple consists of a tuple that defines the
         appropriate pygame rectangle to display for a leaf, and the colour
         to fill it with.
+
+        A tree whose rectangle is less than <min_pixels> wide or high is
+        treated as a leaf of the displayed-tree, so it is drawn as one block
+        instead of as many rectangles too thin to see.
         >>> x = FileSystemTree('example-directory')
         >>> rect = (0, 0, 100, 100)
         >>> x.update_rectangles(rect)
         >>> x.get_rectangles()
         [((), ())]
         """
+        return list(self.iter_rectangles(min_pixels))
+
+    def iter_rectangles(self, min_pixels: int = 0) \
+            -> Iterator[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
+        """Yield the tuples of get_rectangles one at a time, in the same
+        order, without building any intermediate lists.
+
+        The displayed-tree is walked with an explicit stack, so this also
+        works on trees too deep to recurse through.
+        """
         if self.is_empty():
-            return []
-        elif self._subtrees == [] or not self._expanded:
-            return [(self.rect, self._colour)]
-        else:
-            rectangles = []
-            for subtree in self._subtrees:
-                rectangles += subtree.get_rectangles()
-            return rectangles
+            return
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node._is_displayed_leaf(min_pixels):
+                yield node.rect, node._get_colour()
+            else:
+                stack.extend(reversed(node._subtrees))
+
+    def fill_rectangles(self, buffer: array, min_pixels: int = 0) -> int:
+        """Write the rectangles and colours of get_rectangles into <buffer>,
+        in the same order, flattened into one record of seven integers per
+        leaf: x, y, width, height, red, green and blue. Return the number of
+        records written.
+
+        The records are written from the start of <buffer>, and whatever
+        follows the last one is left as it was. <buffer> is only grown when
+        it is too short, and no tuple is made for any leaf, so that filling
+        the same buffer for every frame allocates nothing once it is long
+        enough.
+
+        Precondition: <buffer> is an array of a signed integer typecode.
+        """
+        if self.is_empty():
+            return 0
+        # Each record is packed straight into the bytes of buffer
+        record = struct.Struct(str(RECORD_LENGTH) + buffer.typecode)
+        pack_into, record_bytes = record.pack_into, record.size
+        end = len(buffer) * buffer.itemsize
+        offset = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if not node._is_displayed_leaf(min_pixels):
+                stack.extend(reversed(node._subtrees))
+                continue
+            if offset + record_bytes > end:
+                _grow_buffer(buffer)
+                end = len(buffer) * buffer.itemsize
+            x, y, width, height = node.rect
+            red, green, blue = node._colour or node._get_colour()
+            pack_into(buffer, offset, x, y, width, height, red, green, blue)
+            offset += record_bytes
+        return offset // record_bytes
 
-    def get_tree_at_position(self, pos: Tuple[int, int]) -> Optional[TMTree]:
+    def get_tree_at_position(self, pos: Tuple[int, int],
+                             min_pixels: int = 0) -> Optional[TMTree]:
         """Return the leaf in the displayed-tree rooted at this tree whose
         rectangle contains position <pos>, or None if <pos> is outside of this
         tree's rectangle.
 
         If <pos> is on the shared edge between two rectangles, return the
         tree represented by the rectangle that is closer to the origin.
+
+        A tree whose rectangle is less than <min_pixels> wide or high is
+        treated as a leaf of the displayed-tree, as in get_rectangles.
+
+        Only the subtrees whose rectangles can contain <pos> are searched; they
+        are found by bisection, or in a grid if they are not laid out in
+        strips, in the index kept by each expanded tree. They are searched
+        with an explicit stack, so this also works on trees too deep to
+        recurse through.
         """
-        if self._subtrees == [] or not self._expanded:
-            x1, y1, width, height = self.rect
-            contains_position = (x1 <= pos[0] <= x1 + width) and \
-                                (y1 <= pos[1] <= y1 + height)
-            if contains_position:
-                return self
+        if self._is_displayed_leaf(min_pixels):
+            return self if _contains(self.rect, pos) else None
+
+        # The expanded trees being searched, outermost first, each with the
+        # positions of its subtrees left to search, and the leaf closest to
+        # the origin found in it so far
+        stack = [(self, iter(self._get_candidates(pos)), [None])]
+        while True:
+            tree, candidates, result = stack[-1]
+            i = next(candidates, None)
+            if i is None:
+                stack.pop()
+                if not stack:
+                    return result[0]
+                found = result[0]
             else:
-                return None
+                subtree = tree._subtrees[i]
+                if not subtree._is_displayed_leaf(min_pixels):
+                    stack.append((subtree, iter(subtree._get_candidates(pos)),
+                                  [None]))
+                    continue
+                found = subtree if _contains(subtree.rect, pos) else None
+            if found is not None:
+                closest = stack[-1][2]
+                closest[0] = _get_closer_to_origin(closest[0], found)
 
-        result = None
+    def _get_colour(self) -> Tuple[int, int, int]:
+        """Return the RGB colour of this tree.
 
-        def _get_closer_to_origin(sub: subtree) -> Optional[TMTree]:
-            if not result:
-                return sub
-            else:
-                curr_pos, next_pos = result.rect[:-2], sub.rect[:-2]
-                # if next is on top or on the left return sub.
-                if next_pos[1] < curr_pos[1] or next_pos[0] < curr_pos[0]:
-                    return sub
-                # else return None
+        The first time it is needed, the colour is derived from a checksum of
+        the path of this tree, so a tree gets the same colour every time it
+        is built, in this run or any other. Once derived, the colour is kept,
+        even if the tree is moved.
+
+        The checksum is continued from the one of its parent's path, as in
+        CompactTree, and the checksum of each ancestor on the way that was
+        not kept is computed from its parent's, from the top down, and kept.
+        """
+        if self._colour is None:
+            missing = [self]
+            now = self._parent_tree
+            while now is not None and now._path_checksum is None:
+                missing.append(now)
+                now = now._parent_tree
+            for tree in reversed(missing):
+                if tree._parent_tree is None:
+                    checksum = _get_path_checksum(tree._name)
                 else:
-                    return result
+                    checksum = _get_path_checksum(
+                        tree.get_separator() + tree._name,
+                        tree._parent_tree._path_checksum)
+                if tree is not self:
+                    tree._path_checksum = checksum
+            self._colour = _get_path_colour(checksum)
+        return self._colour
 
-        for subtree in self._subtrees:
-            valid = subtree.get_tree_at_position(pos)
-            if valid:
-                result = _get_closer_to_origin(valid)
-        return result
+    def _is_displayed_leaf(self, min_pixels: int) -> bool:
+        """Return True iff this tree is drawn as a single rectangle: it is a
+        leaf, it is not expanded, or its rectangle is less than <min_pixels>
+        wide or high.
+        """
+        return self._subtrees == [] or not self._expanded or \
+            self.rect[2] < min_pixels or self.rect[3] < min_pixels
+
+    def _get_candidates(self, pos: Tuple[int, int]) -> List[int]:
+        """Return the positions in _subtrees, in increasing order, of the
+        subtrees that may contain a leaf whose rectangle contains <pos>.
+
+        Build _hit_index first if necessary.
+        """
+        if self._hit_index is None:
+            self._hit_index = _index_rectangles(
+                self.rect, [subtree.rect for subtree in self._subtrees],
+                [subtree.data_size for subtree in self._subtrees])
+        return _find_candidates(self._hit_index, pos)
 
     def update_data_sizes(self) -> int:
         """Update the data_size for this tree and its subtrees, based on the
         size of their leaves, and return the new size.
         If this tree is a leaf, return its size unchanged.
+
+        Since move and change_size keep every data_size up to date, this
+        full traversal is only needed to check, or restore, the
+        representation invariants.
         """
         if not self._subtrees:
             return self.data_size
-        else:
-            size = 0
-            for subtree in self._subtrees:
-                size += subtree.update_data_sizes()
+        # Every tree, each before its subtrees, so that when they are added
+        # up in reverse, each tree comes after all of its subtrees
+        trees = []
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            trees.append(tree)
+            stack.extend(tree._subtrees)
+        for tree in reversed(trees):
+            tree._add_up_size()
+        return self.data_size
+
+    def _add_up_size(self) -> None:
+        """Set the data_size of this tree to the sum of the data_size of its
+        subtrees, which are up to date, as update_data_sizes does for each
+        tree. A leaf keeps its data_size.
+
+        This tree is marked as dirty, and its _hit_index dropped, if its
+        data_size changed or one of its subtrees is dirty.
+        """
+        if not self._subtrees:
+            return
+        size = 0
+        for subtree in self._subtrees:
+            size += subtree.data_size
+            if subtree._dirty:
+                self._dirty = True
+        if size != self.data_size:
             self.data_size = size
+            self._dirty = True
+        if self._dirty:
+            self._hit_index = None
         if size == 0:
             self.rect = (0, 0, 0, 0)
-        return size
 
     def move(self, destination: TMTree) -> None:
         """If this tree is a leaf, and <destination> is not a leaf, move this
         tree to be the last subtree of <destination>. Otherwise, do nothing.
+
+        The data_size of the old and new ancestors of this tree is updated
+        along the way. If the old parent of this tree is left without
+        subtrees, the listeners are told it was added as a leaf.
         """
         if self._subtrees == [] and destination._subtrees != []:
             self._parent_tree._subtrees.remove(self)
+            self._parent_tree._adjust_data_size(-self.data_size)
             destination._subtrees.append(self)
             if self._parent_tree._subtrees == []:
                 self._parent_tree.data_size = 0
                 self._parent_tree.rect = (0, 0, 0, 0)
+                for listener in self._parent_tree._get_listeners():
+                    listener.subtree_added(self._parent_tree)
             self._parent_tree = destination
+            self._forget_path_prefixes()
+            destination._adjust_data_size(self.data_size)
 
     def change_size(self, factor: float) -> None:
         """Change the value of this tree's data_size attribute by <factor>.
         Always round up the amount to change, so that it's an int, and
         some change is made.
         Do nothing if this tree is not a leaf.
+
+        The data_size of each ancestor of this tree is updated along the way.
         """
         if self._subtrees == []:
             size = math.ceil(abs(self.data_size * factor))
@@ -255,7 +494,158 @@ class TMTree:
             else:
                 new_size = self.data_size - size
 
-            self.data_size = 1 if new_size < 1 else new_size
+            new_size = 1 if new_size < 1 else new_size
+            self._adjust_data_size(new_size - self.data_size)
+
+    def _adjust_data_size(self, delta: int) -> None:
+        """Add <delta> to the data_size of this tree and of each of its
+        ancestors, so that they stay equal to the sum of their leaves without
+        visiting the rest of the tree.
+
+        As in update_data_sizes, an internal tree whose size drops to 0 has its
+        rectangle cleared. This tree and its ancestors are all marked as dirty,
+        and their _hit_index dropped, even if <delta> is 0, since their layout
+        depends on their subtrees.
+
+        While a batch is running, only this tree is changed, and its
+        ancestors are brought up to date when the batch ends.
+
+        Either way, if this tree is a leaf, the listeners of this tree and of
+        its ancestors are told it was resized.
+        """
+        stale = TMTree._stale_sizes
+        if stale is not None:
+            self._add_to_size(delta)
+            if self._parent_tree is not None:
+                stale.add(self._parent_tree)
+            listeners = self._get_listeners()
+        else:
+            listeners = ()
+            now = self
+            while now is not None:
+                now.data_size += delta
+                now._dirty = True
+                now._hit_index = None
+                if now.data_size == 0 and now._subtrees:
+                    now.rect = (0, 0, 0, 0)
+                listeners += now._listeners
+                now = now._parent_tree
+        if not self._subtrees:
+            for listener in listeners:
+                listener.leaf_resized(self)
+
+    def _add_to_size(self, delta: int) -> None:
+        """Add <delta> to the data_size of this tree alone, and mark it as
+        changed, as _adjust_data_size does for each tree it visits.
+        """
+        self.data_size += delta
+        self._dirty = True
+        self._hit_index = None
+        if self.data_size == 0 and self._subtrees:
+            self.rect = (0, 0, 0, 0)
+
+    @contextmanager
+    def batch(self, rect: Optional[Tuple[int, int, int, int]] = None) \
+            -> Iterator[TMTree]:
+        """Return a context manager that makes the edits in its body, such as
+        calls to change_size, move and expand, as a single batch, and yields
+        this tree.
+
+        Inside the batch, each edit only changes the data_size of the trees it
+        is made on. When the batch ends, the data_size of their ancestors is
+        added up again from their subtrees, visiting each ancestor once
+        however many edits were made under it. Then, if <rect> is given, this
+        tree is laid out once in <rect> with update_rectangles.
+
+        The sizes are brought up to date even if the body raises an
+        exception, but the tree is then not laid out. A batch started inside
+        another one joins it, and its <rect> is ignored.
+
+        Until the batch ends, the data_size of the ancestors of the edited
+        trees is out of date, so the body must not lay out, hit-test or call
+        update_data_sizes on them.
+        """
+        if TMTree._stale_sizes is not None:
+            yield self
+            return
+        TMTree._stale_sizes = set()
+        try:
+            yield self
+        finally:
+            stale = TMTree._stale_sizes
+            TMTree._stale_sizes = None
+            _add_up_stale_sizes(stale)
+        if rect is not None:
+            self.update_rectangles(rect)
+
+    def _add_subtree(self, subtree: TMTree) -> None:
+        """Add <subtree> as the last subtree of this tree, and add its
+        data_size to this tree and its ancestors.
+
+        The listeners are told that <subtree> was added, and, if this tree
+        was a leaf, that it was removed first.
+
+        Precondition: <subtree> has no parent, and this tree either has
+        subtrees or has a data_size of 0.
+        """
+        listeners = self._get_listeners()
+        if not self._subtrees:
+            for listener in listeners:
+                listener.subtree_removed(self)
+        self._subtrees.append(subtree)
+        subtree._parent_tree = self
+        subtree._forget_path_prefixes()
+        self._adjust_data_size(subtree.data_size)
+        for listener in listeners:
+            listener.subtree_added(subtree)
+
+    def _remove_subtree(self, subtree: TMTree) -> None:
+        """Remove <subtree> from the subtrees of this tree, and subtract its
+        data_size from this tree and its ancestors.
+
+        As in move, a tree left without subtrees has a data_size of 0, no
+        rectangle, and is collapsed. The listeners are told that <subtree>
+        was removed, and that this tree was added if it is left as a leaf.
+
+        Precondition: <subtree> is one of the subtrees of this tree.
+        """
+        listeners = self._get_listeners()
+        for listener in listeners:
+            listener.subtree_removed(subtree)
+        self._subtrees.remove(subtree)
+        subtree._parent_tree = None
+        subtree._forget_path_prefixes()
+        self._adjust_data_size(-subtree.data_size)
+        if not self._subtrees:
+            self.data_size = 0
+            self.rect = (0, 0, 0, 0)
+            self._expanded = False
+            for listener in listeners:
+                listener.subtree_added(self)
+
+    def _add_listener(self, listener: TreeListener) -> None:
+        """Tell <listener> about the changes made to the leaves of the tree
+        rooted at this tree from now on.
+        """
+        self._listeners += (listener,)
+
+    def _remove_listener(self, listener: TreeListener) -> None:
+        """Stop telling <listener> about the changes made to the leaves of
+        the tree rooted at this tree, if it was told about them.
+        """
+        self._listeners = tuple(other for other in self._listeners
+                                if other is not listener)
+
+    def _get_listeners(self) -> Tuple[TreeListener, ...]:
+        """Return the listeners of this tree and of each of its ancestors,
+        which are the ones to tell about a change made to this tree.
+        """
+        listeners = ()
+        now = self
+        while now is not None:
+            listeners += now._listeners
+            now = now._parent_tree
+        return listeners
 
     def expand(self) -> None:
         """ Expand selected folder. """
@@ -264,10 +654,18 @@ class TMTree:
 
     def expand_all(self) -> None:
         """ Expand all files and folder in folder. """
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            tree._expand_node()
+            stack.extend(tree._subtrees)
+
+    def _expand_node(self) -> None:
+        """Expand this tree alone, if it has subtrees, as expand_all does for
+        each tree.
+        """
         if self._subtrees:
             self._expanded = True
-            for subtree in self._subtrees:
-                subtree.expand_all()
 
     def collapse(self) -> None:
         """ Collapse selected file/folder """
@@ -275,10 +673,12 @@ class TMTree:
             self._parent_tree._collapse_everything_under()
 
     def _collapse_everything_under(self) -> None:
-        if self._subtrees:
-            self._expanded = False
-            for subtree in self._subtrees:
-                subtree._collapse_everything_under()
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            if tree._subtrees:
+                tree._expanded = False
+                stack.extend(tree._subtrees)
 
     def collapse_all(self) -> None:
         """Collapse everything """
@@ -292,18 +692,51 @@ class TMTree:
         """Return a string representing the path containing this tree
         and its ancestors, using the separator for this tree between each
         tree's name. If <final_node>, then add the suffix for the tree.
+
+        The path of this tree and of each of its ancestors is cached, so once
+        it has been computed, only the suffix is added on later calls.
         """
-        if self._parent_tree is None:
-            path_str = self._name
-            if final_node:
-                path_str += self.get_suffix()
-            return path_str
-        else:
-            path_str = (self._parent_tree.get_path_string(False) +
-                        self.get_separator() + self._name)
-            if final_node or len(self._subtrees) == 0:
-                path_str += self.get_suffix()
-            return path_str
+        path_str = self._get_path_prefix()
+        if final_node or (self._parent_tree is not None and
+                          len(self._subtrees) == 0):
+            path_str += self.get_suffix()
+        return path_str
+
+    def _get_path_prefix(self) -> str:
+        """Return the names of the trees from the root down to this tree,
+        separated as in get_path_string.
+
+        The prefix of each tree on the way that was not cached is computed
+        from its parent's, from the top down, and cached.
+        """
+        missing = []
+        now = self
+        while now is not None and now._path_prefix is None:
+            missing.append(now)
+            now = now._parent_tree
+        for tree in reversed(missing):
+            if tree._parent_tree is None:
+                tree._path_prefix = tree._name
+            else:
+                tree._path_prefix = (tree._parent_tree._path_prefix +
+                                     tree.get_separator() + tree._name)
+        return self._path_prefix
+
+    def _forget_path_prefixes(self) -> None:
+        """Forget the cached path prefix and path checksum of this tree and
+        its descendents, after this tree was given a new parent.
+
+        Only the trees with either of them cached are visited, since neither
+        is ever cached for a tree without its parent's.
+        """
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            if tree._path_prefix is not None or \
+                    tree._path_checksum is not None:
+                tree._path_prefix = None
+                tree._path_checksum = None
+                stack.extend(tree._subtrees)
 
     def get_separator(self) -> str:
         """Return the string used to separate names in the string
@@ -329,11 +762,41 @@ class FileSystemTree(TMTree):
 
     The data_size attribute for regular files is simply the size of the file,
     as reported by os.path.getsize.
+
+    In lazy mode, the subtrees of a folder are only loaded when they are
+    needed: when it is expanded, or is the destination of a move. Until then,
+    the folder has no subtrees. The total size of the files under it is
+    added up by a background thread, and becomes its data_size when
+    load_folder_sizes is called; until then, its data_size is 0, so it is
+    not displayed.
+
+    === Private Attributes ===
+    _pending:
+        The path of this folder if its subtrees have not been loaded yet, or
+        None.
+    _folder_sizes:
+        The sizes of the folders added up in the background, shared by the
+        whole tree, or None if this tree was not built in lazy mode.
     """
+    _pending: Optional[str] = None
+    _folder_sizes: Optional[_FolderSizes] = None
 
-    def __init__(self, path: str) -> None:
+    def __init__(self, path: str, workers: int = 0,
+                 use_processes: bool = False, lazy: bool = False) -> None:
         """Store the file tree structure contained in the given file or folder.
 
+        The folders are listed with os.scandir, one at a time unless
+        <workers> is positive, in which case they are listed by a pool of that
+        many worker threads (or processes, if <use_processes>). Both ways
+        build the same tree, bottom-up and without recursion, so arbitrarily
+        deep folders can be stored.
+
+        If <lazy>, only the folder at <path> is listed, and no tree is built
+        for its subfolders until they are needed. The size of the files under
+        each of them is added up in the background, by a thread that lists
+        the folders as described above, and load_folder_sizes gives each
+        folder its size once it is known.
+
         Precondition: <path> is a valid path for this computer.
         """
 
@@ -341,28 +804,680 @@ class FileSystemTree(TMTree):
             name = os.path.basename(path)
             size = os.path.getsize(path)
             TMTree.__init__(self, name, [], size)
+        elif lazy:
+            TMTree.__init__(self, os.path.basename(path), [], 0)
+            self._pending = path
+            self._folder_sizes = _FolderSizes(workers, use_processes)
+            self._materialise()
         else:
-            subtree1 = []
-            for filename in os.listdir(path):
-                subtree = FileSystemTree(os.path.join(path, filename))
-                subtree1.append(subtree)
-
-            name1 = os.path.basename(path)
-            TMTree.__init__(self, name1, subtree1)
+            if workers > 0:
+                listings = _scan_parallel(path, workers, use_processes)
+            else:
+                listings = _scan(path)
+            _build_from_listings(self, path, listings)
 
     def get_separator(self) -> str:
         """Return the file separator for this OS.
         """
         return os.sep
 
+    def load_folder_sizes(self, block: bool = False) -> bool:
+        """Give the folders of the lazy tree this tree is part of that have
+        not been loaded yet the sizes added up in the background since the
+        last call, and return whether any was given. If <block>, wait until
+        the sizes of all of them are added up first.
+
+        The data_size of their ancestors is updated along the way, and they
+        are marked dirty, as in change_size. Do nothing if this tree was not
+        built in lazy mode.
+
+        This must be called from the thread that owns the tree.
+        """
+        if self._folder_sizes is None:
+            return False
+        return self._folder_sizes.apply(block)
+
+    def notify_folder_sizes(self, notify: Optional[Callable[[], None]]) \
+            -> None:
+        """Call <notify> from the background thread each time it adds up
+        the size of a folder of the lazy tree this tree is part of, so that
+        an event loop can wake up and call load_folder_sizes, or stop
+        calling anything if <notify> is None.
+
+        Do nothing if this tree was not built in lazy mode.
+        """
+        if self._folder_sizes is not None:
+            self._folder_sizes.notify = notify
+
     def get_suffix(self) -> str:
         """Return the final descriptor of this tree.
         """
-        if len(self._subtrees) == 0:
+        if len(self._subtrees) == 0 and self._pending is None:
             return ' (file)'
         else:
             return ' (folder)'
 
+    def expand(self) -> None:
+        """ Expand selected folder, loading its subtrees if needed. """
+        self._materialise()
+        TMTree.expand(self)
+
+    def _expand_node(self) -> None:
+        """Expand this folder alone, as TMTree._expand_node does, after
+        loading its subtrees if needed, so that expand_all loads every folder
+        it expands.
+        """
+        self._materialise()
+        TMTree._expand_node(self)
+
+    def move(self, destination: TMTree) -> None:
+        """Move this tree as TMTree.move does, after loading the subtrees of
+        this tree and of <destination> if needed, so that unloaded folders are
+        not mistaken for files.
+        """
+        self._materialise()
+        if isinstance(destination, FileSystemTree):
+            destination._materialise()
+        TMTree.move(self, destination)
+
+    def change_size(self, factor: float) -> None:
+        """Change the size of this tree as TMTree.change_size does, after
+        loading its subtrees if needed, so that an unloaded folder is not
+        mistaken for a file.
+        """
+        self._materialise()
+        TMTree.change_size(self, factor)
+
+    def _materialise(self) -> None:
+        """Load the subtrees of this folder, if they have not been loaded yet.
+
+        Its subfolders are left unloaded, with the size added up for them in
+        the background if it is known already, or with a data_size of 0 until
+        load_folder_sizes gives them one. The data_size of this tree and its
+        ancestors is corrected to the sum of the new subtrees, and they are
+        marked dirty, so the new subtrees are laid out by the next call to
+        update_rectangles.
+
+        If the folder cannot be listed, e.g. because it was deleted or made
+        unreadable since it was found, it is left unloaded, as a leaf.
+
+        The listeners are told that this tree was removed as a leaf, and
+        added again with its new subtrees.
+        """
+        if self._pending is None:
+            return
+        path = self._pending
+        try:
+            listing = _list_directory(path)
+        except OSError:
+            return
+        listeners = self._get_listeners()
+        for listener in listeners:
+            listener.subtree_removed(self)
+        del self._pending
+        self._folder_sizes.forget(path)
+        for name, is_folder, size in listing:
+            subtree = self._new_subtree(os.path.join(path, name), is_folder,
+                                        size)
+            subtree._parent_tree = self
+            self._subtrees.append(subtree)
+        self._adjust_data_size(
+            sum(subtree.data_size for subtree in self._subtrees) -
+            self.data_size)
+        for listener in listeners:
+            listener.subtree_added(self)
+
+    def _new_subtree(self, path: str, is_folder: bool,
+                     size: int) -> FileSystemTree:
+        """Return a new tree of the same class as this one, not part of any
+        tree yet, for the entry at <path> in this folder: a folder if
+        <is_folder>, or a file of <size> bytes otherwise.
+
+        In lazy mode, a folder is left unloaded, as in _materialise, and
+        queued to have its size added up in the background. Otherwise, it is
+        built with everything under it, and an OSError is raised if it cannot
+        be listed.
+        """
+        name = os.path.basename(path)
+        if self._folder_sizes is None:
+            if is_folder:
+                return type(self)(path)
+            return _new_node(type(self), name, [], size)
+        subtree = _new_node(type(self), name, [], 0 if is_folder else size)
+        subtree._folder_sizes = self._folder_sizes
+        if is_folder:
+            subtree._pending = path
+            self._folder_sizes.request(subtree)
+        return subtree
+
+
+class _FolderSizes:
+    """The total size of the files under the folders of a lazy
+    FileSystemTree that have not been loaded yet, added up by a background
+    thread.
+
+    Each folder is queued by the thread that owns the tree, and listed with
+    everything under it by the background thread, which is started when a
+    folder is queued and ends when none are left. The sizes it adds up are
+    only given to the folders by apply, on the thread that owns the tree, so
+    the background thread never touches the tree.
+
+    === Public Attributes ===
+    notify:
+        The function called by the background thread each time it adds up
+        the size of a folder, or None.
+
+    === Private Attributes ===
+    _workers:
+        The number of workers that list the folders under a queued folder,
+        as in FileSystemTree.__init__.
+    _use_processes:
+        Whether those workers are processes rather than threads.
+    _known:
+        The total size of the files under each folder added up so far and
+        applied, keyed by its path.
+    _waiting:
+        The unloaded folders of the tree still waiting for their size, keyed
+        by their path.
+    _lock:
+        The lock that guards _queued, _wanted and _thread.
+    _queued:
+        The paths of the folders still to be added up, in the order they were
+        queued in.
+    _wanted:
+        The paths in _queued whose folders are still waiting for their size;
+        the others are skipped.
+    _thread:
+        The background thread, or None if it is not running.
+    _results:
+        The sizes added up by the background thread and not applied yet,
+        keyed by path, one dictionary per queued folder.
+    """
+    notify: Optional[Callable[[], None]]
+    _workers: int
+    _use_processes: bool
+    _known: Dict[str, int]
+    _waiting: Dict[str, FileSystemTree]
+    _lock: threading.Lock
+    _queued: Deque[str]
+    _wanted: Set[str]
+    _thread: Optional[threading.Thread]
+    _results: queue.Queue
+
+    def __init__(self, workers: int, use_processes: bool) -> None:
+        """Initialize new folder sizes, none of them known yet, that are
+        added up by listing folders with <workers> and <use_processes>.
+        """
+        self.notify = None
+        self._workers = workers
+        self._use_processes = use_processes
+        self._known = {}
+        self._waiting = {}
+        self._lock = threading.Lock()
+        self._queued = deque()
+        self._wanted = set()
+        self._thread = None
+        self._results = queue.Queue()
+
+    def request(self, folder: FileSystemTree) -> None:
+        """Give the unloaded <folder> its size, if it is known, or queue it
+        to be added up in the background otherwise.
+
+        Precondition: <folder> is not part of a tree yet.
+        """
+        path = folder._pending
+        if path in self._known:
+            folder.data_size = self._known[path]
+            return
+        self._waiting[path] = folder
+        with self._lock:
+            self._queued.append(path)
+            self._wanted.add(path)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._add_up,
+                                                daemon=True)
+                self._thread.start()
+
+    def forget(self, path: str) -> None:
+        """Stop waiting for the size of the folder at <path>, because it was
+        loaded or given its size, and skip it if it is still queued.
+        """
+        self._waiting.pop(path, None)
+        with self._lock:
+            self._wanted.discard(path)
+
+    def drop_known(self, path: str) -> None:
+        """Forget the sizes added up for the folder at <path> and every
+        folder under it, because it was created again since.
+        """
+        prefix = os.path.join(path, '')
+        for known in [known for known in self._known
+                      if known == path or known.startswith(prefix)]:
+            del self._known[known]
+
+    def apply(self, block: bool) -> bool:
+        """Give the folders waiting for their size the sizes added up since
+        the last call, and return whether any was given, as described in
+        FileSystemTree.load_folder_sizes.
+        """
+        changed = False
+        while True:
+            if block and self._waiting:
+                sizes = self._results.get()
+            else:
+                try:
+                    sizes = self._results.get_nowait()
+                except queue.Empty:
+                    return changed
+            self._known.update(sizes)
+            for path, size in sizes.items():
+                folder = self._waiting.get(path)
+                if folder is not None:
+                    self.forget(path)
+                    folder._adjust_data_size(size - folder.data_size)
+                    changed = True
+
+    def _add_up(self) -> None:
+        """Add up the sizes of the queued folders, and of every folder under
+        them, until none are left.
+
+        This is run by the background thread.
+        """
+        while True:
+            with self._lock:
+                while self._queued and self._queued[0] not in self._wanted:
+                    self._queued.popleft()
+                if not self._queued:
+                    self._thread = None
+                    return
+                path = self._queued.popleft()
+            if self._workers > 0:
+                listings = _scan_parallel(path, self._workers,
+                                          self._use_processes,
+                                          _try_summarise_directory)
+            else:
+                listings = _scan(path, _try_summarise_directory)
+            self._results.put(_add_up_sizes(path, listings))
+            notify = self.notify
+            if notify is not None:
+                notify()
+
+
+class TreeListener:
+    """An object told about the changes made to the leaves of a TMTree, once
+    it is added to the tree with TMTree._add_listener.
+
+    A listener is told about the changes made by change_size, move,
+    _add_subtree, _remove_subtree and the loading of the folders of a lazy
+    FileSystemTree, which are also the changes made by a ChangeTracker. It
+    is only told about the changes to the tree it was added to, which are
+    found by walking up from the tree changed to its root.
+
+    This is an abstract class that should not be instantiated directly.
+    """
+
+    def leaf_resized(self, leaf: TMTree) -> None:
+        """Record that the data_size of <leaf>, a tree without subtrees,
+        changed.
+        """
+        raise NotImplementedError
+
+    def subtree_added(self, subtree: TMTree) -> None:
+        """Record that <subtree> and its descendents were added to the tree
+        that <subtree> is now part of.
+        """
+        raise NotImplementedError
+
+    def subtree_removed(self, subtree: TMTree) -> None:
+        """Record that <subtree> and its descendents are about to be removed
+        from the tree that <subtree> is part of, or, if <subtree> is a leaf,
+        that it is about to get subtrees of its own.
+        """
+        raise NotImplementedError
+
+
+def _list_directory(path: str) -> List[Tuple[str, bool, int]]:
+    """Return a (name, is_folder, size) tuple for each entry of the folder at
+    <path>, in the order os.scandir lists them.
+
+    The size of a folder entry is 0; the size of a file is taken from the
+    stat result cached on its DirEntry, so no extra system call is made for
+    entries whose type is already known.
+    """
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                entries.append((entry.name, True, 0))
+            else:
+                entries.append((entry.name, False, entry.stat().st_size))
+    return entries
+
+
+def _summarise_directory(path: str) -> List[Tuple[str, bool, int]]:
+    """Return a listing of the folder at <path> like _list_directory does,
+    but with all of its files replaced by one entry, with an empty name,
+    whose size is their total size.
+    """
+    entries = []
+    size = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                entries.append((entry.name, True, 0))
+            else:
+                size += entry.stat().st_size
+    entries.append(('', False, size))
+    return entries
+
+
+def _try_summarise_directory(path: str) -> List[Tuple[str, bool, int]]:
+    """Return the listing of the folder at <path> made by
+    _summarise_directory, or that of an empty folder if it cannot be listed,
+    e.g. because it was deleted or made unreadable.
+    """
+    try:
+        return _summarise_directory(path)
+    except OSError:
+        return [('', False, 0)]
+
+
+def _add_up_sizes(path: str,
+                  listings: Dict[str, List[Tuple[str, bool, int]]]) \
+        -> Dict[str, int]:
+    """Return the total size of the files under every folder under the
+    folder at <path> (including <path> itself), keyed by the folder's path,
+    from the folder <listings> produced by _scan or _scan_parallel.
+    """
+    order = [path]
+    i = 0
+    while i < len(order):
+        for name, is_folder, _ in listings[order[i]]:
+            if is_folder:
+                order.append(os.path.join(order[i], name))
+        i += 1
+
+    sizes = {}
+    for folder in reversed(order):
+        total = 0
+        for name, is_folder, size in listings[folder]:
+            if is_folder:
+                total += sizes[os.path.join(folder, name)]
+            else:
+                total += size
+        sizes[folder] = total
+    return sizes
+
+
+def _scan(path: str, lister: Callable[[str], List[Tuple[str, bool, int]]]
+          = _list_directory) -> Dict[str, List[Tuple[str, bool, int]]]:
+    """Return the listing of every folder under the folder at <path>
+    (including <path> itself) made by <lister>, keyed by the folder's path.
+
+    Folders are listed one at a time, using an explicit stack of the folders
+    still to visit.
+    """
+    listings = {}
+    stack = [path]
+    while stack:
+        folder = stack.pop()
+        listings[folder] = lister(folder)
+        for name, is_folder, _ in listings[folder]:
+            if is_folder:
+                stack.append(os.path.join(folder, name))
+    return listings
+
+
+def _scan_parallel(path: str, workers: int, use_processes: bool,
+                   lister: Callable[[str], List[Tuple[str, bool, int]]]
+                   = _list_directory) \
+        -> Dict[str, List[Tuple[str, bool, int]]]:
+    """Return the listing of every folder under the folder at <path>
+    (including <path> itself) made by <lister>, keyed by the folder's path.
+
+    Folders are listed by a pool of <workers> threads, or processes if
+    <use_processes>; each subfolder is submitted as soon as its parent's
+    listing comes back.
+    """
+    if use_processes:
+        pool = ProcessPoolExecutor(max_workers=workers)
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers)
+
+    listings = {}
+    with pool:
+        pending = {pool.submit(lister, path): path}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                folder = pending.pop(future)
+                listings[folder] = future.result()
+                for name, is_folder, _ in listings[folder]:
+                    if is_folder:
+                        subfolder = os.path.join(folder, name)
+                        pending[pool.submit(lister, subfolder)] = subfolder
+    return listings
+
+
+def _build_from_listings(root: FileSystemTree, path: str,
+                         listings: Dict[str, List[Tuple[str, bool, int]]]) \
+        -> None:
+    """Initialize <root> as the tree for the folder at <path>, using the
+    folder <listings> produced by _scan or _scan_parallel.
+
+    The folders are visited in reverse pre-order, so every subfolder is built
+    before the folder that contains it.
+    """
+    order = [path]
+    stack = [path]
+    while stack:
+        folder = stack.pop()
+        for name, is_folder, _ in listings[folder]:
+            if is_folder:
+                subfolder = os.path.join(folder, name)
+                order.append(subfolder)
+                stack.append(subfolder)
+
+    built = {}
+    for folder in reversed(order):
+        subtrees = []
+        for name, is_folder, size in listings[folder]:
+            if is_folder:
+                subtrees.append(built.pop(os.path.join(folder, name)))
+            else:
+                subtrees.append(_new_node(type(root), name, [], size))
+        if folder == path:
+            TMTree.__init__(root, os.path.basename(path), subtrees)
+        else:
+            built[folder] = _new_node(type(root), os.path.basename(folder),
+                                      subtrees)
+
+
+def _new_node(cls: type, name: str, subtrees: List[TMTree],
+              data_size: int = 0) -> TMTree:
+    """Return a new <cls> tree initialized by TMTree.__init__ with <name>,
+    <subtrees> and <data_size>, without running <cls>'s own initializer.
+    """
+    node = cls.__new__(cls)
+    TMTree.__init__(node, name, subtrees, data_size)
+    return node
+
+
+def _add_up_stale_sizes(trees: Set[TMTree]) -> None:
+    """Set the data_size of each of <trees> and of each of their ancestors
+    to the sum of the data_size of its subtrees, marking them as changed as
+    _adjust_data_size does. A tree left without subtrees is a leaf by now,
+    and keeps its own data_size, which the listeners were told of.
+
+    The trees are handled from the deepest up, one depth at a time, so that
+    each ancestor is added up once, after all of the trees under it.
+    """
+    depths = {}
+    levels = {}
+    for tree in trees:
+        # Find the depth of tree, from the nearest ancestor of known depth
+        path = []
+        now = tree
+        while now is not None and now not in depths:
+            path.append(now)
+            now = now._parent_tree
+        depth = -1 if now is None else depths[now]
+        for node in reversed(path):
+            depth += 1
+            depths[node] = depth
+        levels.setdefault(depths[tree], set()).add(tree)
+
+    for depth in range(max(levels, default=-1), -1, -1):
+        for tree in levels.get(depth, ()):
+            if tree._subtrees:
+                size = 0
+                for subtree in tree._subtrees:
+                    size += subtree.data_size
+                tree._add_to_size(size - tree.data_size)
+            if tree._parent_tree is not None:
+                levels.setdefault(depth - 1, set()).add(tree._parent_tree)
+
+
+def _contains(rect: Tuple[int, int, int, int], pos: Tuple[int, int]) -> bool:
+    """Return whether the pygame rectangle <rect>, edges included, contains
+    position <pos>.
+    """
+    x1, y1, width, height = rect
+    return x1 <= pos[0] <= x1 + width and y1 <= pos[1] <= y1 + height
+
+
+def _get_closer_to_origin(result: Optional[TMTree], leaf: TMTree) -> TMTree:
+    """Return whichever of <result>, the leaf found so far by
+    get_tree_at_position, and <leaf>, which was just found, it returns, as
+    the one closer to the origin. <result> is None if no leaf was found yet.
+    """
+    if result is None:
+        return leaf
+    curr_pos, next_pos = result.rect[:-2], leaf.rect[:-2]
+    # if next is on top or on the left return leaf.
+    if next_pos[1] < curr_pos[1] or next_pos[0] < curr_pos[0]:
+        return leaf
+    return result
+
+
+def _grow_buffer(buffer: array) -> None:
+    """Double the length of <buffer>, an array of records of
+    fill_rectangles, or make room for a first few records if it is short.
+    The new entries are 0.
+    """
+    buffer.frombytes(bytes(max(len(buffer), 64 * RECORD_LENGTH) *
+                           buffer.itemsize))
+
+
+def _get_path_checksum(path: str, checksum: int = 0) -> int:
+    """Return the CRC-32 checksum of <path>, continuing from the <checksum>
+    of the text before it, so that the checksum of a path can be computed
+    from its parent's.
+    """
+    return zlib.crc32(path.encode('utf-8', 'surrogateescape'), checksum)
+
+
+def _get_path_colour(checksum: int) -> Tuple[int, int, int]:
+    """Return the RGB colour of the tree whose path has CRC-32 <checksum>.
+    """
+    return checksum >> 16 & 255, checksum >> 8 & 255, checksum & 255
+
+
+def _index_rectangles(rect: Tuple[int, int, int, int],
+                      rects: List[Tuple[int, int, int, int]],
+                      sizes: List[int]) -> _HitIndex:
+    """Return a new index, in the format of TMTree._hit_index, of the
+    rectangles <rects> of the children of a tree whose rectangle is <rect>,
+    where <sizes> are the data sizes of those children.
+
+    The children with a size of 0 are not laid out, so they are left to be
+    checked one by one. If the other rectangles are not in order along the
+    direction the treemap algorithm lays them out in, e.g. because they were
+    laid out by SquarifiedLayout, or the tree was changed but not laid out
+    again, they are put in a grid instead.
+    """
+    along_x = rect[2] > rect[3]
+    starts, ends, laid_out, others = [], [], [], []
+    in_order = True
+    for i, (x, y, width, height) in enumerate(rects):
+        if sizes[i] == 0:
+            others.append(i)
+            continue
+        start, end = (x, x + width) if along_x else (y, y + height)
+        if laid_out and (start < starts[-1] or end < ends[-1]):
+            in_order = False
+        starts.append(start)
+        ends.append(end)
+        laid_out.append(i)
+    if in_order:
+        return along_x, starts, ends, laid_out, others, None
+    return along_x, [], [], [], others, _grid_rectangles(rects, laid_out)
+
+
+def _grid_rectangles(rects: List[Tuple[int, int, int, int]],
+                     laid_out: List[int]) \
+        -> Tuple[int, int, int, int, int, List[List[int]]]:
+    """Return a grid of the rectangles at the positions <laid_out> in
+    <rects>, in the format of the grid of TMTree._hit_index.
+
+    The area is divided in about as many cells as there are rectangles, so
+    that each cell is touched by a few of them. Each position is listed in
+    every cell its rectangle touches, edges included, in increasing order.
+
+    Precondition: <laid_out> is not empty, and in increasing order.
+    """
+    rects = [rects[i] for i in laid_out]
+    left = min(rect[0] for rect in rects)
+    top = min(rect[1] for rect in rects)
+    width = max(rect[0] + rect[2] for rect in rects) - left
+    height = max(rect[1] + rect[3] for rect in rects) - top
+    divisions = max(1, math.isqrt(len(laid_out)))
+    cells = [[] for _ in range(divisions * divisions)]
+    for i, (x, y, rect_width, rect_height) in zip(laid_out, rects):
+        first_column = _get_cell(x - left, width, divisions)
+        last_column = _get_cell(x + rect_width - left, width, divisions)
+        for row in range(_get_cell(y - top, height, divisions),
+                         _get_cell(y + rect_height - top, height,
+                                   divisions) + 1):
+            for column in range(first_column, last_column + 1):
+                cells[row * divisions + column].append(i)
+    return left, top, width, height, divisions, cells
+
+
+def _find_candidates(index: _HitIndex, pos: Tuple[int, int]) -> List[int]:
+    """Return the positions, in increasing order, of the rectangles in
+    <index> that may contain <pos>, or hold leaves whose rectangles do.
+    """
+    along_x, starts, ends, laid_out, others, grid = index
+    if grid is not None:
+        left, top, width, height, divisions, cells = grid
+        if left <= pos[0] <= left + width and top <= pos[1] <= top + height:
+            row = _get_cell(pos[1] - top, height, divisions)
+            column = _get_cell(pos[0] - left, width, divisions)
+            candidates = cells[row * divisions + column]
+        else:
+            candidates = []
+    else:
+        coordinate = pos[0] if along_x else pos[1]
+        candidates = laid_out[bisect_left(ends, coordinate):
+                              bisect_right(starts, coordinate)]
+    if others:
+        candidates = sorted(candidates + others)
+    return candidates
+
+
+def _get_cell(offset: int, length: int, divisions: int) -> int:
+    """Return the cell, out of <divisions> equal cells along a side of
+    <length>, that holds the point at <offset> from the start of that side.
+    A point on the edge between two cells is in the later one, and a point
+    at the very end in the last one.
+
+    Precondition: 0 <= offset <= length
+    """
+    if length == 0:
+        return 0
+    return min(offset * divisions // length, divisions - 1)
+
 
 if __name__ == '__main__':
     import python_ta
@@ -372,7 +1487,9 @@ if __name__ == '__main__':
 
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'math', 'random', 'os', '__future__'
+            'python_ta', 'typing', 'math', 'struct', 'zlib', 'os',
+            '__future__', 'queue', 'threading', 'collections',
+            'bisect', 'concurrent.futures', 'array', 'contextlib'
         ]
     })
 
@@ -17,10 +17,19 @@ concrete subclass, of course), rendering it to the user using pygame,
 and detecting user events like mouse clicks and key presses and responding
 to them.
 """
-from typing import Optional, Tuple
+import os
+import time
+from array import array
+from contextlib import nullcontext
+from itertools import islice
+from typing import ContextManager, List, Optional, Tuple
 import pygame
-from tm_trees import TMTree, FileSystemTree
+from tm_trees import RECORD_LENGTH, TMTree, FileSystemTree
 from papers import PaperTree
+from layouts import LayoutStrategy, SliceAndDiceLayout
+from snapshots import load_file_system_tree
+from change_tracker import ChangeTracker
+from instrumentation import Instrumentation, TimingStats
 
 
 # Screen dimensions and coordinates
@@ -34,21 +43,99 @@ TREEMAP_HEIGHT = HEIGHT - FONT_HEIGHT  # The height of the treemap display.
 # Font to use for the treemap program.
 FONT_FAMILY = 'Consolas'
 
+# Trees whose rectangle is less than this many pixels wide or high are drawn,
+# and selected, as a single block instead of being subdivided.
+MIN_RECT_PIXELS = 2
 
-def run_visualisation(tree: TMTree) -> None:
-    """Display an interactive graphical display of the given tree's treemap.
+# The event posted by a ChangeTracker when the tree's folder changed, or by a
+# lazy FileSystemTree when the size of one of its folders was added up.
+TREE_CHANGED = pygame.USEREVENT
+
+
+class FrameStats(TimingStats):
+    """Timing statistics for the frames handled by the event loop, each
+    recorded as one call.
+
+    The time of a frame is the time spent handling its events and rendering
+    it, not the time spent waiting for the events.
+    """
+
+    def __init__(self, window: int = 120) -> None:
+        """Initialize new statistics with no frames, which keep the times of
+        the last <window> frames.
+        """
+        TimingStats.__init__(self, window)
+
+    @property
+    def frames(self) -> int:
+        """The number of frames recorded.
+        """
+        return self.calls
+
+    def __str__(self) -> str:
+        """Return a one-line summary of these statistics, in milliseconds.
+        """
+        return '{} frames, mean {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms'.format(
+            self.frames, 1000 * self.mean_time(),
+            1000 * self.recent_percentile(99), 1000 * self.max_time)
+
+
+def run_visualisation(tree: TMTree, frame_rate: int = 0,
+                      min_pixels: int = MIN_RECT_PIXELS,
+                      layout: Optional[LayoutStrategy] = None,
+                      tracker: Optional[ChangeTracker] = None,
+                      instrumentation: Optional[Instrumentation] = None) \
+        -> FrameStats:
+    """Display an interactive graphical display of the given tree's treemap,
+    and return the timing statistics of its frames once the window is closed.
+
+    If <tracker> is given, it is started once the display is set up, and
+    stopped when the window is closed. If <tree> is a lazy FileSystemTree,
+    the sizes of its folders are loaded as they are added up in the
+    background. If <instrumentation> is given, its report is dumped when the
+    window is closed.
+
+    See event_loop for the meaning of <frame_rate>, <min_pixels>, <layout>,
+    <tracker> and <instrumentation>.
     """
+    if layout is None:
+        layout = SliceAndDiceLayout()
 
     # Setup pygame
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
 
-    # Render the initial display of the static treemap.
+    # Render the initial display of the static treemap, with the sizes of
+    # the folders of a lazy tree known so far
+    if isinstance(tree, FileSystemTree):
+        tree.notify_folder_sizes(_post_tree_changed)
+        tree.load_folder_sizes()
     render_display(screen, tree, None, None)
-    tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+    layout.layout(tree, (0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
 
     # Start an event loop to respond to events.
-    event_loop(screen, tree)
+    if tracker is not None:
+        tracker.start(_post_tree_changed)
+    try:
+        return event_loop(screen, tree, frame_rate, min_pixels, layout,
+                          tracker, instrumentation)
+    finally:
+        if tracker is not None:
+            tracker.stop()
+        if isinstance(tree, FileSystemTree):
+            tree.notify_folder_sizes(None)
+        if instrumentation is not None:
+            instrumentation.dump()
+
+
+def _post_tree_changed() -> None:
+    """Wake up the event loop to apply the changes seen by a ChangeTracker,
+    or the folder sizes added up for a lazy FileSystemTree.
+
+    This is called from the tracker's thread, or from the tree's background
+    thread.
+    """
+    pygame.event.post(pygame.event.Event(TREE_CHANGED))
 
 
 def render_display(screen: pygame.Surface, tree: Optional[TMTree],
@@ -58,29 +145,124 @@ def render_display(screen: pygame.Surface, tree: Optional[TMTree],
 
     Use the constants TREEMAP_HEIGHT and FONT_HEIGHT to divide the
     screen vertically into the treemap and text comments.
-    """
-    # First, clear the screen
-    pygame.draw.rect(screen, pygame.color.THECOLORS['black'],
-                     (0, 0, WIDTH, HEIGHT))
-
-    subscreen = screen.subsurface((0, 0, WIDTH, TREEMAP_HEIGHT))
-
-    # TODO: Uncomment this afer you have completed Task 2
-    for rect, colour in tree.get_rectangles():
-        # Note that the arguments are in the opposite order
-        pygame.draw.rect(subscreen, colour, rect)
 
-    # add the hover rectangle
-    if selected_node is not None:
-        pygame.draw.rect(subscreen, (255, 255, 255), selected_node.rect, 5)
-    if hover_node is not None:
-        pygame.draw.rect(subscreen, (255, 255, 255), hover_node.rect, 2)
-
-    # TODO: Uncomment this after you have completed Task 2
-    _render_text(screen, _get_display_text(selected_node))
-
-    # This must be called *after* all other pygame functions have run.
-    pygame.display.flip()
+    This repaints everything; the event loop uses a TreemapRenderer instead,
+    which only repaints what changed since the previous frame.
+    """
+    TreemapRenderer(screen).render(tree, selected_node, hover_node)
+
+
+class TreemapRenderer:
+    """A retained-mode renderer for the treemap display.
+
+    The treemap is drawn onto an offscreen surface, which is kept until the
+    layout or expansion state of the tree changes. The selection and hover
+    outlines and the text are drawn over it, and only the areas of the screen
+    that changed since the previous frame are pushed to the display.
+
+    === Private Attributes ===
+    _screen:
+        The screen to render to.
+    _treemap:
+        The offscreen surface holding the treemap, without any outlines.
+    _stale:
+        Whether _treemap must be drawn again from the tree.
+    _outlines:
+        The rectangle and line width of each outline on the screen.
+    _text:
+        The text on the screen, or None if nothing was rendered yet.
+    _min_pixels:
+        The size below which a tree's rectangle is drawn as a single block.
+    _records:
+        The buffer the rectangles of the tree are written to by
+        TMTree.fill_rectangles, reused every time _treemap is drawn.
+    """
+    _screen: pygame.Surface
+    _treemap: pygame.Surface
+    _stale: bool
+    _outlines: List[Tuple[Tuple[int, int, int, int], int]]
+    _text: Optional[str]
+    _min_pixels: int
+    _records: array
+
+    def __init__(self, screen: pygame.Surface, min_pixels: int = 0) -> None:
+        """Initialize a new renderer for <screen>, with nothing rendered yet.
+
+        Trees whose rectangle is less than <min_pixels> wide or high are drawn
+        as a single block, as in TMTree.get_rectangles.
+        """
+        self._screen = screen
+        self._min_pixels = min_pixels
+        self._treemap = pygame.Surface((WIDTH, TREEMAP_HEIGHT))
+        self._stale = True
+        self._outlines = []
+        self._text = None
+        self._records = array('i')
+
+    def invalidate(self) -> None:
+        """Record that the layout or expansion state of the tree changed, so
+        that the whole treemap is drawn again on the next frame.
+        """
+        self._stale = True
+
+    def render(self, tree: TMTree, selected_node: Optional[TMTree],
+               hover_node: Optional[TMTree]) -> None:
+        """Render the treemap of <tree> and the text display to the screen,
+        with outlines around <selected_node> and <hover_node>.
+        """
+        outlines = []
+        if selected_node is not None:
+            outlines.append((selected_node.rect, 5))
+        if hover_node is not None:
+            outlines.append((hover_node.rect, 2))
+        text = _get_display_text(selected_node)
+
+        if self._stale:
+            self._treemap.fill(pygame.color.THECOLORS['black'])
+            count = tree.fill_rectangles(self._records, self._min_pixels)
+            # Read the buffer RECORD_LENGTH integers at a time
+            records = [iter(self._records)] * RECORD_LENGTH
+            for x, y, width, height, red, green, blue in islice(zip(*records),
+                                                                count):
+                self._treemap.fill((red, green, blue), (x, y, width, height))
+            self._stale = False
+            self._screen.blit(self._treemap, ORIGIN)
+            changed = [pygame.Rect(0, 0, WIDTH, TREEMAP_HEIGHT)]
+            self._text = None
+        elif outlines != self._outlines:
+            # Erase the old outlines before drawing the new ones.
+            changed = [_get_outline_area(rect, width)
+                       for rect, width in self._outlines + outlines]
+            for area in changed:
+                self._screen.blit(self._treemap, area, area)
+        else:
+            changed = []
+
+        if changed:
+            subscreen = self._screen.subsurface((0, 0, WIDTH, TREEMAP_HEIGHT))
+            for rect, width in outlines:
+                pygame.draw.rect(subscreen, (255, 255, 255), rect, width)
+            self._outlines = outlines
+
+        if text != self._text:
+            text_area = pygame.Rect(0, TREEMAP_HEIGHT, WIDTH, FONT_HEIGHT)
+            pygame.draw.rect(self._screen, pygame.color.THECOLORS['black'],
+                             text_area)
+            _render_text(self._screen, text)
+            changed.append(text_area)
+            self._text = text
+
+        if changed:
+            pygame.display.update(changed)
+
+
+def _get_outline_area(rect: Tuple[int, int, int, int],
+                      width: int) -> pygame.Rect:
+    """Return the area of the treemap covered by an outline of <rect> with
+    lines <width> pixels wide.
+    """
+    return pygame.Rect(rect).inflate(2 * width, 2 * width).clip(
+        pygame.Rect(0, 0, WIDTH, TREEMAP_HEIGHT))
 
 
 def _render_text(screen: pygame.Surface, text: str) -> None:
@@ -95,88 +277,206 @@ def _render_text(screen: pygame.Surface, text: str) -> None:
     screen.blit(text_surface, text_pos)
 
 
-def event_loop(screen: pygame.Surface, tree: TMTree) -> None:
+def event_loop(screen: pygame.Surface, tree: TMTree, frame_rate: int = 0,
+               min_pixels: int = MIN_RECT_PIXELS,
+               layout: Optional[LayoutStrategy] = None,
+               tracker: Optional[ChangeTracker] = None,
+               instrumentation: Optional[Instrumentation] = None) \
+        -> FrameStats:
     """Respond to events (mouse clicks, key presses) and update the display.
 
     Note that the event loop is an *infinite loop*: it continually waits for
     the next event, determines the event's type, and then updates the state
     of the visualisation or the tree itself, updating the display if necessary.
-    This loop ends only when the user closes the window.
+    This loop ends only when the user closes the window, and then returns the
+    timing statistics of the frames it rendered.
+
+    If <frame_rate> is 0, sleep until the next event arrives; otherwise, wake
+    up at most <frame_rate> times per second. Either way, all of the events
+    that are pending when the loop wakes up are handled as one frame: the
+    hovered node is only looked up again after the mouse moves or the tree
+    changes, the tree is laid out at most once, and the display is rendered
+    once.
+
+    The treemap is only drawn again after a change to the tree's layout or
+    expansion state; otherwise, only the outlines and text are updated.
+    Trees whose rectangle is less than <min_pixels> wide or high are drawn,
+    hovered and selected as a single block.
+
+    The tree is laid out with <layout>, or with the slice-and-dice layout of
+    TMTree.update_rectangles if it is None.
+
+    If <tracker> is given, the changes it has seen in the tree's folder are
+    applied to the tree at the end of the frame in which it posts a
+    TREE_CHANGED event. So are the folder sizes added up in the background
+    for a lazy FileSystemTree.
+
+    If <instrumentation> is given, the time of each phase of a frame is
+    recorded in it: handling the events, loading folder sizes, applying the
+    tracker's changes, laying out the tree, looking up the hovered node and
+    rendering. Pressing 'i' dumps its report.
     """
+    if layout is None:
+        layout = SliceAndDiceLayout()
     selected_node = None
+    renderer = TreemapRenderer(screen, min_pixels)
+    stats = FrameStats()
+    clock = pygame.time.Clock()
+    mouse_pos = pygame.mouse.get_pos()
+    hover_node = None
+    hover_stale = True
 
     while True:
-        # Wait for an event
-        event = pygame.event.poll()
-        if event.type == pygame.QUIT:
-            return
-
-        # get the hover position and the corresponding node
-        hover_node = tree.get_tree_at_position(pygame.mouse.get_pos())
-
-        if event.type == pygame.MOUSEBUTTONUP:
-            selected_node = \
-                _handle_click(event.button, event.pos, tree, selected_node)
-
-        elif event.type == pygame.KEYUP and selected_node is not None:
-            if event.key == pygame.K_UP:
-
-                # TODO: Uncomment once you have completed Task 4
-                selected_node.change_size(0.01)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
-
-            elif event.key == pygame.K_DOWN:
-
-                # TODO: Uncomment once you have completed Task 4
-                selected_node.change_size(-0.01)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
-
-            elif event.key == pygame.K_m:
-
-                # TODO: Uncomment once you have completed Task 4
-                selected_node.move(hover_node)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
-
-            elif event.key == pygame.K_e:
-
-                # TODO: Uncomment once you have completed Task 5
-                selected_node.expand()
-
-            elif event.key == pygame.K_a:
-
-                # TODO: Uncomment once you have completed Task 5
-                selected_node.expand_all()
+        # Wait for the events of the next frame
+        if frame_rate > 0:
+            clock.tick(frame_rate)
+            events = pygame.event.get()
+        else:
+            events = [pygame.event.wait()] + pygame.event.get()
+        start = time.perf_counter()
+        resized = False
+        tree_changed = False
+
+        for event in events:
+            if event.type == pygame.QUIT:
+                return stats
+
+            if resized and (event.type == pygame.MOUSEBUTTONUP or
+                            event.type == pygame.KEYUP and
+                            event.key == pygame.K_m):
+                # clicks and moves must see the edits made earlier in this
+                # frame
+                layout.layout(tree, (0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+                renderer.invalidate()
+                resized = False
+
+            if event.type == TREE_CHANGED:
+                tree_changed = True
+
+            elif event.type == pygame.MOUSEMOTION:
+                # the hovered node is only looked up when it is needed
+                mouse_pos = event.pos
+                hover_stale = True
+
+            elif event.type == pygame.MOUSEBUTTONUP:
+                selected_node = _handle_click(event.button, event.pos, tree,
+                                              selected_node, min_pixels)
+
+            elif event.type == pygame.KEYUP and event.key == pygame.K_i and \
+                    instrumentation is not None:
+                instrumentation.dump()
+
+            elif event.type == pygame.KEYUP and selected_node is not None:
+                if event.key == pygame.K_UP:
+                    selected_node.change_size(0.01)
+                    resized = True
+
+                elif event.key == pygame.K_DOWN:
+                    selected_node.change_size(-0.01)
+                    resized = True
+
+                elif event.key == pygame.K_m:
+                    # the tree was laid out above if it had been edited
+                    if hover_stale:
+                        hover_node = tree.get_tree_at_position(mouse_pos,
+                                                               min_pixels)
+                    if hover_node is not None:
+                        selected_node.move(hover_node)
+                        resized = True
+
+                elif event.key == pygame.K_e:
+                    # lazily loaded trees lay out their new subtrees
+                    selected_node.expand()
+                    resized = True
+
+                elif event.key == pygame.K_a:
+                    selected_node.expand_all()
+                    resized = True
+
+                elif event.key == pygame.K_c:
+                    selected_node.collapse()
+                    renderer.invalidate()
+
+                elif event.key == pygame.K_x:
+                    selected_node.collapse_all()
+                    renderer.invalidate()
+
+                # the displayed-tree may have changed under the mouse
+                hover_stale = True
+
+        if instrumentation is not None:
+            instrumentation.record('event_loop.events',
+                                   time.perf_counter() - start)
+
+        # Give the folders of a lazy tree the sizes added up since last time
+        if tree_changed and isinstance(tree, FileSystemTree):
+            with _phase(instrumentation, 'folder sizes'):
+                loaded = tree.load_folder_sizes()
+            if loaded:
+                resized = True
+                hover_stale = True
+
+        # Apply the changes made on disk, which may remove the selected node
+        if tree_changed and tracker is not None:
+            with _phase(instrumentation, 'tracker'):
+                applied = tracker.apply_pending()
+            if applied:
+                resized = True
+                hover_stale = True
+                if selected_node is not None and \
+                        not _is_in_tree(selected_node, tree):
+                    selected_node = None
+
+        # Lay out the tree once for all of the edits in this frame
+        if resized:
+            with _phase(instrumentation, 'layout'):
+                layout.layout(tree, (0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+            renderer.invalidate()
+        if hover_stale:
+            with _phase(instrumentation, 'hit test'):
+                hover_node = tree.get_tree_at_position(mouse_pos, min_pixels)
+            hover_stale = False
 
-            elif event.key == pygame.K_c:
+        # Update display
+        with _phase(instrumentation, 'render'):
+            renderer.render(tree, selected_node, hover_node)
+        stats.record(time.perf_counter() - start)
 
-                # TODO: Uncomment once you have completed Task 5
-                selected_node.collapse()
 
-            elif event.key == pygame.K_x:
+def _phase(instrumentation: Optional[Instrumentation],
+           name: str) -> ContextManager[None]:
+    """Return a context manager that records the time of its body as the
+    event loop phase <name> in <instrumentation>, or that does nothing if
+    <instrumentation> is None.
+    """
+    if instrumentation is None:
+        return nullcontext()
+    return instrumentation.phase(name)
 
-                # TODO: Uncomment once you have completed Task 5
-                selected_node.collapse_all()
 
-        # Update display
-        render_display(screen, tree, selected_node, hover_node)
+def _is_in_tree(node: TMTree, tree: TMTree) -> bool:
+    """Return whether <node> is <tree> or one of its descendents.
+    """
+    while node is not None and node is not tree:
+        node = node._parent_tree
+    return node is tree
 
 
 def _handle_click(button: int, pos: Tuple[int, int], tree: TMTree,
-                  old_selected_leaf: Optional[TMTree]) -> Optional[TMTree]:
+                  old_selected_leaf: Optional[TMTree],
+                  min_pixels: int = 0) -> Optional[TMTree]:
     """Return the new selection after handling the mouse event.
 
     We need to use old_selected_leaf to handle the case when the selected
-    leaf is left-clicked again.
+    leaf is left-clicked again. Trees whose rectangle is less than
+    <min_pixels> wide or high are selected as a single block.
     """
     # TODO: Delete the line below after completing Task 3
 
 
     # left mouse click
     if button == 1:
-        selected_leaf = tree.get_tree_at_position(pos)
+        selected_leaf = tree.get_tree_at_position(pos, min_pixels)
         if selected_leaf is None:
             return old_selected_leaf
         elif selected_leaf is old_selected_leaf:
@@ -197,22 +497,41 @@ def _get_display_text(leaf: Optional[TMTree]) -> str:
         return leaf.get_path_string() + '  ({})'.format(leaf.data_size)
 
 
-def run_treemap_file_system(path: str) -> None:
+def run_treemap_file_system(path: str,
+                            snapshot_path: Optional[str] = None,
+                            track_changes: bool = False,
+                            lazy: bool = False) -> None:
     """Run a treemap visualisation for the given path's file structure.
 
+    If <snapshot_path> is given, only the folders that changed since the
+    snapshot saved there are listed, and a new snapshot is saved there.
+    Otherwise, if <lazy>, the folders are only loaded as they are expanded.
+    If <track_changes>, the treemap is kept up to date with the changes made
+    to the folder while it is displayed.
+
     Precondition: <path> is a valid path to a file or folder.
     """
-    file_tree = FileSystemTree(path)
-    run_visualisation(file_tree)
+    if snapshot_path is None:
+        file_tree = FileSystemTree(path, lazy=lazy)
+    else:
+        file_tree = load_file_system_tree(path, snapshot_path)
+    tracker = None
+    if track_changes and os.path.isdir(path):
+        tracker = ChangeTracker(file_tree, path)
+    run_visualisation(file_tree, tracker=tracker)
 
 
-def run_treemap_papers() -> None:
+def run_treemap_papers(cache_file: Optional[str] = None) -> None:
     """Run a treemap visualization for CS Education research papers data.
 
+    If <cache_file> is given, the papers are read from the binary cache of
+    the dataset at that path, which is made on the first run.
+
     You can try changing the value of the named argument by_year, but the
     others should stay the same.
     """
-    paper_tree = PaperTree('CS1', [], all_papers=True, by_year=False)
+    paper_tree = PaperTree('CS1', [], all_papers=True, by_year=False,
+                           cache_file=cache_file)
     run_visualisation(paper_tree)
 
 
@@ -220,7 +539,9 @@ if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'pygame', 'tm_trees', 'papers'
+            'python_ta', 'typing', 'pygame', 'tm_trees', 'papers', 'layouts',
+            'snapshots', 'change_tracker', 'instrumentation', 'os', 'time',
+            'array', 'contextlib', 'itertools'
         ],
         'generated-members': 'pygame.*'
     })